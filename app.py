@@ -1,12 +1,27 @@
 import streamlit as st
 import json
+import time
 from mongodb_service import MongoDBService
 from perplexity_service import PerplexityService
-from config import APP_TITLE, APP_DESCRIPTION, APP_KEYWORDS, APP_AUTHOR
+import telemetry
+from warmup import get_warmup_manager
+from conversation import Conversation
+from config import (
+    APP_TITLE, APP_DESCRIPTION, APP_KEYWORDS, APP_AUTHOR, FORMAT_STREAMING, RESULT_PAGE_SIZE, EXAMPLE_QUESTIONS
+)
 
 
-def load_schema_context():
-    """Charge le contexte du schéma MongoDB depuis CLAUDE.md"""
+def load_schema_context(mongodb_service=None):
+    """
+    Charge le contexte du schéma MongoDB
+
+    Résumé déduit de la collection (mis en cache sur disque) en priorité,
+    section schéma de CLAUDE.md à défaut.
+    """
+    if mongodb_service is not None:
+        schema_context = mongodb_service.get_schema_context()
+        if schema_context:
+            return schema_context
     try:
         with open("CLAUDE.md", "r", encoding="utf-8") as f:
             content = f.read()
@@ -28,8 +43,19 @@ def init_services():
     if 'perplexity_service' not in st.session_state:
         st.session_state.perplexity_service = PerplexityService()
     
+    # Endpoint /metrics (Prometheus), démarré une fois par processus si TELEMETRY_METRICS_PORT est défini
+    telemetry.start_metrics_server()
+    
     if 'schema_context' not in st.session_state:
-        st.session_state.schema_context = load_schema_context()
+        st.session_state.schema_context = load_schema_context(st.session_state.mongodb_service)
+    
+    # Réponses précalculées des exemples, partagées par toutes les sessions du processus
+    if 'warmup' not in st.session_state:
+        st.session_state.warmup = get_warmup_manager(st.session_state.schema_context)
+    
+    # Dernière requête de la session, modifiée par les questions de suivi
+    if 'conversation' not in st.session_state:
+        st.session_state.conversation = Conversation()
 
 
 def display_connection_status():
@@ -41,7 +67,9 @@ def display_connection_status():
             st.success("✅ MongoDB connecté")
             stats = st.session_state.mongodb_service.get_collection_stats()
             if stats and 'total_documents' in stats:
-                st.info(f"📊 {stats.get('total_documents', 0)} films dans la base")
+                st.info(f"📊 ~{stats.get('total_documents', 0)} films dans la base")
+                if stats.get('stale'):
+                    st.caption(f"Statistiques datant de {stats.get('age_seconds', 0) / 60:.0f} min, actualisation en cours")
         else:
             st.error("❌ Erreur de connexion MongoDB")
     
@@ -54,16 +82,69 @@ def display_connection_status():
 
 def handle_user_question(user_question: str):
     """Traite la question de l'utilisateur"""
+    trace = telemetry.start_trace("question")
+    try:
+        details = answer_question(user_question)
+    finally:
+        telemetry.finish_trace(trace)
+    if details is not None:
+        display_timings(details, trace)
+
+
+def display_timings(details, trace):
+    """Temps passé dans chaque étape de la question, dans les détails de l'analyse"""
+    breakdown = " · ".join(f"{name} {duration_ms:.0f} ms" for name, duration_ms in trace.breakdown())
+    with details:
+        st.write("**Temps par étape:**")
+        st.caption(f"{breakdown} — total {trace.duration_ms:.0f} ms")
+        # Seuil significatif à partir de 100 questions récentes seulement
+        p99 = telemetry.recent_percentile(99, min_samples=100)
+        if p99 is not None and trace.duration_ms >= p99:
+            st.caption(f"⚠️ Parmi le 1 % des questions les plus lentes (p99 récent : {p99:.0f} ms)")
+
+
+def answer_question(user_question: str):
+    """
+    Génère, exécute et formate la requête d'une question
+
+    Returns:
+        L'expander des détails de l'analyse
+    """
+    st.session_state.pop("last_answer", None)
+    st.session_state.pop("last_query", None)
+    
+    # « et pour 2016 ? » : la requête précédente est modifiée plutôt que retraduite
+    conversation = st.session_state.conversation
+    follow_up = conversation.follow_up(user_question)
+    if follow_up is None:
+        details = answer_from_warmup(user_question)
+        if details is not None:
+            return details
     
     # Étape 1: Générer la requête MongoDB via Perplexity
     with st.spinner("🧠 Analyse de votre question..."):
-        query_info = st.session_state.perplexity_service.generate_mongodb_query(
-            user_question, 
-            st.session_state.schema_context
-        )
+        if follow_up is None:
+            query_info = st.session_state.perplexity_service.generate_mongodb_query(
+                user_question, 
+                st.session_state.schema_context
+            )
+        elif follow_up.query_info is not None:
+            query_info = follow_up.query_info
+        else:
+            query_info = st.session_state.perplexity_service.generate_follow_up_query(
+                follow_up.text,
+                follow_up.previous.question,
+                follow_up.previous.query_info,
+                st.session_state.schema_context
+            )
+    # Question complète pour le formatage de la réponse
+    question = follow_up.question if follow_up else user_question
     
     # Afficher les détails de la requête générée
-    with st.expander("🔍 Détails de l'analyse"):
+    details = st.expander("🔍 Détails de l'analyse")
+    with details:
+        if follow_up:
+            st.write("**Question de suivi:**", follow_up.describe())
         st.write("**Type de requête:**", query_info.get("query_type", "inconnu"))
         st.write("**Explication:**", query_info.get("explanation", "Non disponible"))
         st.code(json.dumps(query_info.get("mongodb_query", {}), indent=2), language="json")
@@ -71,7 +152,7 @@ def handle_user_question(user_question: str):
     # Étape 2: Exécuter la requête MongoDB
     if query_info.get("query_type") == "error":
         st.error(f"Erreur lors de l'analyse: {query_info.get('explanation')}")
-        return
+        return details
     
     with st.spinner("📊 Exécution de la requête MongoDB..."):
         try:
@@ -82,32 +163,121 @@ def handle_user_question(user_question: str):
         
         except Exception as e:
             st.error(f"Erreur lors de l'exécution de la requête: {str(e)}")
-            return
+            return details
+    
+    conversation.record(question, query_info)
+    
+    route = st.session_state.mongodb_service.last_route
+    if route:
+        with details:
+            st.write(f"**Servi par le cumul** `{route.collection}`")
+    elif st.session_state.mongodb_service.last_engine == "columnar":
+        with details:
+            st.write("**Calculé en mémoire** (moteur colonnaire)")
+
+    optimization = st.session_state.mongodb_service.last_optimization
+    if optimization and optimization.rewritten:
+        with details:
+            st.write("**Pipeline optimisé:**")
+            st.code(json.dumps(optimization.pipeline, indent=2), language="json")
+            for change in optimization.changes:
+                st.caption(f"• {change}")
+            for saving in optimization.estimated_savings:
+                st.caption(f"↳ {saving}")
     
     # Étape 3: Formater la réponse via Perplexity
-    with st.spinner("✨ Formatage de la réponse..."):
-        formatted_response = st.session_state.perplexity_service.format_results(
-            results, 
-            user_question
+    if FORMAT_STREAMING:
+        # Affichage progressif : la réponse complète est retournée par write_stream
+        st.markdown("### 🎬 Réponse")
+        formatted_response = st.write_stream(
+            st.session_state.perplexity_service.format_results_stream(results, question)
         )
+    else:
+        with st.spinner("✨ Formatage de la réponse..."):
+            formatted_response = st.session_state.perplexity_service.format_results(
+                results, 
+                question
+            )
+        
+        # Afficher la réponse
+        st.markdown("### 🎬 Réponse")
+        st.markdown(formatted_response)
+    
+    compaction = st.session_state.perplexity_service.last_compaction
+    if compaction:
+        with details:
+            st.caption(
+                f"Prompt de formatage ({compaction.mode}) : ~{compaction.tokens} tokens "
+                f"au lieu de ~{compaction.baseline_tokens} ({compaction.savings_percent:.0f} % économisés)"
+            )
+    
+    # Traduction validée par une réponse servie sans erreur : exemple pour les questions proches
+    if follow_up is None and not st.session_state.perplexity_service.last_format_error:
+        st.session_state.perplexity_service.record_success(user_question, query_info, results)
+    
+    # Conservés pour les affichages suivants (données brutes chargées page par page)
+    st.session_state.last_answer = formatted_response
+    st.session_state.last_query = {"query_type": query_type, "mongodb_query": mongodb_query}
+    st.session_state.raw_pages = []
+    return details
+
+
+def answer_from_warmup(user_question: str):
+    """
+    Affiche la réponse précalculée de la question si elle existe
+    
+    Returns:
+        L'expander des détails de l'analyse, ou None si rien n'est précalculé
+    """
+    warmup = st.session_state.get("warmup")
+    answer = warmup.get(user_question) if warmup else None
+    telemetry.record_cache("warmup", answer is not None)
+    if answer is None:
+        return None
+    
+    query_info = answer["query_info"]
+    details = st.expander("🔍 Détails de l'analyse")
+    with details:
+        st.write("**Type de requête:**", query_info.get("query_type", "inconnu"))
+        st.write("**Explication:**", query_info.get("explanation", "Non disponible"))
+        st.code(json.dumps(query_info.get("mongodb_query", {}), indent=2), language="json")
+        st.caption(f"Réponse précalculée il y a {(time.time() - answer['computed_at']) / 60:.0f} min")
     
-    # Afficher la réponse
     st.markdown("### 🎬 Réponse")
-    st.markdown(formatted_response)
-    
-    # Afficher les données brutes si demandé
-    if st.checkbox("Voir les données brutes"):
-        # Détecter si l'utilisateur veut toutes les données
-        needs_all_data = any(keyword in user_question.lower() for keyword in [
-            "pour toutes les années", "toutes les", "chaque année", "par année", 
-            "pour chaque", "détaillé", "complet", "tous les résultats"
-        ])
-        
-        if needs_all_data or len(results) <= 10:
-            st.json(results)
-        else:
-            st.json(results[:5])
-            st.info(f"Affichage des 5 premiers résultats sur {len(results)} au total")
+    st.markdown(answer["formatted_response"])
+    
+    st.session_state.conversation.record(user_question, query_info)
+    st.session_state.last_answer = answer["formatted_response"]
+    st.session_state.last_query = {
+        "query_type": query_info.get("query_type", "find"),
+        "mongodb_query": query_info.get("mongodb_query", {}),
+    }
+    st.session_state.raw_pages = []
+    return details
+
+
+def display_raw_data():
+    """Affiche les données brutes de la dernière question, page par page à la demande"""
+    last_query = st.session_state.get("last_query")
+    if not last_query or not st.checkbox("Voir les données brutes"):
+        return
+    
+    pages = st.session_state.setdefault("raw_pages", [])
+    if not pages:
+        pages.append(st.session_state.mongodb_service.fetch_page(
+            last_query["query_type"], last_query["mongodb_query"]
+        ))
+    
+    documents = [document for page in pages for document in page.documents]
+    st.json(documents)
+    
+    if pages[-1].has_more:
+        st.info(f"Affichage des {len(documents)} premiers résultats")
+        if st.button(f"⬇️ Charger {RESULT_PAGE_SIZE} résultats de plus"):
+            pages.append(st.session_state.mongodb_service.fetch_page(
+                last_query["query_type"], last_query["mongodb_query"], page_token=pages[-1].next_token
+            ))
+            st.rerun()
 
 
 def main():
@@ -195,16 +365,7 @@ def main():
     
     # Exemples de questions
     st.markdown("**Exemples de questions:**")
-    example_questions = [
-        "Quelle est la note moyenne des films parus en 2015 ?",
-        "Quels sont les 5 réalisateurs qui ont produit le plus de films entre 2000 et 2015 ?",
-        "Combien de films sont sortis entre 2012 et 2014 ?",
-        "Quel est le premier film paru en 2016 et qui l'a réalisé ?",
-        "Peux-tu me montrer le contenu d'un document de la collection ?",
-        "Quel est le genre le plus populaire par décennie entre 1970 et 2010 ?"
-    ]
-    
-    for i, example in enumerate(example_questions):
+    for i, example in enumerate(EXAMPLE_QUESTIONS):
         if st.button(f"📝 {example}", key=f"example_{i}"):
             st.session_state.user_input = example
     
@@ -216,20 +377,59 @@ def main():
     )
     
     # Bouton d'envoi
-    if st.button("🚀 Analyser", type="primary") and user_question:
+    submitted = st.button("🚀 Analyser", type="primary")
+    
+    # Calcul anticipé des questions connues qui prolongent le texte saisi, seulement
+    # sur les reruns sans envoi : sinon il doublerait la réponse en cours au premier plan
+    if st.session_state.get("warmup") and user_question and not submitted:
+        st.session_state.warmup.prefetch(user_question)
+    
+    if submitted and user_question:
         handle_user_question(user_question)
+    elif st.session_state.get("last_answer"):
+        st.markdown("### 🎬 Réponse")
+        st.markdown(st.session_state.last_answer)
+    
+    display_raw_data()
     
     # Sidebar avec informations
     with st.sidebar:
         st.markdown("### 📋 Informations")
         
         if st.button("🔄 Actualiser les stats"):
-            stats = st.session_state.mongodb_service.get_collection_stats()
+            stats = st.session_state.mongodb_service.get_collection_stats(force_refresh=True)
             if stats:
-                st.metric("Films totaux", stats.get('total_documents', 0))
+                st.metric("Films totaux (estimation)", stats.get('total_documents', 0))
                 st.metric("Taille (MB)", stats.get('size_mb', 0))
                 st.metric("Index", stats.get('indexes', 0))
         
+        with st.expander("🔌 Pool de connexions MongoDB"):
+            pool_stats = st.session_state.mongodb_service.get_pool_stats()
+            if pool_stats:
+                st.metric("Connexions ouvertes", pool_stats.get('open_connections', 0))
+                st.metric("Connexions empruntées", pool_stats.get('checked_out', 0))
+                st.metric("Attente moyenne (ms)", pool_stats.get('avg_wait_ms', 0))
+                st.caption(
+                    f"Attente max: {pool_stats.get('max_wait_ms', 0)} ms · "
+                    f"Échecs: {pool_stats.get('failed_checkouts', 0)} · "
+                    f"Taille max: {pool_stats.get('max_pool_size', 0)}"
+                )
+            else:
+                st.info("Pool non initialisé")
+        
+        limiter = st.session_state.perplexity_service.transport.limiter
+        if limiter:
+            with st.expander("🚦 File d'attente API Perplexity"):
+                limiter_stats = limiter.stats()
+                st.metric("Appels en attente", sum(limiter_stats["queue_depth"].values()))
+                st.metric("Appels simultanés autorisés", limiter_stats["concurrency_limit"])
+                st.metric("Attente moyenne (ms)", limiter_stats["wait_ms"]["interactive"]["avg"])
+                st.caption(
+                    f"En cours: {limiter_stats['in_flight']} · "
+                    f"File: {' / '.join(f'{name} {count}' for name, count in limiter_stats['queue_depth'].items())} · "
+                    f"429 reçus: {limiter_stats['throttled']}"
+                )
+        
         st.markdown("### 🛠 Fonctionnalités")
         st.markdown("""
         - 📊 **Analyses statistiques**
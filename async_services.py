@@ -0,0 +1,350 @@
+import asyncio
+import contextvars
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+from config import (
+    MONGODB_URI, MONGODB_DATABASE, MONGODB_COLLECTION, MONGODB_MAX_POOL_SIZE,
+    MONGODB_MIN_POOL_SIZE, MONGODB_MAX_IDLE_TIME_MS, MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+    PERPLEXITY_CONNECT_TIMEOUT, PERPLEXITY_READ_TIMEOUT, PERPLEXITY_MAX_RETRIES,
+    PERPLEXITY_BACKOFF_BASE, PERPLEXITY_BACKOFF_MAX, PERPLEXITY_POOL_SIZE, ASYNC_MAX_CONCURRENCY,
+    PIPELINE_MAX_TIME_MS
+)
+from http_transport import RETRYABLE_STATUS_CODES, backoff_delay, parse_retry_after, estimate_payload_tokens
+from mongodb_service import MongoDBService
+from perplexity_service import PerplexityService, SSEDecoder
+from pipeline_optimizer import optimize_pipeline
+from result_cache import get_result_cache, canonical_query_key
+import telemetry
+
+# Chronométrage du dernier appel LLM, propre à chaque tâche asyncio (questions traitées en parallèle)
+_call_timings: contextvars.ContextVar = contextvars.ContextVar("mbot_async_llm_timings", default=None)
+
+
+class AsyncPerplexityService(PerplexityService):
+    """
+    Variante asyncio de PerplexityService (httpx)
+
+    Réutilise la construction des prompts, le cache de requêtes et le
+    décodage des réponses du service synchrone ; seuls les appels réseau
+    deviennent des coroutines. Le client httpx est lié à la boucle
+    d'événements qui l'utilise en premier.
+    """
+
+    def __init__(self, api_url: Optional[str] = None):
+        super().__init__(api_url)
+        self._http: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def last_timings(self) -> Dict:
+        """Chronométrage du dernier appel de la tâche courante ({} si elle n'a pas appelé l'API)"""
+        return _call_timings.get() or {}
+    
+    @last_timings.setter
+    def last_timings(self, timings: Dict):
+        _call_timings.set(timings)
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(PERPLEXITY_READ_TIMEOUT, connect=PERPLEXITY_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=PERPLEXITY_POOL_SIZE,
+                                    max_keepalive_connections=PERPLEXITY_POOL_SIZE),
+            )
+        return self._http
+
+    async def _post(self, payload: Dict, stream: bool = False) -> Tuple[httpx.Response, Dict]:
+        """
+        POST avec nouvelles tentatives (429/5xx, erreurs réseau) et chronométrage
+
+        Returns:
+            Tuple (réponse, chronométrage de cet appel)
+        """
+        client = self._client()
+        limiter = self.transport.limiter
+        estimated_tokens = estimate_payload_tokens(payload)
+        call_started = time.perf_counter()
+        queue_ms = 0.0
+        attempt = 0
+        while True:
+            # Même limiteur que le transport synchrone ; l'attente bloquante se fait hors de la boucle
+            permit = await asyncio.to_thread(limiter.acquire, estimated_tokens) if limiter else None
+            if permit is not None:
+                queue_ms += permit.waited_ms
+            attempt_started = time.perf_counter()
+            response = None
+            try:
+                request = client.build_request("POST", self.api_url, headers=self.headers, json=payload)
+                # stream=True : la réponse revient dès réception des en-têtes (TTFB)
+                response = await client.send(request, stream=True)
+                ttfb_ms = (time.perf_counter() - attempt_started) * 1000
+                retryable = response.status_code in RETRYABLE_STATUS_CODES
+            except httpx.TransportError:
+                if attempt >= PERPLEXITY_MAX_RETRIES:
+                    raise
+                retryable = True
+            finally:
+                if permit is not None:
+                    if response is not None:
+                        permit.release(response.status_code, parse_retry_after(response.headers.get("Retry-After")))
+                    else:
+                        permit.release()
+
+            if not retryable or attempt >= PERPLEXITY_MAX_RETRIES:
+                if not stream:
+                    await response.aread()
+                timings = {
+                    "ttfb_ms": round(ttfb_ms, 3),
+                    "total_ms": round((time.perf_counter() - call_started) * 1000, 3),
+                    "attempts": attempt + 1,
+                    "status_code": response.status_code,
+                    "queue_ms": round(queue_ms, 3),
+                    "estimated_tokens": estimated_tokens,
+                }
+                self.last_timings = timings
+                return response, timings
+
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            delay = backoff_delay(attempt, retry_after, PERPLEXITY_BACKOFF_BASE, PERPLEXITY_BACKOFF_MAX)
+            if response is not None:
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _record_call(self, call: str, timings: Dict, usage: Optional[Dict]):
+        """Métriques de l'appel et tokens réellement consommés transmis au limiteur (comme le transport synchrone)"""
+        telemetry.record_llm_call(call, timings, usage)
+        limiter = self.transport.limiter
+        if limiter and usage and usage.get("total_tokens") is not None:
+            limiter.record_usage(timings.get("estimated_tokens", 0), usage["total_tokens"])
+
+    async def generate_mongodb_query(self, user_question: str, schema_context: str) -> Dict:
+        """Version asynchrone de PerplexityService.generate_mongodb_query"""
+        self.last_timings = {}
+        known_query, cache_namespace = self._lookup_query(user_question, schema_context)
+        if known_query:
+            return known_query
+
+        try:
+            with telemetry.span("generate"):
+                payload = self._build_query_payload(user_question, schema_context)
+                response, timings = await self._post(payload)
+                response.raise_for_status()
+                result = response.json()
+            self._record_call("generate", timings, result.get("usage"))
+            content = result["choices"][0]["message"]["content"]
+            return self._parse_query_content(content, user_question, cache_namespace)
+        except Exception as e:
+            return {
+                "query_type": "error",
+                "mongodb_query": {},
+                "explanation": f"Erreur API Perplexity: {str(e)}",
+                "estimated_results": "Aucun"
+            }
+
+    async def format_results(self, query_results: List[Dict], user_question: str) -> str:
+        """Version asynchrone de PerplexityService.format_results"""
+        self.last_compaction = None
+        self.last_format_error = None
+        self.last_timings = {}
+        if not query_results:
+            return "Aucun résultat trouvé pour votre question."
+
+        with telemetry.span("format") as attributes:
+            local_response = self._format_locally(query_results, user_question)
+            attributes["mode"] = "local" if local_response else "llm"
+            if local_response:
+                return local_response
+
+            payload, results_summary = self._build_format_request(query_results, user_question)
+            try:
+                response, timings = await self._post(payload)
+                response.raise_for_status()
+                result = response.json()
+                self._record_call("format", timings, result.get("usage"))
+                return result["choices"][0]["message"]["content"]
+            except Exception as e:
+                telemetry.record_error("format")
+                self.last_format_error = str(e)
+                return f"Erreur lors du formatage: {str(e)}\n\nRésultats bruts:\n{results_summary}"
+
+    async def format_results_stream(self, query_results: List[Dict], user_question: str) -> AsyncIterator[str]:
+        """Version asynchrone de PerplexityService.format_results_stream"""
+        self.last_compaction = None
+        self.last_format_error = None
+        self.last_timings = {}
+        if not query_results:
+            yield "Aucun résultat trouvé pour votre question."
+            return
+
+        with telemetry.span("format") as attributes:
+            local_response = self._format_locally(query_results, user_question)
+            attributes["mode"] = "local" if local_response else "llm"
+            if local_response:
+                yield local_response
+                return
+
+            payload, results_summary = self._build_format_request(query_results, user_question)
+            payload["stream"] = True
+
+            received_any = False
+            try:
+                response, timings = await self._post(payload, stream=True)
+                try:
+                    response.raise_for_status()
+                    decoder = SSEDecoder()
+                    async for line in response.aiter_lines():
+                        delta = decoder.feed(line)
+                        if delta:
+                            received_any = True
+                            yield delta
+                        if decoder.done:
+                            break
+                    # Dernier événement sans ligne vide finale
+                    delta = decoder.feed("")
+                    if delta:
+                        yield delta
+                finally:
+                    await response.aclose()
+                self._record_call("format", timings, decoder.usage)
+            except Exception as e:
+                telemetry.record_error("format")
+                self.last_format_error = str(e)
+                prefix = "\n\n" if received_any else ""
+                yield f"{prefix}Erreur lors du formatage: {str(e)}\n\nRésultats bruts:\n{results_summary}"
+
+    async def aclose(self):
+        """Ferme le client HTTP asynchrone"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+class AsyncMongoDBService:
+    """Variante asyncio de MongoDBService (Motor), partageant le cache de résultats"""
+
+    _serialize_document = MongoDBService._serialize_document
+
+    def __init__(self, uri: Optional[str] = None):
+        self.client = AsyncIOMotorClient(
+            uri or MONGODB_URI,
+            maxPoolSize=MONGODB_MAX_POOL_SIZE,
+            minPoolSize=MONGODB_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        )
+        self.db = self.client[MONGODB_DATABASE]
+        self.collection = self.db[MONGODB_COLLECTION]
+        self.result_cache = get_result_cache()
+
+    async def execute_query(self, query_type: str, query: Dict) -> List[Dict]:
+        """Version asynchrone de MongoDBService.execute_query"""
+        cache_key = None
+        if self.result_cache:
+            cache_key = canonical_query_key(query_type, query)
+            cached_results = self.result_cache.get(cache_key)
+            if cached_results is not None:
+                return cached_results
+
+        try:
+            if query_type == "aggregate":
+                report = optimize_pipeline(query)
+                cursor = self.collection.aggregate(report.pipeline, **report.options)
+            else:
+                cursor = self.collection.find(query).limit(10)
+                if PIPELINE_MAX_TIME_MS:
+                    cursor = cursor.max_time_ms(PIPELINE_MAX_TIME_MS)
+            documents = await cursor.to_list(length=None)
+            results = self._serialize_document(documents)
+        except Exception as e:
+            print(f"Erreur lors de l'exécution de la requête: {e}")
+            return []
+
+        if cache_key:
+            self.result_cache.set(cache_key, results)
+        return results
+
+    def close_connection(self):
+        """Ferme le client Motor"""
+        self.client.close()
+
+
+class AsyncQuestionPipeline:
+    """
+    Orchestrateur asynchrone question → requête → résultats → réponse
+
+    Plusieurs questions peuvent être traitées simultanément sur une même
+    boucle d'événements, dans la limite de max_concurrency.
+    """
+
+    def __init__(self, perplexity_service: Optional[AsyncPerplexityService] = None,
+                 mongodb_service: Optional[AsyncMongoDBService] = None,
+                 schema_context: str = "", max_concurrency: int = ASYNC_MAX_CONCURRENCY):
+        self.perplexity_service = perplexity_service or AsyncPerplexityService()
+        self.mongodb_service = mongodb_service or AsyncMongoDBService()
+        self.schema_context = schema_context
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def answer(self, user_question: str) -> Dict:
+        """
+        Traite une question de bout en bout
+
+        Returns:
+            Dict avec query_info, results, formatted_response et timings
+            (ms ; llm_calls : chronométrage des appels API de cette question)
+        """
+        async with self._semaphore:
+            timings = {}
+            started = time.perf_counter()
+            query_info = await self.perplexity_service.generate_mongodb_query(
+                user_question, self.schema_context
+            )
+            timings["generate_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            llm_calls = {}
+            if self.perplexity_service.last_timings:
+                llm_calls["generate"] = self.perplexity_service.last_timings
+            timings["llm_calls"] = llm_calls
+
+            answer = {"question": user_question, "query_info": query_info,
+                      "results": [], "formatted_response": None, "timings": timings}
+            if query_info.get("query_type") == "error":
+                answer["error"] = query_info.get("explanation")
+                return answer
+
+            step_started = time.perf_counter()
+            answer["results"] = await self.mongodb_service.execute_query(
+                query_info.get("query_type", "find"), query_info.get("mongodb_query", {})
+            )
+            timings["execute_ms"] = round((time.perf_counter() - step_started) * 1000, 3)
+            self.perplexity_service.record_success(user_question, query_info, answer["results"])
+
+            step_started = time.perf_counter()
+            answer["formatted_response"] = await self.perplexity_service.format_results(
+                answer["results"], user_question
+            )
+            timings["format_ms"] = round((time.perf_counter() - step_started) * 1000, 3)
+            if self.perplexity_service.last_timings:
+                llm_calls["format"] = self.perplexity_service.last_timings
+            timings["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            return answer
+
+    async def answer_many(self, questions: List[str]) -> List[Dict]:
+        """Traite plusieurs questions en parallèle (ordre des réponses conservé)"""
+        return await asyncio.gather(*(self.answer(question) for question in questions))
+
+    async def aclose(self):
+        """Libère les clients HTTP et MongoDB"""
+        await self.perplexity_service.aclose()
+        self.mongodb_service.close_connection()
+
+
+def answer_questions(questions: List[str], schema_context: str = "") -> List[Dict]:
+    """Point d'entrée synchrone : traite une liste de questions sur une boucle dédiée"""
+    async def _run():
+        pipeline = AsyncQuestionPipeline(schema_context=schema_context)
+        try:
+            return await pipeline.answer_many(questions)
+        finally:
+            await pipeline.aclose()
+    return asyncio.run(_run())
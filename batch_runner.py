@@ -0,0 +1,233 @@
+"""
+Traitement par lots sans interface (question → requête → résultats → réponse)
+
+Lit un fichier de questions (une par ligne, ou JSONL avec une clé
+"question"), les traite en parallèle avec PerplexityService et
+MongoDBService, et ajoute un enregistrement JSONL par question au fichier
+de sortie : requête générée, résultats, réponse formatée et temps par
+étape. Les questions identiques (après normalisation) ne sont traitées
+qu'une fois.
+
+Le fichier de sortie sert de point de reprise : relancé sur le même
+fichier, le traitement saute les questions déjà réussies et refait celles
+en erreur (le dernier enregistrement d'une question fait foi).
+
+    python batch_runner.py questions.txt --output .cache/batch.jsonl --concurrency 8
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Set
+from config import BATCH_CONCURRENCY
+from query_cache import normalize_question
+from rate_limiter import PRIORITY_BATCH, request_priority
+import telemetry
+
+
+def read_questions(path: str) -> List[str]:
+    """Questions d'un fichier texte (une par ligne, # pour commenter) ou JSONL ("question")"""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                question = json.loads(line).get("question", "")
+            else:
+                question = line
+            if question:
+                questions.append(question)
+    return questions
+
+
+def deduplicate(questions: Iterable[str]) -> Dict[str, Dict]:
+    """Questions uniques par clé normalisée (première formulation, nombre d'occurrences)"""
+    unique: Dict[str, Dict] = {}
+    for question in questions:
+        key = normalize_question(question)
+        if key in unique:
+            unique[key]["occurrences"] += 1
+        else:
+            unique[key] = {"question": question, "occurrences": 1}
+    return unique
+
+
+def load_checkpoint(output_path: str) -> Set[str]:
+    """Clés des questions déjà réussies dans un fichier de sortie existant"""
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Dernière ligne tronquée par une interruption
+                continue
+            if record.get("error"):
+                done.discard(record.get("key"))
+            else:
+                done.add(record.get("key"))
+    return done
+
+
+def answer_question(question: str, perplexity_service, mongodb_service, schema_context: str) -> Dict:
+    """
+    Traite une question de bout en bout
+
+    Returns:
+        Enregistrement avec query_info, results, formatted_response,
+        timings (ms) et error si une étape a échoué
+    """
+    trace = telemetry.start_trace("batch")
+    timings = {}
+    record = {"question": question, "query_info": None, "results": [],
+              "formatted_response": None, "timings": timings}
+    started = time.perf_counter()
+    try:
+        query_info = perplexity_service.generate_mongodb_query(question, schema_context)
+        timings["generate_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        record["query_info"] = query_info
+        if query_info.get("query_type") == "error":
+            record["error"] = query_info.get("explanation")
+            return record
+
+        step_started = time.perf_counter()
+        record["results"] = mongodb_service.execute_query(
+            query_info.get("query_type", "find"), query_info.get("mongodb_query", {})
+        )
+        timings["execute_ms"] = round((time.perf_counter() - step_started) * 1000, 3)
+        perplexity_service.record_success(question, query_info, record["results"])
+
+        step_started = time.perf_counter()
+        record["formatted_response"] = perplexity_service.format_results(record["results"], question)
+        timings["format_ms"] = round((time.perf_counter() - step_started) * 1000, 3)
+        if record["formatted_response"].startswith("Erreur lors du formatage"):
+            record["error"] = record["formatted_response"].split("\n", 1)[0]
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        telemetry.finish_trace(trace)
+        if trace.spans:
+            record["stages"] = {name: round(duration_ms, 3) for name, duration_ms in trace.breakdown()}
+    return record
+
+
+class _JsonlWriter:
+    """Ajout d'enregistrements JSONL depuis plusieurs threads, écrits sur disque un par un"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, "a+", encoding="utf-8")
+        # Ligne tronquée par une interruption : le prochain enregistrement commence sur sa propre ligne
+        if self._file.tell() > 0:
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")
+
+    def write(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def run_batch(questions: List[str], output_path: str, concurrency: int = BATCH_CONCURRENCY,
+              perplexity_service=None, mongodb_service=None, schema_context: Optional[str] = None,
+              resume: bool = True) -> Dict:
+    """
+    Traite un lot de questions avec au plus concurrency questions en cours
+
+    Les services (et donc leurs clients HTTP et MongoDB, caches compris)
+    sont partagés par tous les threads ; seules concurrency × 2 questions
+    sont soumises à la fois, quelle que soit la taille du lot.
+
+    Returns:
+        Bilan : questions lues, uniques, sautées (reprise), traitées,
+        erreurs, durée et débit en questions par minute
+    """
+    if perplexity_service is None:
+        from perplexity_service import PerplexityService
+        perplexity_service = PerplexityService()
+    if mongodb_service is None:
+        from mongodb_service import MongoDBService
+        mongodb_service = MongoDBService()
+    if schema_context is None:
+        schema_context = mongodb_service.get_schema_context() or ""
+
+    unique = deduplicate(questions)
+    done = load_checkpoint(output_path) if resume else set()
+    pending = [(key, item) for key, item in unique.items() if key not in done]
+    summary = {"questions": len(questions), "unique": len(unique),
+               "skipped": len(unique) - len(pending), "processed": 0, "errors": 0}
+
+    def process(key: str, item: Dict) -> Dict:
+        # Les questions posées dans l'interface passent avant le lot
+        with request_priority(PRIORITY_BATCH):
+            record = answer_question(item["question"], perplexity_service, mongodb_service, schema_context)
+        record["key"] = key
+        record["occurrences"] = item["occurrences"]
+        record["completed_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        writer.write(record)
+        return record
+
+    started = time.perf_counter()
+    writer = _JsonlWriter(output_path)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch") as executor:
+            in_flight = set()
+            remaining = iter(pending)
+            while True:
+                for key, item in remaining:
+                    in_flight.add(executor.submit(process, key, item))
+                    if len(in_flight) >= 2 * max(1, concurrency):
+                        break
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    summary["processed"] += 1
+                    if record.get("error"):
+                        summary["errors"] += 1
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    summary["duration_s"] = round(elapsed, 3)
+    summary["questions_per_minute"] = round(summary["processed"] / elapsed * 60, 1) if elapsed > 0 else 0.0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Traitement d'un fichier de questions sans interface")
+    parser.add_argument("questions", help="Fichier de questions (une par ligne, ou JSONL avec « question »)")
+    parser.add_argument("--output", default=".cache/batch.jsonl", help="Enregistrements JSONL (point de reprise)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Questions traitées simultanément")
+    parser.add_argument("--no-resume", action="store_true", help="Retraiter les questions déjà présentes")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    summary = run_batch(questions, args.output, args.concurrency, resume=not args.no_resume)
+    print(f"🎬 {summary['questions']} questions lues, {summary['unique']} uniques, "
+          f"{summary['skipped']} déjà traitées")
+    print(f"✅ {summary['processed']} traitées en {summary['duration_s']:.1f} s "
+          f"({summary['questions_per_minute']:.1f} questions/min, concurrence {args.concurrency})")
+    if summary["errors"]:
+        print(f"❌ {summary['errors']} questions en erreur (retraitées à la prochaine reprise)")
+    print(f"📄 Résultats ajoutés à {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Benchmark de bout en bout hors ligne (question → requête → résultats → réponse)
+
+Remplace l'API Perplexity par un serveur HTTP local rejouant des réponses
+enregistrées avec une latence configurable, et MongoDB Atlas par un mongod
+local (--mongo-uri) ou, à défaut, par mongomock en mémoire. La collection
+est remplie d'un corpus synthétique à la forme de sample_mflix.movies.
+
+Chaque question du corpus (bench_questions.json) est rejouée --repeat fois ;
+les latences par étape (intent, generate, execute, serialize, format) et
+leurs p50/p95/p99 sont écrites en JSON pour comparer deux commits :
+
+    python bench_e2e.py --count 5000 --repeat 5 --llm-latency-ms 300
+    python bench_e2e.py --compare .cache/bench_e2e_base.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from config import MONGODB_DATABASE, MONGODB_COLLECTION
+from intent_engine import match_intent
+from query_cache import normalize_question
+from synthetic_movies import iter_movies
+
+
+STAGES = ["intent", "generate", "execute", "serialize", "format", "total"]
+QUERY_PROMPT_MARKER = "convertir des questions en langage naturel en requêtes MongoDB"
+
+
+def load_corpus(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakePerplexityServer:
+    """
+    Serveur chat completions local (thread de fond)
+
+    Les requêtes de traduction reçoivent la réponse enregistrée pour la
+    question (find {} si elle est inconnue), les requêtes de formatage un
+    texte fixe ; en flux (stream=True), la réponse est découpée en
+    événements SSE. Chaque réponse est retardée de latency_ms ± jitter_ms.
+    """
+
+    def __init__(self, recorded: Dict[str, Dict], latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.recorded = {normalize_question(question): response for question, response in recorded.items()}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/chat/completions"
+
+    def start(self) -> "FakePerplexityServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-perplexity", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def answer(self, payload: Dict) -> str:
+        messages = payload.get("messages", [])
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        if QUERY_PROMPT_MARKER in system:
+            question = next((m["content"] for m in messages if m.get("role") == "user"), "")
+            response = self.recorded.get(normalize_question(question)) or {
+                "query_type": "find", "mongodb_query": {},
+                "explanation": "Réponse non enregistrée", "estimated_results": "Un document",
+            }
+            return json.dumps(response, ensure_ascii=False)
+        return ("### Résultats\n\nVoici une synthèse des données demandées, avec les valeurs clés "
+                "mises en évidence et une courte interprétation.\n\n" + "- Point clé\n" * 10)
+
+    def _delay(self):
+        delay_ms = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                server.requests += 1
+                server._delay()
+                content = server.answer(payload)
+                if payload.get("stream"):
+                    chunks = [content[i:i + 40] for i in range(0, len(content), 40)]
+                    body = "".join(
+                        "data: " + json.dumps({"choices": [{"delta": {"content": chunk}}]}, ensure_ascii=False) + "\n\n"
+                        for chunk in chunks
+                    ) + "data: [DONE]\n\n"
+                    content_type = "text/event-stream"
+                else:
+                    body = json.dumps({"choices": [{"message": {"content": content}}]}, ensure_ascii=False)
+                    content_type = "application/json"
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def open_client(mongo_uri: Optional[str]):
+    """mongod local si une URI est fournie, sinon mongomock (pip install mongomock)"""
+    if mongo_uri:
+        from pymongo import MongoClient
+        return MongoClient(mongo_uri, serverSelectionTimeoutMS=5000), "mongod"
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("❌ Aucun mongod (--mongo-uri) et mongomock non installé : pip install mongomock")
+    return mongomock.MongoClient(), "mongomock"
+
+
+def seed_collection(collection, count: int, batch_size: int = 1000) -> int:
+    """Remplit une collection vide avec count films synthétiques (collection existante non modifiée)"""
+    existing = collection.estimated_document_count()
+    if existing:
+        print(f"⚠️ {collection.full_name} contient déjà {existing} documents : corpus conservé")
+        return existing
+    batch = []
+    for movie in iter_movies(count):
+        batch.append(movie)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    collection.create_index("year")
+    return count
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentile par interpolation linéaire (q entre 0 et 100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_stages(samples: List[Dict]) -> Dict[str, Dict]:
+    summary = {}
+    for stage in STAGES:
+        values = [sample[stage] for sample in samples if stage in sample]
+        if values:
+            summary[stage] = {
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values), 3),
+                "p50_ms": round(percentile(values, 50), 3),
+                "p95_ms": round(percentile(values, 95), 3),
+                "p99_ms": round(percentile(values, 99), 3),
+                "max_ms": round(max(values), 3),
+            }
+    return summary
+
+
+def run_question(question: str, perplexity_service, mongodb_service, schema_context: str) -> Dict:
+    """Une question de bout en bout, chronométrée étape par étape (ms)"""
+    sample = {"question": question}
+    started = time.perf_counter()
+    intent = match_intent(question)
+    sample["intent"] = (time.perf_counter() - started) * 1000
+
+    step_started = time.perf_counter()
+    query_info = intent or perplexity_service.generate_mongodb_query(question, schema_context)
+    if not intent:
+        sample["generate"] = (time.perf_counter() - step_started) * 1000
+    if query_info.get("query_type") == "error":
+        sample["error"] = query_info.get("explanation")
+        return sample
+
+    results = mongodb_service.execute_query(query_info["query_type"], query_info.get("mongodb_query", {}))
+    timings = mongodb_service.last_timings
+    sample["execute"] = timings.get("execute_ms", 0.0)
+    sample["serialize"] = timings.get("serialize_ms", 0.0)
+    sample["rows"] = len(results)
+
+    step_started = time.perf_counter()
+    perplexity_service.format_results(results, question)
+    sample["format"] = (time.perf_counter() - step_started) * 1000
+    sample["total"] = (time.perf_counter() - started) * 1000
+    return sample
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> Dict:
+    from mongodb_service import MongoDBService
+    from perplexity_service import PerplexityService
+    from schema_inference import SchemaInferrer
+
+    corpus = load_corpus(args.questions)
+    recorded = {item["question"]: item["response"] for item in corpus if item.get("response")}
+    server = FakePerplexityServer(recorded, args.llm_latency_ms, args.llm_jitter_ms).start()
+    client, backend = open_client(args.mongo_uri)
+    try:
+        collection = client[MONGODB_DATABASE][MONGODB_COLLECTION]
+        seeded = seed_collection(collection, args.count)
+
+        mongodb_service = MongoDBService(client=client)
+        # Mesure de l'exécution réelle : ni cache de résultats, ni explain() en arrière-plan
+        mongodb_service.result_cache = None
+        mongodb_service.index_advisor = None
+        if backend == "mongomock":
+            mongodb_service.rollups = None
+        perplexity_service = PerplexityService(api_url=server.url)
+        perplexity_service.query_cache = None
+        # API simulée sans quota : le limiteur de débit fausserait les latences mesurées
+        perplexity_service.transport.limiter = None
+        schema_context = SchemaInferrer(collection, cache_path=None).get_context() or ""
+
+        samples = []
+        for _ in range(args.warmup):
+            run_question(corpus[0]["question"], perplexity_service, mongodb_service, schema_context)
+        for _ in range(args.repeat):
+            for item in corpus:
+                samples.append(run_question(item["question"], perplexity_service, mongodb_service, schema_context))
+    finally:
+        server.stop()
+        client.close()
+
+    return {
+        "commit": _git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "backend": backend, "documents": seeded, "questions": len(corpus), "repeat": args.repeat,
+            "llm_latency_ms": args.llm_latency_ms, "llm_jitter_ms": args.llm_jitter_ms,
+        },
+        "stages": summarize_stages(samples),
+        "errors": sum(1 for sample in samples if "error" in sample),
+        "samples": [{key: round(value, 3) if isinstance(value, float) else value for key, value in sample.items()}
+                    for sample in samples],
+    }
+
+
+def print_report(report: Dict, baseline: Optional[Dict] = None):
+    config = report["config"]
+    print(f"🎬 {config['questions']} questions × {config['repeat']} sur {config['documents']} films "
+          f"({config['backend']}), LLM simulé {config['llm_latency_ms']:.0f} ms")
+    header = f"{'Étape':<10} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    if baseline:
+        header += f" {'Δ p50':>8} {'Δ p95':>8}"
+    print(header)
+    for stage, measures in report["stages"].items():
+        line = (f"{stage:<10} {measures['count']:>5} {measures['p50_ms']:>9.2f} {measures['p95_ms']:>9.2f} "
+                f"{measures['p99_ms']:>9.2f} {measures['max_ms']:>9.2f}")
+        previous = (baseline or {}).get("stages", {}).get(stage)
+        if previous:
+            for key in ("p50_ms", "p95_ms"):
+                change = (measures[key] - previous[key]) / previous[key] * 100 if previous[key] else 0.0
+                line += f" {change:>+7.1f}%"
+        print(line)
+    if report["errors"]:
+        print(f"❌ {report['errors']} questions en erreur")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de bout en bout hors ligne")
+    parser.add_argument("--count", type=int, default=5000, help="Films synthétiques insérés (collection vide)")
+    parser.add_argument("--repeat", type=int, default=3, help="Passages sur le corpus de questions")
+    parser.add_argument("--warmup", type=int, default=1, help="Questions de chauffe non mesurées")
+    parser.add_argument("--questions", default="bench_questions.json", help="Corpus de questions")
+    parser.add_argument("--mongo-uri", default=None, help="mongod local (mongomock par défaut)")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Latence simulée de l'API")
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0, help="Variation aléatoire de la latence")
+    parser.add_argument("--output", default=".cache/bench_e2e.json", help="Résultats JSON")
+    parser.add_argument("--compare", default=None, help="Résultats JSON d'un commit de référence")
+    args = parser.parse_args()
+
+    report = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 Résultats écrits dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
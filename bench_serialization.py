@@ -0,0 +1,118 @@
+"""
+Micro-benchmark de la sérialisation des résultats MongoDB
+
+Compare l'ancien parcours récursif de MongoDBService._serialize_document
+aux chemins de serialization.py sur un corpus généré à la forme de
+sample_mflix.movies : débit (documents/s, Mo/s de JSON produit) et
+allocations (pic mémoire et blocs conservés mesurés par tracemalloc).
+
+    python bench_serialization.py --count 5000 --repeat 5
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+from bson import ObjectId
+from serialization import to_serializable, dumps_compact
+from synthetic_movies import generate_movies
+
+
+def legacy_serialize_document(doc):
+    """Implémentation d'origine de MongoDBService._serialize_document (référence)"""
+    if doc is None:
+        return None
+
+    if isinstance(doc, list):
+        return [legacy_serialize_document(item) for item in doc]
+
+    if isinstance(doc, dict):
+        serialized = {}
+        for key, value in doc.items():
+            if isinstance(value, ObjectId):
+                serialized[key] = str(value)
+            elif isinstance(value, datetime):
+                serialized[key] = value.isoformat()
+            elif isinstance(value, dict):
+                serialized[key] = legacy_serialize_document(value)
+            elif isinstance(value, list):
+                serialized[key] = legacy_serialize_document(value)
+            else:
+                serialized[key] = value
+        return serialized
+
+    return doc
+
+
+def _variants(documents: List[Dict]) -> Dict[str, Callable[[], object]]:
+    return {
+        "legacy _serialize_document": lambda: legacy_serialize_document(documents),
+        "to_serializable": lambda: to_serializable(documents),
+        "legacy + json.dumps(indent=2)": lambda: json.dumps(
+            legacy_serialize_document(documents), indent=2, ensure_ascii=False),
+        "legacy + json.dumps compact": lambda: json.dumps(
+            legacy_serialize_document(documents), separators=(",", ":"), ensure_ascii=False),
+        "dumps_compact": lambda: dumps_compact(documents),
+    }
+
+
+def _best_time(function: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _allocations(function: Callable[[], object]) -> Dict:
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = function()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    del result
+    return {"peak_mb": peak / (1024 * 1024), "blocks": blocks}
+
+
+def run(count: int, repeat: int) -> List[Dict]:
+    """Mesure chaque variante et vérifie qu'elles produisent le même JSON"""
+    documents = generate_movies(count)
+    reference = legacy_serialize_document(documents)
+    if to_serializable(documents) != reference or json.loads(dumps_compact(documents)) != reference:
+        raise AssertionError("Les sérialisations ne sont pas équivalentes")
+    json_mb = len(dumps_compact(documents).encode("utf-8")) / (1024 * 1024)
+
+    measures = []
+    for name, function in _variants(documents).items():
+        elapsed = _best_time(function, repeat)
+        measures.append(dict(
+            {"variant": name, "seconds": elapsed, "docs_per_s": count / elapsed, "mb_per_s": json_mb / elapsed},
+            **_allocations(function)
+        ))
+    return measures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la sérialisation des résultats")
+    parser.add_argument("--count", type=int, default=5000, help="Nombre de films générés")
+    parser.add_argument("--repeat", type=int, default=5, help="Répétitions (meilleur temps retenu)")
+    args = parser.parse_args()
+
+    measures = run(args.count, args.repeat)
+    baseline = measures[0]["seconds"]
+    print(f"🎬 {args.count} films générés (forme sample_mflix), meilleur temps sur {args.repeat} essais\n")
+    print(f"{'Variante':<32} {'ms':>8} {'docs/s':>10} {'Mo/s':>8} {'vs legacy':>10} {'pic Mo':>8} {'blocs conservés':>16}")
+    for measure in measures:
+        print(f"{measure['variant']:<32} {measure['seconds'] * 1000:>8.1f} {measure['docs_per_s']:>10.0f} "
+              f"{measure['mb_per_s']:>8.1f} {baseline / measure['seconds']:>9.2f}x "
+              f"{measure['peak_mb']:>8.1f} {measure['blocks']:>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,883 @@
+"""
+Moteur d'agrégation colonnaire en mémoire pour la collection movies
+
+Les champs analytiques sont copiés dans des tableaux NumPy (un par champ,
+dictionnaire + codes pour les champs texte et les tableaux) ; les
+pipelines composés de $match, $unwind, $group, $count, puis de $sort,
+$limit, $skip, $project, $match et $group sur les groupes obtenus, sont
+exécutés sans aller-retour vers MongoDB. Tout le reste retombe sur
+MongoDB. L'instantané est relu toutes les COLUMNAR_REFRESH_INTERVAL
+secondes en arrière-plan.
+
+    python columnar_engine.py --check --uri mongodb://localhost:27017
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from config import (
+    MONGODB_URI, MONGODB_DATABASE, MONGODB_COLLECTION, PIPELINE_MAX_RESULTS,
+    COLUMNAR_ENGINE_ENABLED, COLUMNAR_REFRESH_INTERVAL
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Champs copiés dans l'instantané
+NUMERIC_FIELDS = ["year", "runtime", "imdb.rating", "imdb.votes", "metacritic",
+                  "num_mflix_comments", "awards.wins", "awards.nominations"]
+TEXT_FIELDS = ["type", "rated"]
+ARRAY_FIELDS = ["genres", "directors", "countries", "languages", "cast", "writers"]
+
+_MISSING = object()
+_REGEX_FLAGS = {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}
+_ARITHMETIC = {"$add", "$subtract", "$multiply", "$divide", "$mod", "$floor", "$ceil"}
+
+
+class Unsupported(Exception):
+    """Pipeline hors du sous-ensemble exécuté localement : MongoDB prend le relais"""
+
+
+def _lookup(document: Any, path: str) -> Any:
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class NumericColumn:
+    """Champ numérique : valeurs (NaN hors nombres), présence, entiers et valeurs d'un autre type"""
+
+    def __init__(self, raw: List[Any]):
+        self.values = np.array([float(v) if _is_number(v) else np.nan for v in raw], dtype=np.float64)
+        self.numeric = ~np.isnan(self.values)
+        self.present = np.array([v is not _MISSING for v in raw], dtype=bool)
+        self.integral = np.array([isinstance(v, int) and not isinstance(v, bool) for v in raw], dtype=bool)
+        # Chaînes, dates... : comparaisons correctes, mais ni clé de groupe ni $min/$max
+        self.other = self.present & ~self.numeric & np.array([v is not None for v in raw], dtype=bool)
+
+
+class CodedColumn:
+    """
+    Champ texte ou tableau de textes encodé par dictionnaire
+
+    Chaque élément (une valeur par document pour un champ texte, une par
+    élément de tableau sinon) est un code dans dictionary ; element_doc
+    donne le document de chaque élément.
+    """
+
+    def __init__(self, raw: List[Any], multi_valued: bool):
+        self.multi_valued = multi_valued
+        self.present = np.array([v is not _MISSING for v in raw], dtype=bool)
+        index: Dict[str, int] = {}
+        codes, docs = [], []
+        self.irregular = False
+        for row, value in enumerate(raw):
+            items = value if isinstance(value, list) else ([] if value is None or value is _MISSING else [value])
+            for item in items:
+                if not isinstance(item, str):
+                    self.irregular = True
+                    continue
+                codes.append(index.setdefault(item, len(index)))
+                docs.append(row)
+        self.dictionary = np.array(list(index), dtype=object)
+        self.element_codes = np.array(codes, dtype=np.int64)
+        self.element_doc = np.array(docs, dtype=np.int64)
+        # Champ texte : code par document (-1 si absent), utilisable comme clé de groupe
+        self.doc_codes = None
+        if not multi_valued:
+            self.doc_codes = np.full(len(raw), -1, dtype=np.int64)
+            self.doc_codes[self.element_doc] = self.element_codes
+
+    def value_mask(self, condition: Any) -> "np.ndarray":
+        """Valeurs du dictionnaire satisfaisant une condition (égalité, $in, $regex...)"""
+        values = self.dictionary
+        if isinstance(condition, str):
+            return values == condition
+        if not isinstance(condition, dict) or not condition:
+            raise Unsupported(f"condition {condition!r}")
+        mask = np.ones(len(values), dtype=bool)
+        for operator, operand in condition.items():
+            if operator == "$eq" and isinstance(operand, str):
+                mask &= values == operand
+            elif operator == "$in" and isinstance(operand, list) and all(isinstance(v, str) for v in operand):
+                mask &= np.isin(values, operand)
+            elif operator == "$regex" and isinstance(operand, str):
+                flags = 0
+                for option in condition.get("$options", ""):
+                    if option not in _REGEX_FLAGS:
+                        raise Unsupported(f"option $regex {option}")
+                    flags |= _REGEX_FLAGS[option]
+                pattern = re.compile(operand, flags)
+                mask &= np.array([bool(pattern.search(v)) for v in values], dtype=bool)
+            elif operator != "$options":
+                raise Unsupported(f"opérateur {operator} sur un champ texte")
+        return mask
+
+
+class ColumnarSnapshot:
+    """Copie colonnaire des champs analytiques de la collection"""
+
+    def __init__(self, documents: Iterable[Dict]):
+        raw: Dict[str, List[Any]] = {field: [] for field in NUMERIC_FIELDS + TEXT_FIELDS + ARRAY_FIELDS}
+        for document in documents:
+            for field, values in raw.items():
+                values.append(_lookup(document, field))
+        self.size = len(raw["year"])
+        self.columns: Dict[str, Any] = {}
+        for field in NUMERIC_FIELDS:
+            self.columns[field] = NumericColumn(raw[field])
+        for field in TEXT_FIELDS + ARRAY_FIELDS:
+            self.columns[field] = CodedColumn(raw[field], multi_valued=field in ARRAY_FIELDS)
+        self.built_at = time.time()
+
+    @classmethod
+    def from_collection(cls, collection) -> "ColumnarSnapshot":
+        projection = {field: 1 for field in NUMERIC_FIELDS + TEXT_FIELDS + ARRAY_FIELDS}
+        projection["_id"] = 0
+        return cls(collection.find({}, projection))
+
+    def column(self, field: str):
+        column = self.columns.get(field)
+        if column is None:
+            raise Unsupported(f"champ {field} absent de l'instantané")
+        if isinstance(column, CodedColumn) and column.irregular:
+            raise Unsupported(f"champ {field} avec des valeurs non textuelles")
+        return column
+
+
+class _Frame:
+    """Lignes en cours : document source de chaque ligne et, après $unwind, élément déroulé"""
+
+    def __init__(self, doc_index: "np.ndarray", unwound: Optional[str] = None,
+                 element_index: Optional["np.ndarray"] = None):
+        self.doc_index = doc_index
+        self.unwound = unwound
+        self.element_index = element_index
+
+    def __len__(self):
+        return len(self.doc_index)
+
+    def take(self, mask: "np.ndarray") -> "_Frame":
+        return _Frame(self.doc_index[mask], self.unwound,
+                      self.element_index[mask] if self.element_index is not None else None)
+
+
+# --- Étapes vectorisées (documents) ---
+
+def _numeric_mask(column: NumericColumn, condition: Any) -> "np.ndarray":
+    values, numeric = column.values, column.numeric
+    if _is_number(condition):
+        return numeric & (values == condition)
+    if not isinstance(condition, dict) or not condition:
+        raise Unsupported(f"condition {condition!r}")
+    mask = np.ones(len(values), dtype=bool)
+    for operator, operand in condition.items():
+        if operator in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+            if not _is_number(operand):
+                raise Unsupported(f"{operator} {operand!r}")
+            if operator == "$eq":
+                mask &= numeric & (values == operand)
+            elif operator == "$ne":
+                mask &= ~(numeric & (values == operand))
+            elif operator == "$gt":
+                mask &= numeric & (values > operand)
+            elif operator == "$gte":
+                mask &= numeric & (values >= operand)
+            elif operator == "$lt":
+                mask &= numeric & (values < operand)
+            else:
+                mask &= numeric & (values <= operand)
+        elif operator in ("$in", "$nin"):
+            if not isinstance(operand, list) or not all(_is_number(v) for v in operand):
+                raise Unsupported(f"{operator} {operand!r}")
+            found = numeric & np.isin(values, operand)
+            mask &= found if operator == "$in" else ~found
+        elif operator == "$exists":
+            mask &= column.present if operand else ~column.present
+        elif operator == "$type" and operand in ("number", "double"):
+            mask &= numeric if operand == "number" else numeric & ~column.integral
+        else:
+            raise Unsupported(f"opérateur {operator} sur un champ numérique")
+    return mask
+
+
+def _coded_element_mask(column: CodedColumn, condition: Any) -> Tuple["np.ndarray", bool]:
+    """Éléments satisfaisant la condition ; negated si la condition est une négation ($ne, $nin)"""
+    if isinstance(condition, dict) and len(condition) == 1 and next(iter(condition)) in ("$ne", "$nin"):
+        operator, operand = next(iter(condition.items()))
+        positive = column.value_mask(operand if operator == "$ne" else {"$in": operand})
+        return positive[column.element_codes], True
+    return column.value_mask(condition)[column.element_codes], False
+
+
+def _field_mask(snapshot: ColumnarSnapshot, frame: _Frame, field: str, condition: Any) -> "np.ndarray":
+    column = snapshot.column(field)
+    if isinstance(column, NumericColumn):
+        return _numeric_mask(column, condition)[frame.doc_index]
+
+    if isinstance(condition, dict) and set(condition) == {"$exists"}:
+        present = column.present if condition["$exists"] else ~column.present
+        return present[frame.doc_index]
+    elements, negated = _coded_element_mask(column, condition)
+    if field == frame.unwound:
+        # Champ déroulé : la condition porte sur l'élément de la ligne
+        matched = elements[frame.element_index]
+    else:
+        # Tableau : au moins un élément satisfait la condition
+        docs = np.zeros(snapshot.size, dtype=bool)
+        docs[column.element_doc[elements]] = True
+        matched = docs[frame.doc_index]
+    return ~matched if negated else matched
+
+
+def _match(snapshot: ColumnarSnapshot, frame: _Frame, query: Any) -> "np.ndarray":
+    if not isinstance(query, dict):
+        raise Unsupported("$match")
+    mask = np.ones(len(frame), dtype=bool)
+    for key, condition in query.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list) or not condition:
+                raise Unsupported(key)
+            masks = [_match(snapshot, frame, sub_query) for sub_query in condition]
+            mask &= np.logical_and.reduce(masks) if key == "$and" else np.logical_or.reduce(masks)
+        elif key.startswith("$"):
+            raise Unsupported(key)
+        else:
+            mask &= _field_mask(snapshot, frame, key, condition)
+    return mask
+
+
+def _unwind(snapshot: ColumnarSnapshot, frame: _Frame, spec: Any) -> _Frame:
+    if isinstance(spec, dict):
+        if set(spec) - {"path", "preserveNullAndEmptyArrays"} or spec.get("preserveNullAndEmptyArrays"):
+            raise Unsupported("$unwind avec options")
+        spec = spec.get("path")
+    if not isinstance(spec, str) or not spec.startswith("$") or frame.unwound is not None:
+        raise Unsupported("$unwind")
+    field = spec[1:]
+    column = snapshot.column(field)
+    if not isinstance(column, CodedColumn):
+        raise Unsupported(f"$unwind sur {field}")
+    selected = np.zeros(snapshot.size, dtype=bool)
+    selected[frame.doc_index] = True
+    elements = np.nonzero(selected[column.element_doc])[0]
+    return _Frame(column.element_doc[elements], field, elements)
+
+
+def _expression(snapshot: ColumnarSnapshot, frame: _Frame, expression: Any) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Expression numérique vectorisée : (valeurs, NaN si null ; entiers)"""
+    size = len(frame)
+    if _is_number(expression):
+        return np.full(size, float(expression)), np.full(size, isinstance(expression, int))
+    if isinstance(expression, str) and expression.startswith("$"):
+        column = snapshot.column(expression[1:])
+        if not isinstance(column, NumericColumn):
+            raise Unsupported(f"expression sur {expression}")
+        if column.other[frame.doc_index].any():
+            raise Unsupported(f"valeurs non numériques dans {expression}")
+        return column.values[frame.doc_index], column.integral[frame.doc_index]
+    if not isinstance(expression, dict) or len(expression) != 1 or next(iter(expression)) not in _ARITHMETIC:
+        raise Unsupported(f"expression {expression!r}")
+    operator, operands = next(iter(expression.items()))
+    if operator in ("$floor", "$ceil"):
+        operand = operands[0] if isinstance(operands, list) and len(operands) == 1 else operands
+        values, integral = _expression(snapshot, frame, operand)
+        return (np.floor(values) if operator == "$floor" else np.ceil(values)), integral
+    if not isinstance(operands, list) or not operands:
+        raise Unsupported(f"{operator} {operands!r}")
+    evaluated = [_expression(snapshot, frame, operand) for operand in operands]
+    values = [item[0] for item in evaluated]
+    integral = np.logical_and.reduce([item[1] for item in evaluated])
+    if operator == "$add":
+        return np.sum(values, axis=0), integral
+    if operator == "$multiply":
+        return np.prod(values, axis=0), integral
+    if len(values) != 2:
+        raise Unsupported(f"{operator} à {len(values)} opérandes")
+    if operator in ("$divide", "$mod") and (values[1] == 0).any():
+        raise Unsupported("division par zéro")
+    if operator == "$subtract":
+        return values[0] - values[1], integral
+    if operator == "$divide":
+        return values[0] / values[1], np.zeros(size, dtype=bool)
+    return np.fmod(values[0], values[1]), integral
+
+
+def _group_key(snapshot: ColumnarSnapshot, frame: _Frame, expression: Any):
+    """Composante de clé de groupe : (codes entiers par ligne, valeur d'une ligne)"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        field = expression[1:]
+        column = snapshot.column(field)
+        if isinstance(column, CodedColumn):
+            if field == frame.unwound:
+                codes = column.element_codes[frame.element_index]
+            elif not column.multi_valued:
+                codes = column.doc_codes[frame.doc_index]
+            else:
+                raise Unsupported(f"regroupement sur le tableau {field} non déroulé")
+            return codes, lambda row: column.dictionary[codes[row]] if codes[row] >= 0 else None
+    values, integral = _expression(snapshot, frame, expression)
+    # NaN (null ou absent) regroupés sous un même code
+    filled = np.where(np.isnan(values), np.inf, values)
+    _, codes = np.unique(filled, return_inverse=True)
+    return codes.reshape(-1), lambda row: _number(values[row], integral[row])
+
+
+def _number(value: float, integral: bool) -> Any:
+    if np.isnan(value):
+        return None
+    return int(value) if integral and float(value).is_integer() else float(value)
+
+
+def _accumulate(snapshot: ColumnarSnapshot, frame: _Frame, groups: "np.ndarray", count: int,
+                spec: Any) -> List[Any]:
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise Unsupported(f"accumulateur {spec!r}")
+    operator, operand = next(iter(spec.items()))
+    sizes = np.bincount(groups, minlength=count)
+    if operator == "$count" and operand == {}:
+        return [int(size) for size in sizes]
+    if operator == "$sum" and _is_number(operand):
+        return [_number(size * operand, isinstance(operand, int)) for size in sizes]
+    if operator not in ("$sum", "$avg", "$min", "$max"):
+        raise Unsupported(f"accumulateur {operator}")
+
+    values, integral = _expression(snapshot, frame, operand)
+    numeric = ~np.isnan(values)
+    counts = np.bincount(groups[numeric], minlength=count)
+    non_integral = np.bincount(groups[numeric & ~integral], minlength=count)
+    if operator in ("$sum", "$avg"):
+        sums = np.bincount(groups[numeric], weights=values[numeric], minlength=count)
+        if operator == "$sum":
+            return [_number(total, not non_integral[group]) for group, total in enumerate(sums)]
+        return [float(sums[group] / counts[group]) if counts[group] else None for group in range(count)]
+    extremes = np.full(count, np.inf if operator == "$min" else -np.inf)
+    (np.minimum if operator == "$min" else np.maximum).at(extremes, groups[numeric], values[numeric])
+    return [_number(extremes[group], not non_integral[group]) if counts[group] else None for group in range(count)]
+
+
+def _group(snapshot: ColumnarSnapshot, frame: _Frame, spec: Any) -> List[Dict]:
+    if not isinstance(spec, dict) or "_id" not in spec:
+        raise Unsupported("$group")
+    if not len(frame):
+        return []
+    key_spec = spec["_id"]
+    if isinstance(key_spec, dict) and not any(name.startswith("$") for name in key_spec):
+        components = {name: _group_key(snapshot, frame, expression) for name, expression in key_spec.items()}
+    elif isinstance(key_spec, (str, dict)) and (not isinstance(key_spec, str) or key_spec.startswith("$")):
+        components = {None: _group_key(snapshot, frame, key_spec)}
+    else:
+        # Constante (null...) : un seul groupe
+        components = {}
+
+    if components:
+        matrix = np.stack([codes for codes, _ in components.values()], axis=1)
+        _, first_rows, groups = np.unique(matrix, axis=0, return_index=True, return_inverse=True)
+        groups = groups.reshape(-1)
+    else:
+        first_rows, groups = np.array([0]), np.zeros(len(frame), dtype=np.int64)
+    count = len(first_rows)
+
+    rows = []
+    for group in range(count):
+        row = first_rows[group]
+        if not components:
+            key = key_spec
+        elif None in components:
+            key = components[None][1](row)
+        else:
+            key = {name: value_of(row) for name, (_, value_of) in components.items()}
+            if any(value is None for value in key.values()):
+                raise Unsupported("champ absent dans une clé composée")
+        rows.append({"_id": key})
+    for name, accumulator in spec.items():
+        if name == "_id":
+            continue
+        for row, value in zip(rows, _accumulate(snapshot, frame, groups, count, accumulator)):
+            row[name] = value
+    # Ordre de première apparition, comme un parcours de la collection
+    order = np.argsort(first_rows, kind="stable")
+    return [rows[group] for group in order]
+
+
+# --- Étapes sur les groupes obtenus (quelques centaines de lignes au plus) ---
+
+def _row_value(row: Dict, path: str) -> Any:
+    value = _lookup(row, path)
+    return None if value is _MISSING else value
+
+
+def _sort_key(value: Any):
+    # Ordre BSON : null < nombres < chaînes < documents < booléens
+    if value is None:
+        return (0, 0)
+    if _is_number(value):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, dict):
+        # Champ par champ dans l'ordre d'insertion : type, nom, puis valeur
+        return (3, tuple((_sort_key(item)[0], name, _sort_key(item)) for name, item in value.items()))
+    if isinstance(value, bool):
+        return (5, value)
+    raise Unsupported(f"tri sur une valeur {type(value).__name__}")
+
+
+def _rows_sort(rows: List[Dict], spec: Any) -> List[Dict]:
+    if not isinstance(spec, dict) or not spec or any(direction not in (1, -1) for direction in spec.values()):
+        raise Unsupported("$sort")
+    rows = list(rows)
+    for path, direction in reversed(list(spec.items())):
+        rows.sort(key=lambda row: _sort_key(_row_value(row, path)), reverse=direction == -1)
+    return rows
+
+
+def _rows_match(rows: List[Dict], query: Any) -> List[Dict]:
+    def matches(row: Dict, query: Dict) -> bool:
+        for path, condition in query.items():
+            value = _row_value(row, path)
+            if not isinstance(condition, dict):
+                if isinstance(condition, (dict, list)) or value != condition:
+                    return False
+                continue
+            for operator, operand in condition.items():
+                if operator == "$eq":
+                    ok = value == operand
+                elif operator == "$ne":
+                    ok = value != operand
+                elif operator == "$in" and isinstance(operand, list):
+                    ok = value in operand
+                elif operator in ("$gt", "$gte", "$lt", "$lte") and _is_number(operand):
+                    if not _is_number(value):
+                        return False
+                    ok = {"$gt": value > operand, "$gte": value >= operand,
+                          "$lt": value < operand, "$lte": value <= operand}[operator]
+                else:
+                    raise Unsupported(f"{operator} après $group")
+                if not ok:
+                    return False
+        return True
+
+    if not isinstance(query, dict) or any(path.startswith("$") for path in query):
+        raise Unsupported("$match après $group")
+    return [row for row in rows if matches(row, query)]
+
+
+def _rows_project(rows: List[Dict], spec: Any) -> List[Dict]:
+    if not isinstance(spec, dict) or not spec:
+        raise Unsupported("$project")
+    fields = {name: value for name, value in spec.items() if name != "_id"}
+    exclusion = bool(fields) and all(value in (0, False) for value in fields.values())
+    if any("." in name for name in spec):
+        raise Unsupported("$project sur un sous-champ")
+    keep_id = spec.get("_id", 1) not in (0, False)
+    projected = []
+    for row in rows:
+        if exclusion:
+            item = {name: value for name, value in row.items() if name not in fields}
+        else:
+            item = {"_id": row["_id"]} if "_id" in row else {}
+            for name, value in fields.items():
+                if value in (1, True):
+                    if name in row:
+                        item[name] = row[name]
+                elif isinstance(value, str) and value.startswith("$"):
+                    computed = _lookup(row, value[1:])
+                    if computed is not _MISSING:
+                        item[name] = computed
+                else:
+                    raise Unsupported("$project avec une expression")
+        if not keep_id:
+            item.pop("_id", None)
+        elif "_id" in spec and isinstance(spec["_id"], str) and spec["_id"].startswith("$"):
+            item["_id"] = _row_value(row, spec["_id"][1:])
+        projected.append(item)
+    return projected
+
+
+def _rows_group(rows: List[Dict], spec: Any) -> List[Dict]:
+    if not isinstance(spec, dict) or "_id" not in spec:
+        raise Unsupported("$group")
+
+    def key_of(row: Dict) -> Any:
+        key_spec = spec["_id"]
+        if isinstance(key_spec, str) and key_spec.startswith("$"):
+            return _row_value(row, key_spec[1:])
+        if isinstance(key_spec, dict):
+            if any(name.startswith("$") for name in key_spec):
+                raise Unsupported("expression dans la clé de $group")
+            return {name: _row_value(row, path[1:]) if isinstance(path, str) and path.startswith("$") else path
+                    for name, path in key_spec.items()}
+        return key_spec
+
+    groups: Dict[str, Tuple[Any, List[Dict]]] = {}
+    for row in rows:
+        key = key_of(row)
+        groups.setdefault(json.dumps(key, sort_keys=True, default=str), (key, []))[1].append(row)
+
+    result = []
+    for key, members in groups.values():
+        item = {"_id": key}
+        for name, accumulator in spec.items():
+            if name == "_id":
+                continue
+            if not isinstance(accumulator, dict) or len(accumulator) != 1:
+                raise Unsupported(f"accumulateur {accumulator!r}")
+            operator, operand = next(iter(accumulator.items()))
+            if operator == "$count" and operand == {}:
+                item[name] = len(members)
+                continue
+            if operator == "$sum" and _is_number(operand):
+                item[name] = len(members) * operand
+                continue
+            if not (isinstance(operand, str) and operand.startswith("$")):
+                raise Unsupported(f"{operator} {operand!r}")
+            values = [_row_value(member, operand[1:]) for member in members]
+            if operator in ("$first", "$last"):
+                item[name] = values[0] if operator == "$first" else values[-1]
+                continue
+            numbers = [value for value in values if _is_number(value)]
+            if any(value is not None and not _is_number(value) for value in values) and operator in ("$min", "$max"):
+                raise Unsupported(f"{operator} sur des valeurs non numériques")
+            if operator == "$sum":
+                item[name] = sum(numbers)
+            elif operator == "$avg":
+                item[name] = sum(numbers) / len(numbers) if numbers else None
+            elif operator in ("$min", "$max"):
+                item[name] = (min if operator == "$min" else max)(numbers) if numbers else None
+            else:
+                raise Unsupported(f"accumulateur {operator}")
+        result.append(item)
+    return result
+
+
+def _stage(stage: Any) -> Tuple[str, Any]:
+    if not isinstance(stage, dict) or len(stage) != 1:
+        raise Unsupported("étape invalide")
+    return next(iter(stage.items()))
+
+
+def run_pipeline(snapshot: ColumnarSnapshot, pipeline: Any, max_results: int = PIPELINE_MAX_RESULTS) -> List[Dict]:
+    """
+    Exécute un pipeline sur l'instantané
+
+    Raises:
+        Unsupported: une étape, un opérateur ou un champ n'est pas pris en charge
+    """
+    if not isinstance(pipeline, list) or not pipeline:
+        raise Unsupported("pipeline vide")
+    frame = _Frame(np.arange(snapshot.size))
+    rows: Optional[List[Dict]] = None
+    for stage in pipeline:
+        name, spec = _stage(stage)
+        if rows is None:
+            # Documents de la collection : étapes vectorisées
+            if name == "$match":
+                frame = frame.take(_match(snapshot, frame, spec))
+            elif name == "$unwind":
+                frame = _unwind(snapshot, frame, spec)
+            elif name == "$group":
+                rows = _group(snapshot, frame, spec)
+            elif name == "$count" and isinstance(spec, str):
+                rows = [{spec: len(frame)}] if len(frame) else []
+            else:
+                raise Unsupported(f"{name} avant $group")
+        elif name == "$sort":
+            rows = _rows_sort(rows, spec)
+        elif name == "$limit" and isinstance(spec, int) and spec > 0:
+            rows = rows[:spec]
+        elif name == "$skip" and isinstance(spec, int) and spec >= 0:
+            rows = rows[spec:]
+        elif name == "$match":
+            rows = _rows_match(rows, spec)
+        elif name == "$project":
+            rows = _rows_project(rows, spec)
+        elif name == "$group":
+            rows = _rows_group(rows, spec)
+        elif name == "$count" and isinstance(spec, str):
+            rows = [{spec: len(rows)}] if rows else []
+        else:
+            raise Unsupported(f"{name} après $group")
+    if rows is None:
+        raise Unsupported("pipeline retournant des documents")
+    return rows[:max_results] if max_results else rows
+
+
+class ColumnarEngine:
+    """
+    Instantané colonnaire de la collection, partagé par toutes les sessions
+
+    execute() retourne None tant que l'instantané n'est pas prêt ou si le
+    pipeline sort du sous-ensemble pris en charge : l'appelant exécute
+    alors la requête sur MongoDB.
+    """
+
+    def __init__(self, collection, refresh_interval: int = COLUMNAR_REFRESH_INTERVAL):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.snapshot: Optional[ColumnarSnapshot] = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.executed = 0
+        self.fallbacks = 0
+        self.last_fallback_reason: Optional[str] = None
+
+    def refresh(self) -> ColumnarSnapshot:
+        """Relit les champs analytiques de la collection et remplace l'instantané"""
+        snapshot = ColumnarSnapshot.from_collection(self.collection)
+        self.snapshot = snapshot
+        return snapshot
+
+    def refresh_in_background(self):
+        """Reconstruit l'instantané dans un thread de fond (un seul à la fois)"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="columnar-snapshot", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Erreur lors de la construction de l'instantané colonnaire: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def execute(self, pipeline: Any) -> Optional[List[Dict]]:
+        """Résultats du pipeline calculés localement, ou None (MongoDB)"""
+        snapshot = self.snapshot
+        if snapshot is None or time.time() - snapshot.built_at > self.refresh_interval:
+            self.refresh_in_background()
+        if snapshot is None:
+            return None
+        try:
+            rows = run_pipeline(snapshot, pipeline)
+        except Unsupported as e:
+            with self._lock:
+                self.fallbacks += 1
+                self.last_fallback_reason = str(e)
+            return None
+        with self._lock:
+            self.executed += 1
+        return rows
+
+    def stats(self) -> Dict:
+        snapshot = self.snapshot
+        return {
+            "documents": snapshot.size if snapshot else 0,
+            "age_seconds": round(time.time() - snapshot.built_at, 1) if snapshot else None,
+            "executed": self.executed,
+            "fallbacks": self.fallbacks,
+            "last_fallback_reason": self.last_fallback_reason,
+        }
+
+
+# --- Vérification d'équivalence avec MongoDB ---
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if _is_number(value):
+        return round(float(value), 9)
+    return value
+
+
+def _canonical(row: Dict) -> str:
+    return json.dumps(row, sort_keys=True, default=str)
+
+
+def results_equivalent(expected: List[Dict], actual: List[Dict], sort_fields: Optional[List[str]] = None) -> bool:
+    """
+    Mêmes résultats, nombres à 1e-9 près
+
+    Sans sort_fields, l'ordre est libre. Avec, les clés de tri doivent se
+    suivre dans le même ordre ; les lignes à égalité sont comparées comme un
+    ensemble, sauf au dernier rang (égalités coupées par $limit), où seul
+    leur nombre compte.
+    """
+    expected, actual = _normalize(expected), _normalize(actual)
+    if len(expected) != len(actual):
+        return False
+    if not sort_fields:
+        return sorted(map(_canonical, expected)) == sorted(map(_canonical, actual))
+
+    def by_sort_key(rows: List[Dict]) -> Dict[str, List[str]]:
+        groups: Dict[str, List[str]] = {}
+        for row in rows:
+            key = _canonical([_row_value(row, field) for field in sort_fields])
+            groups.setdefault(key, []).append(_canonical(row))
+        return groups
+
+    def sort_keys(rows: List[Dict]) -> List[str]:
+        return [_canonical([_row_value(row, field) for field in sort_fields]) for row in rows]
+
+    if sort_keys(expected) != sort_keys(actual):
+        return False
+    boundary = sort_keys(expected)[-1] if expected else None
+    expected_groups, actual_groups = by_sort_key(expected), by_sort_key(actual)
+    return all(sorted(rows) == sorted(actual_groups[key])
+               for key, rows in expected_groups.items() if key != boundary)
+
+
+def _final_sort(pipeline: List[Dict]) -> Optional[List[str]]:
+    """Champs du $sort qui fixe l'ordre du résultat (None si l'ordre est libre)"""
+    sort_fields = None
+    for stage in pipeline:
+        name, spec = next(iter(stage.items()))
+        if name == "$sort":
+            sort_fields = list(spec)
+        elif name in ("$group", "$unwind"):
+            sort_fields = None
+    return sort_fields
+
+
+def equivalence_pipelines() -> List[List[Dict]]:
+    """Pipelines de référence : moteur d'intentions et réponses enregistrées du benchmark"""
+    from intent_engine import match_intent
+    questions = [
+        "Combien de films sont sortis entre 2012 et 2014 ?",
+        "Quelle est la note moyenne des films parus en 2015 ?",
+        "Note moyenne par année entre 2000 et 2010",
+        "Nombre de films par année depuis 2005",
+        "Quels sont les 5 réalisateurs qui ont produit le plus de films entre 2000 et 2015 ?",
+        "Quels sont les 10 genres les plus fréquents ?",
+        "Quel est le genre le plus populaire par décennie entre 1970 et 2010 ?",
+        "Combien de films de genre Comedy en 2010 ?",
+        "Combien de films au total ?",
+    ]
+    pipelines = []
+    for question in questions:
+        query_info = match_intent(question)
+        if query_info and query_info["query_type"] == "aggregate":
+            pipelines.append(query_info["mongodb_query"])
+    pipelines += [
+        [{"$match": {"imdb.votes": {"$gte": 1000}}}, {"$group": {"_id": "$rated", "films": {"$sum": 1},
+                                                                "votes": {"$sum": "$imdb.votes"},
+                                                                "best": {"$max": "$imdb.rating"}}},
+         {"$sort": {"films": -1, "_id": 1}}],
+        [{"$unwind": "$countries"}, {"$match": {"countries": {"$in": ["France", "Italy"]}}},
+         {"$group": {"_id": {"country": "$countries", "year": "$year"}, "runtime": {"$avg": "$runtime"}}},
+         {"$match": {"_id.year": {"$gte": 2000}}}, {"$sort": {"_id.year": 1, "_id.country": 1}}],
+        [{"$match": {"year": {"$gte": 1995, "$lte": 2005}}}, {"$unwind": "$genres"},
+         {"$group": {"_id": {"year": "$year", "genre": "$genres"}, "films": {"$sum": 1}}},
+         {"$sort": {"_id": 1}}],
+        [{"$match": {"genres": {"$ne": "Drama"}, "year": {"$gte": 1990, "$lt": 2000}}},
+         {"$group": {"_id": None, "films": {"$sum": 1}, "metacritic": {"$avg": "$metacritic"}}}],
+    ]
+    try:
+        with open("bench_questions.json", "r", encoding="utf-8") as f:
+            for item in json.load(f):
+                response = item.get("response") or {}
+                if response.get("query_type") == "aggregate":
+                    pipelines.append(response["mongodb_query"])
+    except (OSError, ValueError):
+        pass
+    return pipelines
+
+
+def check_equivalence(collection, snapshot: Optional[ColumnarSnapshot] = None,
+                      pipelines: Optional[List[List[Dict]]] = None) -> List[Dict]:
+    """
+    Compare les résultats locaux à ceux de MongoDB pour chaque pipeline
+
+    Returns:
+        Une entrée par pipeline : status "identique", "différent" ou
+        "MongoDB" (hors sous-ensemble), et les durées des deux exécutions
+    """
+    snapshot = snapshot or ColumnarSnapshot.from_collection(collection)
+    report = []
+    for pipeline in pipelines if pipelines is not None else equivalence_pipelines():
+        started = time.perf_counter()
+        expected = list(collection.aggregate(pipeline))
+        mongo_ms = (time.perf_counter() - started) * 1000
+        entry = {"pipeline": pipeline, "mongo_ms": round(mongo_ms, 3)}
+        started = time.perf_counter()
+        try:
+            actual = run_pipeline(snapshot, pipeline)
+        except Unsupported as e:
+            entry.update(status="MongoDB", reason=str(e))
+            report.append(entry)
+            continue
+        entry["columnar_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        identical = results_equivalent(expected, actual, _final_sort(pipeline))
+        entry["status"] = "identique" if identical else "différent"
+        if not identical:
+            entry.update(expected=expected[:5], actual=actual[:5])
+        report.append(entry)
+    return report
+
+
+_shared_engine = None
+_shared_engine_lock = threading.Lock()
+
+
+def get_columnar_engine(collection=None) -> Optional[ColumnarEngine]:
+    """
+    Retourne le moteur colonnaire partagé du processus
+
+    Returns:
+        ColumnarEngine (instantané construit en arrière-plan), ou None si
+        le moteur est désactivé ou NumPy absent
+    """
+    global _shared_engine
+    if not COLUMNAR_ENGINE_ENABLED:
+        return None
+    if np is None:
+        print("Moteur colonnaire ignoré : pip install numpy")
+        return None
+    with _shared_engine_lock:
+        if _shared_engine is None and collection is not None:
+            _shared_engine = ColumnarEngine(collection)
+            _shared_engine.refresh_in_background()
+        return _shared_engine
+
+
+def main():
+    """Vérification d'équivalence avec MongoDB (python columnar_engine.py --check)"""
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Moteur d'agrégation colonnaire en mémoire")
+    parser.add_argument("--uri", default=MONGODB_URI, help="Chaîne de connexion")
+    parser.add_argument("--check", action="store_true", help="Comparer les résultats locaux à MongoDB")
+    args = parser.parse_args()
+    if np is None:
+        raise SystemExit("❌ NumPy non installé : pip install numpy")
+
+    client = MongoClient(args.uri or "mongodb://localhost:27017")
+    collection = client[MONGODB_DATABASE][MONGODB_COLLECTION]
+    started = time.perf_counter()
+    snapshot = ColumnarSnapshot.from_collection(collection)
+    print(f"📦 Instantané de {snapshot.size} films construit en {time.perf_counter() - started:.1f} s")
+    if args.check:
+        report = check_equivalence(collection, snapshot)
+        for entry in report:
+            stages = " → ".join(next(iter(stage)) for stage in entry["pipeline"])
+            if entry["status"] == "MongoDB":
+                print(f"↪️  {stages} : exécuté par MongoDB ({entry['reason']})")
+            else:
+                icon = "✅" if entry["status"] == "identique" else "❌"
+                print(f"{icon} {stages} : {entry['mongo_ms']:.1f} ms MongoDB, {entry['columnar_ms']:.2f} ms local")
+        different = sum(1 for entry in report if entry["status"] == "différent")
+        if different:
+            raise SystemExit(f"❌ {different} pipelines aux résultats différents")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
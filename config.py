@@ -7,12 +7,111 @@ load_dotenv()
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
 PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
 PERPLEXITY_MODEL = "sonar"  # Modèle optimisé pour la recherche avec grounding
+FORMAT_STREAMING = os.getenv("FORMAT_STREAMING", "true").lower() == "true"  # Affichage progressif de la réponse
+LOCAL_FORMATTER_ENABLED = os.getenv("LOCAL_FORMATTER_ENABLED", "true").lower() == "true"  # Résultats simples mis en forme sans LLM
+FORMAT_RESULTS_TOKEN_BUDGET = int(os.getenv("FORMAT_RESULTS_TOKEN_BUDGET", "2000"))  # au-delà : résumé statistique
+
+# Transport HTTP vers l'API Perplexity
+PERPLEXITY_CONNECT_TIMEOUT = float(os.getenv("PERPLEXITY_CONNECT_TIMEOUT", "5"))  # secondes
+PERPLEXITY_READ_TIMEOUT = float(os.getenv("PERPLEXITY_READ_TIMEOUT", "60"))  # secondes entre deux octets reçus
+PERPLEXITY_MAX_RETRIES = int(os.getenv("PERPLEXITY_MAX_RETRIES", "3"))
+PERPLEXITY_BACKOFF_BASE = float(os.getenv("PERPLEXITY_BACKOFF_BASE", "0.5"))  # secondes
+PERPLEXITY_BACKOFF_MAX = float(os.getenv("PERPLEXITY_BACKOFF_MAX", "20"))  # secondes
+PERPLEXITY_POOL_SIZE = int(os.getenv("PERPLEXITY_POOL_SIZE", "20"))
+
+# Limiteur de débit côté client (quotas de l'API, file de priorité interface > lots > préchargement)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+PERPLEXITY_RATE_LIMIT_RPM = float(os.getenv("PERPLEXITY_RATE_LIMIT_RPM", "50"))  # requêtes par minute, 0 = sans limite
+PERPLEXITY_RATE_LIMIT_TPM = float(os.getenv("PERPLEXITY_RATE_LIMIT_TPM", "0"))  # tokens par minute, 0 = sans limite
+PERPLEXITY_CONCURRENCY_INITIAL = int(os.getenv("PERPLEXITY_CONCURRENCY_INITIAL", "4"))  # appels simultanés au départ (AIMD)
+PERPLEXITY_CONCURRENCY_MAX = int(os.getenv("PERPLEXITY_CONCURRENCY_MAX", os.getenv("PERPLEXITY_POOL_SIZE", "20")))
+PERPLEXITY_LATENCY_TARGET = float(os.getenv("PERPLEXITY_LATENCY_TARGET", "15"))  # secondes avant réponse, au-delà : concurrence réduite
+PERPLEXITY_QUEUE_TIMEOUT = float(os.getenv("PERPLEXITY_QUEUE_TIMEOUT", "60"))  # secondes d'attente maximale dans la file
+
+# Exécution asynchrone : nombre maximal de questions traitées simultanément
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "8"))
+
+# Traitement par lots (batch_runner.py) : questions traitées simultanément, à garder sous PERPLEXITY_POOL_SIZE
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
 
 # Configuration MongoDB
 MONGODB_URI = os.getenv("MONGODB_URI")
 MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "sample_mflix")
 MONGODB_COLLECTION = os.getenv("MONGODB_COLLECTION", "movies")
 
+# Pool de connexions partagé par toutes les sessions
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "60000"))  # fermeture des connexions inactives
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+
+# Garde-fous appliqués aux pipelines d'agrégation avant exécution
+PIPELINE_MAX_RESULTS = int(os.getenv("PIPELINE_MAX_RESULTS", "1000"))  # 0 = pas de plafond
+PIPELINE_MAX_TIME_MS = int(os.getenv("PIPELINE_MAX_TIME_MS", "15000"))  # 0 = pas de limite
+PIPELINE_ALLOW_DISK_USE = os.getenv("PIPELINE_ALLOW_DISK_USE", "true").lower() == "true"
+PIPELINE_BATCH_SIZE = int(os.getenv("PIPELINE_BATCH_SIZE", "500"))
+
+# Collections de cumul (rollups) servant les agrégations courantes
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+ROLLUPS_WATCH_CHANGES = os.getenv("ROLLUPS_WATCH_CHANGES", "false").lower() == "true"  # change streams
+ROLLUPS_REFRESH_INTERVAL = int(os.getenv("ROLLUPS_REFRESH_INTERVAL", "60"))  # secondes entre deux rafraîchissements
+ROLLUPS_MAX_AGE = int(os.getenv("ROLLUPS_MAX_AGE", "3600"))  # sans suivi des modifications, cumuls plus anciens ignorés (0 = pas de limite)
+
+# Conseiller d'index : fraction des requêtes rejouées avec explain() (0 pour désactiver)
+INDEX_ADVISOR_SAMPLE_RATE = float(os.getenv("INDEX_ADVISOR_SAMPLE_RATE", "0.1"))
+INDEX_ADVISOR_PROFILE_PATH = os.getenv("INDEX_ADVISOR_PROFILE_PATH", ".cache/index_profile.json")
+
+# Schéma de la collection déduit d'un échantillon ($sample), mis en cache sur disque
+SCHEMA_SAMPLE_SIZE = int(os.getenv("SCHEMA_SAMPLE_SIZE", "500"))
+SCHEMA_CACHE_PATH = os.getenv("SCHEMA_CACHE_PATH", ".cache/schema_summary.json")
+SCHEMA_MAX_AGE = int(os.getenv("SCHEMA_MAX_AGE", "86400"))  # secondes avant rafraîchissement en arrière-plan
+
+# Statistiques de la collection (nombre estimé, collStats) mises en cache pour le processus
+STATS_REFRESH_INTERVAL = int(os.getenv("STATS_REFRESH_INTERVAL", "300"))  # secondes
+
+# Moteur d'agrégation colonnaire en mémoire (NumPy), à activer après « python columnar_engine.py --check »
+COLUMNAR_ENGINE_ENABLED = os.getenv("COLUMNAR_ENGINE_ENABLED", "false").lower() == "true"
+COLUMNAR_REFRESH_INTERVAL = int(os.getenv("COLUMNAR_REFRESH_INTERVAL", "600"))  # secondes avant reconstruction de l'instantané
+
+# Pagination des résultats ("Voir les données brutes")
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "50"))
+
+# Préchargement des réponses aux questions d'exemple et préchargement spéculatif
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_INTERVAL = int(os.getenv("WARMUP_INTERVAL", "3600"))  # secondes entre deux recalculs, 0 = au démarrage seulement
+PREFETCH_MIN_PREFIX = int(os.getenv("PREFETCH_MIN_PREFIX", "12"))  # caractères saisis avant préchargement
+PREFETCH_MAX_CANDIDATES = int(os.getenv("PREFETCH_MAX_CANDIDATES", "2"))
+
+# Questions de suivi (« et pour 2016 ? ») traitées en modifiant la requête précédente de la session
+FOLLOW_UP_ENABLED = os.getenv("FOLLOW_UP_ENABLED", "true").lower() == "true"
+FOLLOW_UP_MAX_WORDS = int(os.getenv("FOLLOW_UP_MAX_WORDS", "8"))  # au-delà, la question est traitée comme indépendante
+
+# Exemples de traduction insérés dans le prompt (sélection BM25 des k plus proches)
+EXAMPLE_STORE_PATH = os.getenv("EXAMPLE_STORE_PATH", ".cache/examples.jsonl")  # chaîne vide : exemples de départ seuls
+EXAMPLE_STORE_K = int(os.getenv("EXAMPLE_STORE_K", "3"))
+EXAMPLE_STORE_MAX_ENTRIES = int(os.getenv("EXAMPLE_STORE_MAX_ENTRIES", "2000"))  # au-delà, les plus anciennes sont retirées
+EXAMPLE_STORE_RECORD = os.getenv("EXAMPLE_STORE_RECORD", "true").lower() == "true"  # Traductions réussies ajoutées aux exemples
+
+# Télémétrie : étapes chronométrées, compteurs et export
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() == "true"
+TELEMETRY_METRICS_PORT = int(os.getenv("TELEMETRY_METRICS_PORT", "0"))  # endpoint /metrics Prometheus, 0 = désactivé
+TELEMETRY_RECENT_TRACES = int(os.getenv("TELEMETRY_RECENT_TRACES", "1000"))  # traces conservées pour les percentiles
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")  # ex. http://localhost:4318 (collecteur local)
+
+# Regroupement des appels identiques simultanés (traduction, exécution, formatage) entre sessions
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", "120"))  # secondes d'attente maximale d'un appel regroupé
+
+# Cache persistant des traductions question → requête (chaîne vide pour désactiver)
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", ".cache/query_cache.sqlite3")
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "86400"))  # secondes, 0 = sans expiration
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "5000"))
+
+# Cache mémoire des résultats MongoDB partagé par les sessions (0 pour désactiver)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "3600"))  # secondes, 0 = sans expiration
+RESULT_CACHE_WATCH_CHANGES = os.getenv("RESULT_CACHE_WATCH_CHANGES", "false").lower() == "true"
+
 # Configuration de l'application
 APP_TITLE = "🎬 Chatbot Analytique MongoDB Movies"
 APP_DESCRIPTION = """
@@ -21,4 +120,14 @@ Outil d'analyse de données cinématographiques utilisant l'intelligence artific
 
 # Métadonnées SEO
 APP_KEYWORDS = "analyse données cinéma, MongoDB, business intelligence, statistiques films, outil professionnel"
-APP_AUTHOR = "Data Factory - Christopher M."
\ No newline at end of file
+APP_AUTHOR = "Data Factory - Christopher M."
+
+# Questions d'exemple proposées sur la page d'accueil (réponses préchargées)
+EXAMPLE_QUESTIONS = [
+    "Quelle est la note moyenne des films parus en 2015 ?",
+    "Quels sont les 5 réalisateurs qui ont produit le plus de films entre 2000 et 2015 ?",
+    "Combien de films sont sortis entre 2012 et 2014 ?",
+    "Quel est le premier film paru en 2016 et qui l'a réalisé ?",
+    "Peux-tu me montrer le contenu d'un document de la collection ?",
+    "Quel est le genre le plus populaire par décennie entre 1970 et 2010 ?"
+]
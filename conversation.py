@@ -0,0 +1,246 @@
+"""
+Questions de suivi : modification de la requête précédente de la session
+
+« Note moyenne des films de 2015 ? » puis « et pour 2016 ? » ou « et
+seulement les drames ? » : la deuxième question ne change qu'une valeur ou
+ajoute un filtre. Plutôt qu'une nouvelle traduction complète, la requête
+précédente est modifiée localement (intention reconstruite avec les
+nouveaux paramètres, ou littéraux remplacés dans le pipeline) ; à défaut,
+un court prompt de modification est envoyé au LLM avec la requête
+précédente.
+"""
+import copy
+import re
+from typing import Dict, Optional
+from config import FOLLOW_UP_ENABLED, FOLLOW_UP_MAX_WORDS
+from intent_engine import (
+    GENRE_ALIASES, IntentEngine, build_intent, match_intent, parameter_filters, unknown_words
+)
+from query_cache import normalize_question
+import telemetry
+
+
+# Marqueurs de continuation qui rattachent une question courte à la précédente
+_FOLLOW_UP_RE = re.compile(
+    r"^(et|mais|pareil|idem|meme chose|meme question|maintenant|seulement|uniquement|juste|plutot)\b"
+)
+# Mots propres aux questions de suivi, hors vocabulaire des modèles de questions
+FOLLOW_UP_WORDS = frozenset("""
+    et mais pareil idem meme chose question maintenant seulement uniquement juste plutot aussi alors
+    ensuite puis sinon fois cas limite limiter garde garder premiers premieres resultats
+""".split())
+# Sans marqueur, seule une question réduite à ses paramètres (« en 2016 ? », « pour les drames ? ») est un suivi
+_PARAMETER_ONLY_WORDS = frozenset("""
+    pour en de des du d les le la l entre et depuis a au aux sur avec que qu annee annees film films top
+""".split()) | frozenset(word for alias in GENRE_ALIASES for word in re.findall(r"[a-z0-9]+", alias))
+
+# Étapes après lesquelles les champs ne sont plus ceux des documents de la collection
+_RESHAPING_STAGES = {"$group", "$project", "$replaceRoot", "$replaceWith", "$bucket", "$bucketAuto",
+                     "$facet", "$sortByCount", "$count", "$unset", "$addFields", "$set", "$lookup"}
+
+
+class Turn:
+    """Question traitée de la session et requête exécutée"""
+
+    def __init__(self, question: str, query_info: Dict):
+        self.question = question
+        self.query_info = query_info
+
+
+class FollowUp:
+    """
+    Question de suivi reconnue
+
+    question: question complète (question précédente + suivi), pour le
+        formatage de la réponse
+    changes: paramètres modifiés (year, year_range, genre, director, n)
+    query_info: requête modifiée localement, ou None si le LLM doit
+        modifier la requête précédente
+    method: "intent", "patch" ou "llm"
+    """
+
+    def __init__(self, text: str, previous: Turn, changes: Dict,
+                 query_info: Optional[Dict], method: str):
+        self.text = text
+        self.previous = previous
+        self.question = f"{previous.question} — {text}"
+        self.changes = changes
+        self.query_info = query_info
+        self.method = method
+
+    def describe(self) -> str:
+        """Modification appliquée, pour les détails de l'analyse"""
+        if self.method == "llm":
+            return "requête précédente modifiée par le LLM"
+        labels = {"year": "année", "year_range": "années", "genre": "genre", "director": "réalisateur", "n": "nombre"}
+        changes = ", ".join(
+            f"{labels[key]} → {'-'.join(map(str, value)) if isinstance(value, (list, tuple)) else value}"
+            for key, value in self.changes.items()
+        )
+        return f"requête précédente modifiée localement ({changes})"
+
+
+def _replace_filters(match: Dict, filters: Dict) -> Optional[bool]:
+    """
+    Remplace dans un $match les conditions des champs de filters
+
+    Returns:
+        True si au moins un champ a été remplacé, None si l'un d'eux est
+        imbriqué dans $and/$or/$nor (modification confiée au LLM)
+    """
+    for operator in ("$and", "$or", "$nor"):
+        for condition in match.get(operator, []):
+            if isinstance(condition, dict) and filters.keys() & _fields(condition):
+                return None
+    replaced = False
+    for field, condition in filters.items():
+        if field in match:
+            match[field] = condition
+            replaced = True
+    return replaced
+
+
+def _fields(condition: Dict) -> set:
+    fields = set()
+    for key, value in condition.items():
+        if key in ("$and", "$or", "$nor"):
+            for item in value:
+                if isinstance(item, dict):
+                    fields |= _fields(item)
+        elif not key.startswith("$"):
+            fields.add(key)
+    return fields
+
+
+def patch_query(query_info: Dict, changes: Dict) -> Optional[Dict]:
+    """
+    Applique les paramètres modifiés à une requête find ou aggregate
+
+    Les filtres (années, genre, réalisateur) remplacent les conditions
+    existantes sur le même champ dans les $match qui précèdent le premier
+    regroupement, ou sont ajoutés au $match de tête ; n remplace la valeur
+    du dernier $limit.
+
+    Returns:
+        query_info modifié (copie), ou None si la requête ne se prête pas à
+        une modification locale
+    """
+    query_type = query_info.get("query_type")
+    query = copy.deepcopy(query_info.get("mongodb_query"))
+    filters = parameter_filters(changes)
+
+    if query_type == "find" and isinstance(query, dict):
+        if "n" in changes or _replace_filters(query, filters) is None:
+            return None
+        query.update(filters)
+    elif query_type == "aggregate" and isinstance(query, list) and query:
+        if filters:
+            remaining = dict(filters)
+            for stage in query:
+                name = next(iter(stage), None) if isinstance(stage, dict) else None
+                if name in _RESHAPING_STAGES:
+                    break
+                if name == "$match":
+                    replaced = _replace_filters(stage["$match"], remaining)
+                    if replaced is None:
+                        return None
+                    remaining = {field: condition for field, condition in remaining.items()
+                                 if field not in stage["$match"]}
+            if remaining:
+                if "$match" in query[0]:
+                    query[0]["$match"].update(remaining)
+                else:
+                    query.insert(0, {"$match": remaining})
+        if "n" in changes:
+            limits = [stage for stage in query if isinstance(stage, dict) and "$limit" in stage]
+            if not limits:
+                return None
+            limits[-1]["$limit"] = changes["n"]
+    else:
+        return None
+
+    patched = dict(query_info)
+    patched["mongodb_query"] = query
+    patched.pop("intent", None)
+    patched.pop("parameters", None)
+    return patched
+
+
+def _merge_parameters(parameters: Dict, changes: Dict) -> Dict:
+    merged = {key: tuple(value) if isinstance(value, list) else value for key, value in parameters.items()}
+    if "year" in changes or "year_range" in changes:
+        merged.pop("year", None)
+        merged.pop("year_range", None)
+    merged.update(changes)
+    return merged
+
+
+class Conversation:
+    """
+    Dernière requête exécutée d'une session (st.session_state.conversation)
+
+    Seule la dernière question compte : une question de suivi d'une
+    question de suivi s'applique à la requête déjà modifiée.
+    """
+
+    def __init__(self, max_words: int = FOLLOW_UP_MAX_WORDS):
+        self.max_words = max_words
+        self.last: Optional[Turn] = None
+
+    def record(self, question: str, query_info: Dict):
+        """Mémorise la requête exécutée pour la question (requêtes valides seulement)"""
+        if query_info.get("query_type") in ("find", "aggregate"):
+            self.last = Turn(question, query_info)
+
+    def reset(self):
+        self.last = None
+
+    def follow_up(self, user_question: str) -> Optional[FollowUp]:
+        """
+        Reconnaît une question de suivi de la question précédente
+
+        Returns:
+            FollowUp avec la requête modifiée (ou à faire modifier par le
+            LLM), ou None pour une question indépendante
+        """
+        if not FOLLOW_UP_ENABLED or self.last is None:
+            return None
+        text = normalize_question(user_question)
+        words = re.findall(r"[a-z0-9]+", text)
+        if not words or len(words) > self.max_words:
+            return None
+        # Question complète à elle seule (« et combien de films en 2016 ? »)
+        if match_intent(user_question):
+            return None
+
+        changes, leftover = IntentEngine.extract_parameters(text)
+        if not _FOLLOW_UP_RE.match(text):
+            # « En quelle année... », « De quels pays... » : question indépendante
+            director_words = set(re.findall(r"[a-z0-9]+", (changes or {}).get("director", "")))
+            if not changes or leftover or any(not word.isdigit() and word not in _PARAMETER_ONLY_WORDS
+                                              and word not in director_words for word in words):
+                return None
+        unknown = [word for word in unknown_words(text, changes or {}) if word not in FOLLOW_UP_WORDS]
+        if changes is None or leftover:
+            return self._resolved(user_question, {}, None, "llm")
+        if unknown:
+            # « et seulement les films français ? » : critère non reconnu, modifié par le LLM avec la requête précédente
+            return self._resolved(user_question, changes, None, "llm")
+        if not changes:
+            return None
+
+        previous = self.last.query_info
+        if previous.get("intent"):
+            query_info = build_intent(previous["intent"], _merge_parameters(previous.get("parameters", {}), changes))
+            if query_info:
+                return self._resolved(user_question, changes, query_info, "intent")
+        query_info = patch_query(previous, changes)
+        if query_info:
+            query_info["explanation"] = f"{previous.get('explanation', '')} (modifiée : {user_question.strip()})"
+            return self._resolved(user_question, changes, query_info, "patch")
+        return self._resolved(user_question, changes, None, "llm")
+
+    def _resolved(self, text: str, changes: Dict, query_info: Optional[Dict], method: str) -> FollowUp:
+        telemetry.increment("mbot_follow_ups_total", method=method)
+        return FollowUp(text.strip(), self.last, changes, query_info, method)
+
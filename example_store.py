@@ -0,0 +1,258 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+from config import EXAMPLE_STORE_PATH, EXAMPLE_STORE_K, EXAMPLE_STORE_MAX_ENTRIES
+from query_cache import normalize_question
+
+
+# Exemples de départ (question, requête validée), complétés par les traductions réussies
+SEED_EXAMPLES = [
+    {"question": "Montre-moi un document de la collection",
+     "query_type": "find", "mongodb_query": {}},
+    {"question": "Combien de films sont sortis entre 2012 et 2014 ?",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$match": {"year": {"$gte": 2012, "$lte": 2014}}}, {"$count": "total"}]},
+    {"question": "Quels sont les 5 réalisateurs les plus prolifiques ?",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$unwind": "$directors"}, {"$group": {"_id": "$directors", "count": {"$sum": 1}}},
+                       {"$sort": {"count": -1}}, {"$limit": 5}]},
+    {"question": "Note moyenne des films par année entre 2005 et 2010",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$match": {"year": {"$gte": 2005, "$lte": 2010}, "imdb.rating": {"$exists": True}}},
+                       {"$group": {"_id": "$year", "avgRating": {"$avg": "$imdb.rating"}}}, {"$sort": {"_id": 1}}]},
+    {"question": "Quels films avec Tom Hanks ont la meilleure note ?",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$match": {"cast": "Tom Hanks", "imdb.rating": {"$type": "number"}}},
+                       {"$sort": {"imdb.rating": -1}}, {"$limit": 10},
+                       {"$project": {"title": 1, "year": 1, "imdb.rating": 1}}]},
+    {"question": "Films avec une note supérieure à 8 sortis en 2015",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$match": {"year": 2015, "imdb.rating": {"$gt": 8}}}, {"$sort": {"imdb.rating": -1}},
+                       {"$project": {"title": 1, "imdb.rating": 1}}]},
+    {"question": "Quel est le genre le plus représenté dans les films des années 90 ?",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$match": {"year": {"$gte": 1990, "$lte": 1999}}}, {"$unwind": "$genres"},
+                       {"$group": {"_id": "$genres", "count": {"$sum": 1}}}, {"$sort": {"count": -1}}, {"$limit": 1}]},
+    {"question": "Durée moyenne des films par genre",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$match": {"runtime": {"$type": "number"}}}, {"$unwind": "$genres"},
+                       {"$group": {"_id": "$genres", "avgRuntime": {"$avg": "$runtime"}}}, {"$sort": {"avgRuntime": -1}}]},
+    {"question": "Quels pays produisent le plus de films ?",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$unwind": "$countries"}, {"$group": {"_id": "$countries", "count": {"$sum": 1}}},
+                       {"$sort": {"count": -1}}, {"$limit": 10}]},
+    {"question": "Nombre de films par décennie",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$match": {"year": {"$type": "number"}}},
+                       {"$group": {"_id": {"$multiply": [{"$floor": {"$divide": ["$year", 10]}}, 10]},
+                                   "count": {"$sum": 1}}},
+                       {"$sort": {"_id": 1}}]},
+    {"question": "Films français les mieux notés par les spectateurs de Rotten Tomatoes",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$match": {"countries": "France", "tomatoes.viewer.rating": {"$type": "number"}}},
+                       {"$sort": {"tomatoes.viewer.rating": -1}}, {"$limit": 10},
+                       {"$project": {"title": 1, "year": 1, "tomatoes.viewer.rating": 1}}]},
+    {"question": "Quel film a remporté le plus de récompenses ?",
+     "query_type": "aggregate",
+     "mongodb_query": [{"$sort": {"awards.wins": -1}}, {"$limit": 1},
+                       {"$project": {"title": 1, "year": 1, "awards": 1}}]},
+]
+
+# Mots vides ignorés par l'index (questions normalisées, sans accents)
+STOPWORDS = frozenset("""
+a au aux avec ce ces d dans de des du en est et il la le les l leur ma me mes moi mon ne
+ont ou par pas plus pour qu que quel quelle quelles quels qui sa se ses son sont sur ta
+te tes toi ton tu un une vos votre y peux peut donne montre moi fournis fournit
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Termes d'indexation : question normalisée, mots vides retirés, pluriels simples réduits"""
+    tokens = []
+    for token in _TOKEN_RE.findall(normalize_question(text)):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith(("s", "x")) and not token.isdigit():
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """Index lexical BM25 en mémoire (k1, b : paramètres usuels d'Okapi BM25)"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: List[Counter] = []
+        self.lengths: List[int] = []
+        self.document_frequency: Counter = Counter()
+
+    def add(self, tokens: List[str]):
+        terms = Counter(tokens)
+        self.documents.append(terms)
+        self.lengths.append(len(tokens))
+        self.document_frequency.update(terms.keys())
+
+    def remove(self, position: int):
+        """Retire le document de rang position (les rangs suivants sont décalés)"""
+        terms = self.documents.pop(position)
+        self.lengths.pop(position)
+        self.document_frequency.subtract(terms.keys())
+        self.document_frequency += Counter()
+
+    def scores(self, tokens: List[str]) -> List[float]:
+        count = len(self.documents)
+        if not count:
+            return []
+        average_length = sum(self.lengths) / count or 1
+        scores = [0.0] * count
+        for term in set(tokens):
+            frequency = self.document_frequency.get(term)
+            if not frequency:
+                continue
+            idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for index, terms in enumerate(self.documents):
+                occurrences = terms.get(term)
+                if occurrences:
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / average_length)
+                    scores[index] += idf * occurrences * (self.k1 + 1) / (occurrences + norm)
+        return scores
+
+
+def format_example(example: Dict) -> str:
+    """Une ligne par exemple : question → requête JSON compacte"""
+    query = {"query_type": example["query_type"], "mongodb_query": example["mongodb_query"]}
+    return f"- \"{example['question']}\" → {json.dumps(query, ensure_ascii=False, separators=(',', ':'))}"
+
+
+class ExampleStore:
+    """
+    Exemples de traduction (question, requête validée) et sélection par similarité
+
+    Les exemples de départ sont complétés par les traductions dont
+    l'exécution a renvoyé des résultats, enregistrées dans un fichier JSONL.
+    Au-delà de max_entries traductions apprises, les plus anciennes sont
+    retirées (et le fichier réécrit quand il dépasse le double). Seuls les
+    k exemples les plus proches de la question (BM25) sont insérés dans le
+    prompt.
+    """
+
+    def __init__(self, path: Optional[str] = EXAMPLE_STORE_PATH, k: int = EXAMPLE_STORE_K,
+                 max_entries: int = EXAMPLE_STORE_MAX_ENTRIES):
+        self.path = path
+        self.k = k
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.examples: List[Dict] = []
+        self._keys = set()
+        self.index = BM25Index()
+        self._file_lines = 0
+        for example in SEED_EXAMPLES:
+            self._add(example)
+        self._seeds = len(self.examples)
+        for example in self._load():
+            self._add(example)
+
+    def _load(self) -> List[Dict]:
+        if not self.path or not os.path.exists(self.path):
+            return []
+        examples = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._file_lines += 1
+                    try:
+                        examples.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError as e:
+            print(f"Exemples illisibles ({self.path}): {e}")
+        return examples[-self.max_entries:] if self.max_entries > 0 else []
+
+    def _add(self, example: Dict) -> bool:
+        key = normalize_question(example.get("question", ""))
+        if not key or key in self._keys or example.get("query_type") not in ("find", "aggregate"):
+            return False
+        self._keys.add(key)
+        self.examples.append(example)
+        self.index.add(tokenize(example["question"]))
+        return True
+
+    def add(self, question: str, query_type: str, mongodb_query) -> bool:
+        """
+        Enregistre une traduction validée (exécutée avec des résultats)
+
+        Returns:
+            False si la question est déjà connue (ou max_entries nul)
+        """
+        example = {"question": question, "query_type": query_type, "mongodb_query": mongodb_query}
+        with self._lock:
+            if self.max_entries <= 0 or not self._add(example):
+                return False
+            # Rotation : la plus ancienne traduction apprise laisse sa place
+            while len(self.examples) - self._seeds > self.max_entries:
+                self._remove(self._seeds)
+            if self.path:
+                self._save(example)
+        return True
+
+    def _save(self, example: Dict):
+        """Ajoute l'exemple au fichier, réécrit avec les seuls exemples conservés au-delà de 2 × max_entries lignes"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if self._file_lines < 2 * self.max_entries:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(example, ensure_ascii=False, default=str) + "\n")
+                self._file_lines += 1
+                return
+            learned = self.examples[self._seeds:]
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                for item in learned:
+                    f.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+            os.replace(temporary_path, self.path)
+            self._file_lines = len(learned)
+        except OSError as e:
+            print(f"Erreur lors de l'enregistrement de l'exemple: {e}")
+
+    def _remove(self, position: int):
+        example = self.examples.pop(position)
+        self._keys.discard(normalize_question(example["question"]))
+        self.index.remove(position)
+
+    def select(self, question: str, k: Optional[int] = None) -> List[Dict]:
+        """Les k exemples les plus proches de la question (score BM25 > 0)"""
+        with self._lock:
+            scores = self.index.scores(tokenize(question))
+            ranked = sorted((index for index, score in enumerate(scores) if score > 0),
+                            key=lambda index: -scores[index])
+            return [self.examples[index] for index in ranked[:k or self.k]]
+
+    def render(self, question: str, k: Optional[int] = None) -> str:
+        """Section d'exemples du prompt pour cette question (vide si aucun exemple proche)"""
+        examples = self.select(question, k)
+        if not examples:
+            return ""
+        return "EXEMPLES PROCHES DE LA QUESTION:\n" + "\n".join(format_example(example) for example in examples)
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_example_store() -> ExampleStore:
+    """Retourne le magasin d'exemples partagé du processus"""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = ExampleStore()
+        return _shared_store
@@ -0,0 +1,232 @@
+import random
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from config import (
+    PERPLEXITY_CONNECT_TIMEOUT, PERPLEXITY_READ_TIMEOUT, PERPLEXITY_MAX_RETRIES,
+    PERPLEXITY_BACKOFF_BASE, PERPLEXITY_BACKOFF_MAX, PERPLEXITY_POOL_SIZE
+)
+from rate_limiter import get_rate_limiter
+from result_compactor import estimate_tokens
+
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_local = threading.local()
+
+
+def _current_timings() -> Dict:
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        timings = _local.timings = {}
+    return timings
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Interprète l'en-tête Retry-After (secondes ou date HTTP)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str], base: float, maximum: float) -> float:
+    """
+    Calcule l'attente avant une nouvelle tentative
+
+    Retry-After est respecté s'il est présent (plafonné à maximum), sinon
+    full jitter : tirage uniforme entre 0 et base * 2^attempt.
+    """
+    retry_after_seconds = parse_retry_after(retry_after)
+    if retry_after_seconds is not None:
+        return min(retry_after_seconds, maximum)
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+class _TimedConnectionMixin:
+    """Mesure la résolution DNS et l'établissement TCP/TLS des nouvelles connexions"""
+
+    def connect(self):
+        timings = _current_timings()
+        original_dns_host = self._dns_host
+        started = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(original_dns_host, self.port, 0, socket.SOCK_STREAM)
+            # Connexion à l'adresse résolue : SNI et vérification TLS restent sur self.host
+            self._dns_host = addresses[0][4][0]
+        except OSError:
+            addresses = None
+        resolved = time.perf_counter()
+        timings["dns_ms"] = timings.get("dns_ms", 0.0) + (resolved - started) * 1000
+        try:
+            super().connect()
+        except OSError:
+            if addresses is None:
+                raise
+            # Première adresse injoignable : laisser urllib3 essayer toutes les adresses
+            self._dns_host = original_dns_host
+            super().connect()
+        finally:
+            self._dns_host = original_dns_host
+        timings["connect_ms"] = timings.get("connect_ms", 0.0) + (time.perf_counter() - resolved) * 1000
+        timings["new_connections"] = timings.get("new_connections", 0) + 1
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """Adaptateur requests dont les pools utilisent les connexions chronométrées"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class HTTPTransport:
+    """
+    Transport HTTP mutualisé pour les appels LLM
+
+    Session keep-alive partagée, délais de connexion et de lecture distincts,
+    nouvelles tentatives avec backoff exponentiel (jitter) sur 429/5xx en
+    respectant Retry-After, et chronométrage de chaque appel. Chaque
+    tentative passe d'abord par le limiteur de débit du processus.
+    """
+
+    def __init__(self, connect_timeout: float = PERPLEXITY_CONNECT_TIMEOUT,
+                 read_timeout: float = PERPLEXITY_READ_TIMEOUT,
+                 max_retries: int = PERPLEXITY_MAX_RETRIES,
+                 backoff_base: float = PERPLEXITY_BACKOFF_BASE,
+                 backoff_max: float = PERPLEXITY_BACKOFF_MAX,
+                 pool_size: int = PERPLEXITY_POOL_SIZE):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        adapter = _TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.limiter = get_rate_limiter()
+
+    def post(self, url: str, headers: Dict, json: Dict, stream: bool = False) -> requests.Response:
+        """
+        Envoie une requête POST avec nouvelles tentatives
+
+        Args:
+            url: URL de l'API
+            headers: En-têtes HTTP
+            json: Corps JSON de la requête
+            stream: Ne pas lire le corps (réponse en flux)
+
+        Returns:
+            Réponse HTTP ; raise_for_status reste à la charge de l'appelant
+        """
+        call_started = time.perf_counter()
+        estimated_tokens = estimate_payload_tokens(json)
+        queue_ms = 0.0
+        attempt = 0
+        while True:
+            _local.timings = {}
+            # Attente de son tour (priorité, quotas, concurrence) avant chaque tentative
+            permit = self.limiter.acquire(estimated_tokens) if self.limiter else None
+            if permit is not None:
+                queue_ms += permit.waited_ms
+            attempt_started = time.perf_counter()
+            response = None
+            try:
+                # stream=True : la réponse revient dès réception des en-têtes (TTFB)
+                response = self.session.post(url, headers=headers, json=json,
+                                             timeout=self.timeout, stream=True)
+                ttfb_ms = (time.perf_counter() - attempt_started) * 1000
+                retryable = response.status_code in RETRYABLE_STATUS_CODES
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                retryable = True
+            finally:
+                # Place rendue dès les en-têtes reçus ; 429 et latence ajustent la concurrence
+                if permit is not None:
+                    if response is not None:
+                        permit.release(response.status_code, parse_retry_after(response.headers.get("Retry-After")))
+                    else:
+                        permit.release()
+
+            if not retryable or attempt >= self.max_retries:
+                if not stream:
+                    response.content  # Lecture complète du corps
+                timings = _current_timings()
+                timings.update({
+                    "dns_ms": round(timings.get("dns_ms", 0.0), 3),
+                    "connect_ms": round(timings.get("connect_ms", 0.0), 3),
+                    "ttfb_ms": round(ttfb_ms, 3),
+                    "total_ms": round((time.perf_counter() - call_started) * 1000, 3),
+                    "attempts": attempt + 1,
+                    "status_code": response.status_code,
+                    "queue_ms": round(queue_ms, 3),
+                    "estimated_tokens": estimated_tokens,
+                })
+                return response
+
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            delay = backoff_delay(attempt, retry_after, self.backoff_base, self.backoff_max)
+            if response is not None:
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def last_timings(self) -> Dict:
+        """Retourne le chronométrage du dernier appel du thread courant"""
+        return dict(_current_timings())
+
+    def record_usage(self, usage: Optional[Dict]):
+        """Transmet au limiteur les tokens réellement consommés par le dernier appel du thread"""
+        if self.limiter and usage and usage.get("total_tokens") is not None:
+            self.limiter.record_usage(_current_timings().get("estimated_tokens", 0), usage["total_tokens"])
+
+
+def estimate_payload_tokens(payload: Dict) -> int:
+    """Tokens réservés pour un appel : messages envoyés et réponse maximale"""
+    prompt = "".join(str(message.get("content", "")) for message in payload.get("messages", []))
+    return estimate_tokens(prompt) + int(payload.get("max_tokens", 0))
+
+
+_shared_transport = None
+_shared_transport_lock = threading.Lock()
+
+
+def get_transport() -> HTTPTransport:
+    """Retourne le transport partagé par toutes les sessions du processus"""
+    global _shared_transport
+    with _shared_transport_lock:
+        if _shared_transport is None:
+            _shared_transport = HTTPTransport()
+        return _shared_transport
@@ -0,0 +1,452 @@
+import argparse
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from config import (
+    MONGODB_URI, MONGODB_DATABASE, MONGODB_COLLECTION,
+    INDEX_ADVISOR_SAMPLE_RATE, INDEX_ADVISOR_PROFILE_PATH, PIPELINE_MAX_TIME_MS
+)
+from pipeline_optimizer import optimize_pipeline
+
+
+# Champs pour lesquels des index composés sont proposés
+CANDIDATE_FIELDS = ["year", "imdb.rating", "genres", "directors"]
+
+# Champs tableaux : MongoDB refuse deux champs tableaux dans un même index
+ARRAY_FIELDS = {"genres", "directors", "cast", "countries", "languages", "writers"}
+
+EQUALITY_OPERATORS = {"$eq", "$in"}
+
+# Au-delà de ce ratio documents examinés / retournés, la requête est jugée peu sélective
+INEFFICIENT_RATIO = 10
+
+
+def _shape(value: Any) -> Any:
+    """Remplace les littéraux par "?" en conservant champs, opérateurs et références $champ"""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_shape(item) for item in value]
+    if isinstance(value, str) and value.startswith("$"):
+        return value
+    return "?"
+
+
+def query_family(query_type: str, query: Any) -> str:
+    """Identifiant de famille : même forme de requête, littéraux ignorés"""
+    return json.dumps([query_type, _shape(query)], separators=(",", ":"), ensure_ascii=False)
+
+
+def describe_family(query_type: str, query: Any) -> str:
+    """Description courte d'une famille pour le rapport"""
+    if query_type == "aggregate" and isinstance(query, list):
+        parts = []
+        for stage in query:
+            name = next(iter(stage)) if isinstance(stage, dict) and stage else "?"
+            if name == "$match":
+                equality, ranges = _filter_fields(stage["$match"]) or ([], [])
+                name += "(" + ", ".join(equality + ranges) + ")"
+            parts.append(name)
+        return "aggregate " + " → ".join(parts)
+    equality, ranges = _filter_fields(query) or ([], [])
+    return "find {" + ", ".join(equality + ranges) + "}"
+
+
+def _filter_fields(query: Any) -> Optional[Tuple[List[str], List[str]]]:
+    """
+    Sépare les champs filtrés en égalités et intervalles
+
+    Returns:
+        (champs d'égalité, champs d'intervalle), ou None si le filtre
+        contient $or/$expr/$text (pas d'index composé simple à proposer)
+    """
+    if not isinstance(query, dict):
+        return None
+    equality: List[str] = []
+    ranges: List[str] = []
+    conditions = list(query.items())
+    while conditions:
+        key, value = conditions.pop(0)
+        if key == "$and" and isinstance(value, list):
+            for clause in value:
+                if not isinstance(clause, dict):
+                    return None
+                conditions.extend(clause.items())
+            continue
+        if key.startswith("$"):
+            return None
+        operators = set(value) if isinstance(value, dict) else set()
+        if operators and all(operator.startswith("$") for operator in operators):
+            # $gte/$lt/$exists/$type... : parcours d'un intervalle de l'index
+            target = equality if operators <= EQUALITY_OPERATORS else ranges
+        else:
+            target = equality
+        if key not in equality and key not in ranges:
+            target.append(key)
+    return equality, ranges
+
+
+def workload_fields(query_type: str, query: Any) -> Optional[Tuple[List[str], List[Tuple[str, int]], List[str]]]:
+    """
+    Champs d'égalité, de tri et d'intervalle utilisables par un index
+
+    Pour un pipeline, seuls les $match de tête et le $sort qui les suit
+    immédiatement peuvent s'appuyer sur un index.
+    """
+    if query_type != "aggregate":
+        fields = _filter_fields(query)
+        return (fields[0], [], fields[1]) if fields else None
+    if not isinstance(query, list):
+        return None
+    equality: List[str] = []
+    sort: List[Tuple[str, int]] = []
+    ranges: List[str] = []
+    for stage in query:
+        name = next(iter(stage)) if isinstance(stage, dict) and stage else None
+        if name == "$match" and not sort:
+            fields = _filter_fields(stage["$match"])
+            if fields is None:
+                return None
+            equality += [field for field in fields[0] if field not in equality]
+            ranges += [field for field in fields[1] if field not in ranges]
+        elif name == "$sort" and not sort:
+            sort = [(field, direction) for field, direction in stage["$sort"].items()
+                    if direction in (1, -1)]
+        else:
+            break
+    return equality, sort, ranges
+
+
+def propose_index(equality: List[str], sort: List[Tuple[str, int]], ranges: List[str]) -> List[Tuple[str, int]]:
+    """
+    Construit un index composé selon la règle ESR (égalité, tri, intervalle)
+
+    Seuls les CANDIDATE_FIELDS sont retenus, avec au plus un champ tableau.
+    """
+    keys: List[Tuple[str, int]] = []
+    array_field_used = False
+    for field, direction in [(field, 1) for field in equality] + sort + [(field, 1) for field in ranges]:
+        if field not in CANDIDATE_FIELDS or any(field == existing for existing, _ in keys):
+            continue
+        if field in ARRAY_FIELDS:
+            if array_field_used:
+                continue
+            array_field_used = True
+        keys.append((field, direction))
+    return keys
+
+
+def _plan_stages(plan: Any) -> List[Dict]:
+    """Liste à plat des étapes d'un plan d'exécution"""
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node)
+        for key in ("inputStage", "queryPlan", "winningPlan"):
+            if key in node:
+                pending.append(node[key])
+        pending.extend(node.get("inputStages", []))
+    return stages
+
+
+def parse_explain(explain: Dict) -> Dict:
+    """
+    Extrait d'une sortie explain("executionStats") les indicateurs du profil
+
+    Gère les deux formes d'explain d'agrégation : plan à la racine (pipeline
+    entièrement délégué au moteur de requêtes) ou sous l'étape $cursor.
+    """
+    sections = [explain]
+    for stage in explain.get("stages", []):
+        if "$cursor" in stage:
+            sections.append(stage["$cursor"])
+
+    stage_names: List[str] = []
+    index_names: List[str] = []
+    docs_examined = keys_examined = n_returned = time_ms = 0
+    for section in sections:
+        planner = section.get("queryPlanner", {})
+        for stage in _plan_stages(planner.get("winningPlan", {})):
+            stage_names.append(stage["stage"])
+            if stage.get("indexName"):
+                index_names.append(stage["indexName"])
+        stats = section.get("executionStats")
+        if stats:
+            docs_examined += stats.get("totalDocsExamined", 0)
+            keys_examined += stats.get("totalKeysExamined", 0)
+            n_returned += stats.get("nReturned", 0)
+            time_ms += stats.get("executionTimeMillis", 0)
+
+    return {
+        "collscan": "COLLSCAN" in stage_names,
+        "indexes": sorted(set(index_names)),
+        "docs_examined": docs_examined,
+        "keys_examined": keys_examined,
+        "n_returned": n_returned,
+        "time_ms": time_ms,
+    }
+
+
+class IndexAdvisor:
+    """
+    Profil de charge et propositions d'index à partir d'explain()
+
+    Une fraction des requêtes exécutées (sample_rate) est rejouée avec
+    explain("executionStats") dans un thread de fond ; les indicateurs sont
+    agrégés par famille de requêtes (même forme, littéraux ignorés) et
+    enregistrés dans un fichier JSON.
+    """
+
+    def __init__(self, collection, sample_rate: float = INDEX_ADVISOR_SAMPLE_RATE,
+                 profile_path: Optional[str] = INDEX_ADVISOR_PROFILE_PATH):
+        self.collection = collection
+        self.sample_rate = sample_rate
+        self.profile_path = profile_path
+        self.profile: Dict[str, Dict] = self._load_profile()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[str, Any]]" = queue.Queue(maxsize=100)
+        self._worker = None
+
+    def _load_profile(self) -> Dict[str, Dict]:
+        if not self.profile_path or not os.path.exists(self.profile_path):
+            return {}
+        try:
+            with open(self.profile_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Profil d'index illisible ({self.profile_path}): {e}")
+            return {}
+
+    def save_profile(self):
+        """Écrit le profil de charge sur disque (remplacement atomique)"""
+        if not self.profile_path:
+            return
+        with self._lock:
+            data = json.dumps(self.profile, ensure_ascii=False, indent=2, default=str)
+        directory = os.path.dirname(self.profile_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = self.profile_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(temporary_path, self.profile_path)
+
+    def observe(self, query_type: str, query: Any):
+        """Soumet une requête exécutée à l'échantillonnage (non bloquant)"""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((query_type, query))
+        except queue.Full:
+            pass
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="index-advisor", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            query_type, query = self._queue.get()
+            try:
+                self.record(query_type, query, self.explain(query_type, query))
+                self.save_profile()
+            except Exception as e:
+                print(f"Erreur lors de l'analyse du plan d'exécution: {e}")
+
+    def explain(self, query_type: str, query: Any) -> Dict:
+        """
+        Exécute explain("executionStats") pour une requête find ou aggregate
+
+        Le pipeline est celui réellement exécuté (optimize_pipeline), borné
+        comme l'exécution par PIPELINE_MAX_TIME_MS : executionStats rejoue
+        la requête en entier.
+        """
+        if query_type == "aggregate":
+            command = {"aggregate": self.collection.name, "pipeline": optimize_pipeline(query).pipeline, "cursor": {}}
+        else:
+            command = {"find": self.collection.name, "filter": query, "limit": 10}
+        if PIPELINE_MAX_TIME_MS:
+            command["maxTimeMS"] = PIPELINE_MAX_TIME_MS
+        return self.collection.database.command({"explain": command, "verbosity": "executionStats"})
+
+    def record(self, query_type: str, query: Any, explain: Dict) -> Dict:
+        """Ajoute le résultat d'un explain au profil de la famille de la requête"""
+        metrics = parse_explain(explain)
+        family = query_family(query_type, query)
+        with self._lock:
+            entry = self.profile.setdefault(family, {
+                "description": describe_family(query_type, query),
+                "query_type": query_type,
+                "example": query,
+                "explained": 0,
+                "collscans": 0,
+                "docs_examined": 0,
+                "keys_examined": 0,
+                "n_returned": 0,
+                "time_ms": 0,
+                "indexes": [],
+            })
+            entry["example"] = query
+            entry["explained"] += 1
+            entry["collscans"] += int(metrics["collscan"])
+            for key in ("docs_examined", "keys_examined", "n_returned", "time_ms"):
+                entry[key] += metrics[key]
+            entry["indexes"] = sorted(set(entry["indexes"]) | set(metrics["indexes"]))
+            entry["last_seen"] = time.time()
+            return entry
+
+    def _existing_indexes(self) -> List[List[Tuple[str, int]]]:
+        try:
+            return [list(info["key"]) for info in self.collection.index_information().values()]
+        except Exception as e:
+            print(f"Erreur lors de la lecture des index: {e}")
+            return []
+
+    def recommendations(self) -> List[Dict]:
+        """
+        Propose un index par famille inefficace (COLLSCAN ou ratio élevé)
+
+        Le gain attendu suppose qu'un index adapté ramène le nombre de
+        documents examinés au nombre de documents retournés.
+        """
+        existing = self._existing_indexes()
+        with self._lock:
+            families = list(self.profile.items())
+
+        recommendations = []
+        for family, entry in families:
+            explained = entry["explained"]
+            if not explained:
+                continue
+            avg_examined = entry["docs_examined"] / explained
+            avg_returned = entry["n_returned"] / explained
+            ratio = avg_examined / max(avg_returned, 1)
+            if not entry["collscans"] and ratio < INEFFICIENT_RATIO:
+                continue
+            fields = workload_fields(entry["query_type"], entry["example"])
+            keys = propose_index(*fields) if fields else []
+            if not keys:
+                continue
+            covered = any(index[:len(keys)] == keys for index in existing)
+            recommendations.append({
+                "family": family,
+                "description": entry["description"],
+                "explained": explained,
+                "collscan_rate": round(entry["collscans"] / explained, 2),
+                "avg_docs_examined": round(avg_examined),
+                "avg_returned": round(avg_returned),
+                "avg_time_ms": round(entry["time_ms"] / explained, 1),
+                "index": keys,
+                "already_exists": covered,
+                "expected_docs_examined": round(avg_returned),
+                "expected_reduction": round(ratio, 1),
+            })
+        recommendations.sort(key=lambda item: item["avg_docs_examined"] * item["explained"], reverse=True)
+        return recommendations
+
+    def create_indexes(self, recommendations: Optional[List[Dict]] = None) -> List[str]:
+        """Crée les index proposés qui n'existent pas encore"""
+        created = []
+        seen = set()
+        for recommendation in recommendations or self.recommendations():
+            keys = tuple(recommendation["index"])
+            if recommendation["already_exists"] or keys in seen:
+                continue
+            seen.add(keys)
+            created.append(self.collection.create_index(list(keys)))
+        return created
+
+
+_shared_advisor = None
+_shared_advisor_lock = threading.Lock()
+
+
+def get_index_advisor(collection=None) -> Optional[IndexAdvisor]:
+    """
+    Retourne le conseiller d'index partagé par toutes les sessions du processus
+
+    Returns:
+        IndexAdvisor, ou None si l'échantillonnage est désactivé
+    """
+    global _shared_advisor
+    if not INDEX_ADVISOR_SAMPLE_RATE:
+        return None
+    with _shared_advisor_lock:
+        if _shared_advisor is None and collection is not None:
+            _shared_advisor = IndexAdvisor(collection)
+        return _shared_advisor
+
+
+def _format_index(keys: List[Tuple[str, int]]) -> str:
+    return "{" + ", ".join(f"{field}: {direction}" for field, direction in keys) + "}"
+
+
+def print_report(recommendations: List[Dict]):
+    """Affiche le rapport par famille de requêtes"""
+    if not recommendations:
+        print("✅ Aucune famille de requêtes ne nécessite de nouvel index")
+        return
+    for item in recommendations:
+        print(f"\n📌 {item['description']}")
+        print(f"   Requêtes analysées : {item['explained']} (COLLSCAN : {item['collscan_rate']:.0%})")
+        print(f"   Documents examinés : ~{item['avg_docs_examined']} pour {item['avg_returned']} retournés"
+              f" ({item['avg_time_ms']} ms)")
+        status = " (déjà présent)" if item["already_exists"] else ""
+        print(f"   Index proposé : {_format_index(item['index'])}{status}")
+        print(f"   Gain attendu : ~{item['expected_docs_examined']} documents examinés,"
+              f" soit ÷{item['expected_reduction']}")
+
+
+def main():
+    """Rapport et création des index proposés (python index_advisor.py --report)"""
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Conseiller d'index pour la collection movies")
+    parser.add_argument("--uri", default=MONGODB_URI, help="Chaîne de connexion (mongod local accepté)")
+    parser.add_argument("--profile", default=INDEX_ADVISOR_PROFILE_PATH, help="Fichier du profil de charge")
+    parser.add_argument("--report", action="store_true", help="Afficher les propositions (par défaut)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Rejouer explain() sur l'exemple de chaque famille avant le rapport")
+    parser.add_argument("--create", action="store_true", help="Créer les index proposés")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri or "mongodb://localhost:27017")
+    collection = client[MONGODB_DATABASE][MONGODB_COLLECTION]
+    advisor = IndexAdvisor(collection, sample_rate=0, profile_path=args.profile)
+    if not advisor.profile:
+        print(f"Profil vide : aucune requête échantillonnée dans {args.profile}")
+        return
+
+    if args.refresh:
+        examples = [(entry["query_type"], entry["example"]) for entry in advisor.profile.values()]
+        advisor.profile = {}
+        for query_type, query in examples:
+            advisor.record(query_type, query, advisor.explain(query_type, query))
+        advisor.save_profile()
+
+    recommendations = advisor.recommendations()
+    print_report(recommendations)
+
+    if args.create:
+        created = advisor.create_indexes(recommendations)
+        print(f"\n🛠 Index créés : {', '.join(created) if created else 'aucun'}")
+        # Mesure réelle après création
+        for item in recommendations:
+            entry = advisor.profile[item["family"]]
+            metrics = parse_explain(advisor.explain(entry["query_type"], entry["example"]))
+            print(f"   {item['description']} : {metrics['docs_examined']} documents examinés "
+                  f"(avant ~{item['avg_docs_examined']}), index {', '.join(metrics['indexes']) or 'aucun'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,543 @@
+import re
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+from query_cache import normalize_question
+
+
+MIN_YEAR = 1870
+MAX_YEAR = 2100
+DEFAULT_TOP_N = 5
+MAX_TOP_N = 100
+
+# Genres de la collection (valeurs anglaises) et leurs formes françaises
+GENRE_ALIASES = {
+    "science-fiction": "Sci-Fi", "science fiction": "Sci-Fi", "sf": "Sci-Fi",
+    "comedie musicale": "Musical", "comedies musicales": "Musical",
+    "drame": "Drama", "drames": "Drama", "dramatique": "Drama",
+    "comedie": "Comedy", "comedies": "Comedy",
+    "action": "Action", "thriller": "Thriller", "thrillers": "Thriller",
+    "horreur": "Horror", "epouvante": "Horror",
+    "romance": "Romance", "romances": "Romance", "romantique": "Romance", "romantiques": "Romance",
+    "animation": "Animation", "dessin anime": "Animation", "dessins animes": "Animation",
+    "documentaire": "Documentary", "documentaires": "Documentary",
+    "aventure": "Adventure", "aventures": "Adventure",
+    "policier": "Crime", "policiers": "Crime", "crime": "Crime",
+    "fantastique": "Fantasy", "fantasy": "Fantasy",
+    "guerre": "War", "western": "Western", "westerns": "Western",
+    "musical": "Musical", "musicaux": "Musical",
+    "familial": "Family", "familiaux": "Family",
+    "biographie": "Biography", "biographies": "Biography", "biopic": "Biography", "biopics": "Biography",
+    "historique": "History", "historiques": "History",
+    "mystere": "Mystery", "sport": "Sport", "court-metrage": "Short", "courts-metrages": "Short",
+}
+
+_GENRE_RE = re.compile(
+    r"\b(" + "|".join(re.escape(alias) for alias in sorted(GENRE_ALIASES, key=len, reverse=True)) + r")\b"
+)
+_YEAR = r"(1[89]\d\d|20\d\d)"
+_YEAR_RANGE_RES = [
+    re.compile(rf"\bentre (?:l'annee |les annees )?{_YEAR} et {_YEAR}\b"),
+    re.compile(rf"\bde {_YEAR} (?:a|jusqu'a|jusqu'en) {_YEAR}\b"),
+    re.compile(rf"\b{_YEAR} ?- ?{_YEAR}\b"),
+]
+# Bornes ouvertes : « depuis 2010 », « jusqu'en 2010 »
+_SINCE_RE = re.compile(rf"\bdepuis (?:l'annee )?{_YEAR}\b")
+_UNTIL_RE = re.compile(rf"\bjusqu'(?:en|a) (?:l'annee )?{_YEAR}\b")
+_BOUND_WORDS = frozenset({"depuis", "jusqu", "annee"})
+_DECADE_RE = re.compile(r"\bannees ((?:19)?[2-9]0|20[0-3]0)\b")
+_YEAR_RE = re.compile(rf"\b{_YEAR}\b")
+_TOP_N_RE = re.compile(r"\b(?:top|les|des|premiers|meilleurs) (\d{1,3})\b|\b(\d{1,3}) (?:premiers|meilleurs|plus)\b")
+# « Qui est le réalisateur le plus prolifique ? » : un seul résultat attendu
+_SINGULAR_TOP_RE = re.compile(r"\b(?:quel|quelle|le|la) (?:realisateur|genre|film)\b(?: [a-z]+){0,2} le (?:plus|mieux)\b")
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_DIRECTOR_RE = re.compile(r"\brealises? par ([a-z][a-z .'-]{1,60}?)(?=\s*(?:\?|,|$| en | entre | de \d| depuis ))")
+
+# Mots neutres ou propres aux modèles de questions. Une question contenant
+# un autre mot (acteur, pays, "spielberg"...) exprime un critère qu'aucun
+# modèle ne sait traduire : elle part au LLM.
+KNOWN_WORDS = frozenset("""
+    a ai au aux c ce ces cette d dans de des donne donner donnez du en est et etait il l la le les
+    leur leurs m me moi n on ou par pour qu que quel quelle quelles quels qui s sa se son sont sur t tu
+    un une y ya ont ete fait faits tourne tournes peux peut pouvez voudrais veux souhaite merci svp stp
+    film films movie movies collection base donnees
+    paru parus parue parues sorti sortis sortie sorties produit produits realise realises realisee realisees
+    note notes moyenne moyennes combien nombre total totale
+    premier premiere meilleur meilleurs mieux plus top classement populaire populaires
+    frequent frequents frequente represente representes prolifique prolifiques
+    genre genres decennie decennies annee annees an chaque toutes tous tout entre
+    realisateur realisateurs affiche afficher montre montrer liste lister voir indique indiquer
+""".split())
+_VOCABULARY = KNOWN_WORDS | frozenset(word for alias in GENRE_ALIASES for word in _TOKEN_RE.findall(alias))
+
+# Critères qui empêchent de répondre par un document d'exemple (règle historique)
+_SPECIFIC_CRITERIA = [
+    "en 20", "annee", "genre", "realisateur", "acteur", "note",
+    "paru en", "sorti en", "de 19", "de 20", "entre", "avec",
+    "rating", "imdb", "director", "cast", "spielberg", "scorsese",
+    "superieure", "inferieure", "action", "drame", "comedie",
+    "thriller", "horreur", "romance", "animation",
+]
+
+
+class IntentMatch:
+    """Résultat d'une reconnaissance d'intention"""
+
+    def __init__(self, name: str, parameters: Dict, query_info: Dict):
+        self.name = name
+        self.parameters = parameters
+        self.query_info = query_info
+
+
+class Intent:
+    """
+    Modèle de question paramétré
+
+    anchors: mots dont au moins un doit figurer dans la question (index inversé)
+    patterns: expressions qui doivent toutes correspondre
+    excludes: expressions qui ne doivent pas correspondre
+    accepts: paramètres que le modèle sait prendre en compte
+    strict: refuser les questions contenant des mots hors vocabulaire
+    """
+
+    def __init__(self, name: str, anchors: List[str], patterns: List[str],
+                 build: Callable[[Dict], Dict], accepts: FrozenSet[str] = frozenset(),
+                 excludes: List[str] = (), strict: bool = True):
+        self.name = name
+        self.anchors = frozenset(anchors)
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.excludes = [re.compile(pattern) for pattern in excludes]
+        self.build = build
+        self.accepts = frozenset(accepts)
+        self.strict = strict
+
+    def matches(self, text: str, parameters: Dict, has_unknown_words: bool) -> bool:
+        if self.strict and has_unknown_words:
+            return False
+        if not parameters.keys() <= self.accepts:
+            return False
+        return (all(pattern.search(text) for pattern in self.patterns)
+                and not any(pattern.search(text) for pattern in self.excludes))
+
+
+def _year_filter(parameters: Dict) -> Dict:
+    """Filtre sur l'année (année seule ou intervalle inclusif)"""
+    if "year" in parameters:
+        return {"year": parameters["year"]}
+    if "year_range" in parameters:
+        start, end = parameters["year_range"]
+        return {"year": {"$gte": start, "$lte": end}}
+    return {}
+
+
+def _base_match(parameters: Dict) -> Dict:
+    """Filtre commun : années, genre et réalisateur"""
+    match = _year_filter(parameters)
+    if "genre" in parameters:
+        match["genres"] = parameters["genre"]
+    if "director" in parameters:
+        match["directors"] = {"$regex": re.escape(parameters["director"]), "$options": "i"}
+    return match
+
+
+def parameter_filters(parameters: Dict) -> Dict:
+    """Conditions $match des paramètres extraits d'une question (années, genre, réalisateur)"""
+    return _base_match(parameters)
+
+
+def unknown_words(text: str, parameters: Dict) -> List[str]:
+    """Mots d'une question normalisée hors du vocabulaire des modèles (critères non reconnus)"""
+    known_words = _VOCABULARY
+    if _SINCE_RE.search(text) or _UNTIL_RE.search(text):
+        # Sans année, « depuis » ou « jusqu'à » expriment une borne non traduite
+        known_words = known_words | _BOUND_WORDS
+    if "director" in parameters:
+        known_words = known_words | set(_TOKEN_RE.findall(parameters["director"]))
+    return [token for token in _TOKEN_RE.findall(text) if not token.isdigit() and token not in known_words]
+
+
+def _describe_filters(parameters: Dict) -> str:
+    parts = []
+    if "year" in parameters:
+        parts.append(f"en {parameters['year']}")
+    if "year_range" in parameters:
+        start, end = parameters["year_range"]
+        if end == MAX_YEAR:
+            parts.append(f"depuis {start}")
+        elif start == MIN_YEAR:
+            parts.append(f"jusqu'en {end}")
+        else:
+            parts.append(f"entre {start} et {end}")
+    if "genre" in parameters:
+        parts.append(f"du genre {parameters['genre']}")
+    if "director" in parameters:
+        parts.append(f"réalisés par {parameters['director'].title()}")
+    return (" " + " ".join(parts)) if parts else ""
+
+
+def _query(pipeline, explanation: str, estimated_results: str, query_type: str = "aggregate") -> Dict:
+    return {
+        "query_type": query_type,
+        "mongodb_query": pipeline,
+        "explanation": explanation,
+        "estimated_results": estimated_results,
+    }
+
+
+def _build_sample_document(parameters: Dict) -> Dict:
+    return _query({}, "Récupération d'un document d'exemple de la collection movies",
+                  "Un document complet avec tous les champs disponibles", query_type="find")
+
+
+def _build_total_count(parameters: Dict) -> Dict:
+    return _query([{"$count": "total"}], "Comptage du nombre total de films dans la collection",
+                  "Le nombre total de documents")
+
+
+def _build_count(parameters: Dict) -> Dict:
+    return _query(
+        [{"$match": _base_match(parameters)}, {"$count": "total"}],
+        f"Comptage des films{_describe_filters(parameters)}",
+        "Le nombre de films correspondants"
+    )
+
+
+def _build_count_per_year(parameters: Dict) -> Dict:
+    match = _base_match(parameters) or {"year": {"$type": "number"}}
+    return _query(
+        [{"$match": match}, {"$group": {"_id": "$year", "count": {"$sum": 1}}}, {"$sort": {"_id": 1}}],
+        f"Nombre de films par année{_describe_filters(parameters)}",
+        "Un nombre de films pour chaque année"
+    )
+
+
+def _build_average_rating(parameters: Dict) -> Dict:
+    match = _base_match(parameters)
+    match["imdb.rating"] = {"$exists": True}
+    return _query(
+        [{"$match": match}, {"$group": {"_id": None, "avgRating": {"$avg": "$imdb.rating"}}}],
+        f"Note IMDb moyenne des films{_describe_filters(parameters)}",
+        "Une note moyenne"
+    )
+
+
+def _build_average_rating_per_year(parameters: Dict) -> Dict:
+    match = _base_match(parameters) or {"year": {"$type": "number"}}
+    match["imdb.rating"] = {"$exists": True}
+    return _query(
+        [{"$match": match}, {"$group": {"_id": "$year", "avgRating": {"$avg": "$imdb.rating"}}},
+         {"$sort": {"_id": 1}}],
+        f"Note IMDb moyenne par année{_describe_filters(parameters)}",
+        "Une note moyenne pour chaque année"
+    )
+
+
+def _build_top_directors(parameters: Dict) -> Dict:
+    n = parameters.get("n", DEFAULT_TOP_N)
+    pipeline = []
+    match = _base_match(parameters)
+    if match:
+        pipeline.append({"$match": match})
+    pipeline += [
+        {"$unwind": "$directors"},
+        {"$group": {"_id": "$directors", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": n},
+    ]
+    return _query(pipeline, f"Top {n} des réalisateurs par nombre de films{_describe_filters(parameters)}",
+                  f"{n} réalisateurs avec leur nombre de films")
+
+
+def _build_top_genres(parameters: Dict) -> Dict:
+    n = parameters.get("n", DEFAULT_TOP_N)
+    pipeline = []
+    match = _base_match(parameters)
+    if match:
+        pipeline.append({"$match": match})
+    pipeline += [
+        {"$unwind": "$genres"},
+        {"$group": {"_id": "$genres", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": n},
+    ]
+    return _query(pipeline, f"Top {n} des genres par nombre de films{_describe_filters(parameters)}",
+                  f"{n} genres avec leur nombre de films")
+
+
+def _build_genre_per_decade(parameters: Dict) -> Dict:
+    match = _year_filter(parameters) or {"year": {"$type": "number"}}
+    if "year_range" in parameters:
+        start, end = parameters["year_range"]
+        # "entre 1970 et 2010" par décennie : la décennie 2010 est incluse entièrement
+        match = {"year": {"$gte": start - start % 10, "$lte": end - end % 10 + 9}}
+    return _query(
+        [
+            {"$match": match},
+            {"$unwind": "$genres"},
+            {"$group": {
+                "_id": {"decade": {"$multiply": [{"$floor": {"$divide": ["$year", 10]}}, 10]},
+                        "genre": "$genres"},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"_id.decade": 1, "count": -1, "_id.genre": 1}},
+            {"$group": {"_id": "$_id.decade", "genre": {"$first": "$_id.genre"}, "count": {"$first": "$count"}}},
+            {"$sort": {"_id": 1}},
+        ],
+        f"Genre le plus représenté par décennie{_describe_filters(parameters)}",
+        "Un genre dominant et son nombre de films pour chaque décennie"
+    )
+
+
+def _build_first_film(parameters: Dict) -> Dict:
+    match = _base_match(parameters)
+    match["released"] = {"$exists": True}
+    return _query(
+        [
+            {"$match": match},
+            {"$sort": {"released": 1, "title": 1}},
+            {"$limit": 1},
+            {"$project": {"_id": 0, "title": 1, "year": 1, "released": 1, "directors": 1, "genres": 1}},
+        ],
+        f"Premier film sorti{_describe_filters(parameters)} (date de sortie la plus ancienne)",
+        "Un film avec ses réalisateurs"
+    )
+
+
+def _build_top_rated(parameters: Dict) -> Dict:
+    n = parameters.get("n", DEFAULT_TOP_N)
+    match = _base_match(parameters)
+    match["imdb.rating"] = {"$type": "number"}
+    match["imdb.votes"] = {"$gte": 1000}
+    return _query(
+        [
+            {"$match": match},
+            {"$sort": {"imdb.rating": -1, "imdb.votes": -1}},
+            {"$limit": n},
+            {"$project": {"_id": 0, "title": 1, "year": 1, "directors": 1, "genres": 1, "imdb.rating": 1}},
+        ],
+        f"Les {n} films les mieux notés sur IMDb{_describe_filters(parameters)} (au moins 1000 votes)",
+        f"{n} films avec leur note IMDb"
+    )
+
+
+_FILTERS = {"year", "year_range", "genre", "director"}
+# Regroupement demandé (« par décennie », « de chaque année ») : un résultat par groupe, hors des modèles de classement
+_GROUPING = r"\bpar (annee|an|genre|realisateur|decennie|pays)\b|\bchaque\b"
+
+DEFAULT_INTENTS = [
+    Intent("sample_document",
+           anchors=["document", "exemple", "structure", "echantillon"],
+           patterns=[r"document|exemple|structure|echantillon"],
+           excludes=["|".join(re.escape(criteria) for criteria in _SPECIFIC_CRITERIA)],
+           strict=False,
+           build=_build_sample_document),
+    Intent("total_count",
+           anchors=["total", "taille"],
+           patterns=[r"combien de films au total|nombre total de films|total de films"
+                     r"|combien de films dans la collection|taille de la collection"],
+           build=_build_total_count),
+    Intent("genre_per_decade",
+           anchors=["decennie", "decennies"],
+           patterns=[r"\bgenres?\b", r"\bdecennies?\b"],
+           accepts=frozenset({"year_range"}),
+           build=_build_genre_per_decade),
+    Intent("average_rating_per_year",
+           anchors=["moyenne", "moyennes"],
+           patterns=[r"\bnotes? moyennes?\b|\bmoyennes? des notes\b",
+                     r"\bpar annee\b|\bchaque annee\b|\bpour toutes les annees\b"],
+           accepts=_FILTERS,
+           build=_build_average_rating_per_year),
+    Intent("average_rating",
+           anchors=["moyenne", "moyennes"],
+           patterns=[r"\bnotes? moyennes?\b|\bmoyennes? des notes\b"],
+           excludes=[_GROUPING],
+           accepts=_FILTERS,
+           build=_build_average_rating),
+    Intent("count_per_year",
+           anchors=["combien", "nombre"],
+           patterns=[r"\b(combien|nombre) de films\b", r"\bpar annee\b|\bchaque annee\b"],
+           accepts=_FILTERS,
+           build=_build_count_per_year),
+    Intent("count",
+           anchors=["combien", "nombre"],
+           patterns=[r"\b(combien|nombre) de (films|drames|comedies|westerns|documentaires|thrillers)\b"],
+           excludes=[_GROUPING],
+           accepts=_FILTERS,
+           build=_build_count),
+    Intent("top_directors",
+           anchors=["realisateurs", "realisateur"],
+           patterns=[r"\brealisateurs?\b", r"\ble plus\b|\bles plus\b|\btop\b|\bprolifiques?\b|\bclassement\b"],
+           excludes=[_GROUPING],
+           accepts=_FILTERS - {"director"} | {"n"},
+           build=_build_top_directors),
+    Intent("top_genres",
+           anchors=["genres", "genre"],
+           patterns=[r"\bgenres?\b", r"\ble plus\b|\bles plus\b|\btop\b|\bclassement\b|\bpopulaires?\b"],
+           excludes=[_GROUPING],
+           accepts=frozenset({"year", "year_range", "director", "n"}),
+           build=_build_top_genres),
+    Intent("first_film",
+           anchors=["premier"],
+           patterns=[r"\bpremier film\b"],
+           excludes=[_GROUPING],
+           accepts=_FILTERS,
+           build=_build_first_film),
+    Intent("top_rated_films",
+           anchors=["meilleurs", "notes"],
+           patterns=[r"\bmeilleurs films\b|\bfilms les mieux notes\b|\bmieux notes\b"],
+           excludes=[_GROUPING],
+           accepts=_FILTERS | {"n"},
+           build=_build_top_rated),
+]
+
+
+class IntentEngine:
+    """
+    Reconnaissance des questions courantes et génération de pipelines validés
+
+    Les intentions candidates sont sélectionnées par un index inversé sur
+    les mots de la question, puis vérifiées par des expressions régulières
+    précompilées : le coût reste de l'ordre de la microseconde par
+    intention candidate, quel que soit le nombre d'intentions déclarées.
+    """
+
+    def __init__(self, intents: Optional[List[Intent]] = None):
+        self.intents = list(intents or DEFAULT_INTENTS)
+        self._priority = {intent.name: index for index, intent in enumerate(self.intents)}
+        self._index: Dict[str, List[Intent]] = {}
+        for intent in self.intents:
+            for anchor in intent.anchors:
+                self._index.setdefault(anchor, []).append(intent)
+
+    @staticmethod
+    def extract_parameters(text: str) -> Tuple[Optional[Dict], List[str]]:
+        """
+        Extrait années, intervalle, N, genre et réalisateur d'une question normalisée
+
+        Returns:
+            Tuple (paramètres ou None si invalides, nombres non interprétés)
+        """
+        parameters = {}
+        consumed = []
+
+        for pattern in _YEAR_RANGE_RES:
+            match = pattern.search(text)
+            if match:
+                start, end = sorted((int(match.group(1)), int(match.group(2))))
+                parameters["year_range"] = (start, end)
+                consumed += [match.group(1), match.group(2)]
+                break
+
+        since_match = _SINCE_RE.search(text)
+        until_match = _UNTIL_RE.search(text)
+        if (since_match or until_match) and "year_range" not in parameters:
+            start = int(since_match.group(1)) if since_match else MIN_YEAR
+            end = int(until_match.group(1)) if until_match else MAX_YEAR
+            parameters["year_range"] = (start, end)
+            consumed += [match.group(1) for match in (since_match, until_match) if match]
+
+        decade_match = _DECADE_RE.search(text)
+        if decade_match and "year_range" not in parameters:
+            # Nombre entier de la décennie (« 90 » ou « 1990 »), pour qu'il ne reste pas non interprété
+            decade = decade_match.group(1)
+            start = int(decade) if len(decade) == 4 else 1900 + int(decade)
+            parameters["year_range"] = (start, start + 9)
+            consumed.append(decade)
+
+        if "year_range" not in parameters:
+            years = [year for year in _YEAR_RE.findall(text)]
+            if len(years) == 1:
+                parameters["year"] = int(years[0])
+                consumed.append(years[0])
+            elif len(years) > 1:
+                return None, []
+
+        top_match = _TOP_N_RE.search(text)
+        if top_match:
+            value = top_match.group(1) or top_match.group(2)
+            if value not in consumed:
+                parameters["n"] = int(value)
+                consumed.append(value)
+
+        genre_match = _GENRE_RE.search(text)
+        if genre_match:
+            parameters["genre"] = GENRE_ALIASES[genre_match.group(1)]
+
+        director_match = _DIRECTOR_RE.search(text)
+        if director_match:
+            parameters["director"] = director_match.group(1).strip()
+
+        # Validation des paramètres
+        years = [parameters["year"]] if "year" in parameters else list(parameters.get("year_range", ()))
+        if any(not MIN_YEAR <= year <= MAX_YEAR for year in years):
+            return None, []
+        if "n" in parameters and not 1 <= parameters["n"] <= MAX_TOP_N:
+            return None, []
+
+        leftover = [number for number in _NUMBER_RE.findall(text) if number not in consumed]
+        return parameters, leftover
+
+    def match(self, user_question: str) -> Optional[IntentMatch]:
+        """
+        Reconnaît une question courante
+
+        Args:
+            user_question: Question de l'utilisateur
+
+        Returns:
+            IntentMatch avec la requête MongoDB, ou None si la question doit
+            être traduite par le LLM
+        """
+        text = normalize_question(user_question)
+        tokens = set(_TOKEN_RE.findall(text))
+        candidates = {intent.name: intent for token in tokens for intent in self._index.get(token, ())}
+        if not candidates:
+            return None
+
+        parameters, leftover = self.extract_parameters(text)
+        if parameters is None or leftover:
+            return None
+        has_unknown_words = bool(unknown_words(text, parameters))
+
+        for intent in sorted(candidates.values(), key=lambda item: self._priority[item.name]):
+            if intent.matches(text, parameters, has_unknown_words):
+                if "n" in intent.accepts and "n" not in parameters and _SINGULAR_TOP_RE.search(text):
+                    parameters = dict(parameters, n=1)
+                return IntentMatch(intent.name, parameters, self._build(intent, parameters))
+        return None
+
+    @staticmethod
+    def _build(intent: Intent, parameters: Dict) -> Dict:
+        query_info = intent.build(parameters)
+        query_info["intent"] = intent.name
+        query_info["parameters"] = {
+            key: list(value) if isinstance(value, tuple) else value
+            for key, value in parameters.items()
+        }
+        return query_info
+
+    def build(self, name: str, parameters: Dict) -> Optional[Dict]:
+        """
+        Reconstruit la requête d'une intention avec d'autres paramètres
+
+        Returns:
+            query_info comme match(), ou None si l'intention est inconnue ou
+            ne sait pas prendre en compte l'un des paramètres
+        """
+        intent = next((intent for intent in self.intents if intent.name == name), None)
+        if intent is None or not parameters.keys() <= intent.accepts:
+            return None
+        return self._build(intent, parameters)
+
+
+_default_engine = IntentEngine()
+
+
+def build_intent(name: str, parameters: Dict) -> Optional[Dict]:
+    """Requête standard d'une intention pour d'autres paramètres, ou None"""
+    return _default_engine.build(name, parameters)
+
+
+def match_intent(user_question: str) -> Optional[Dict]:
+    """Retourne la requête standard associée à une question, ou None"""
+    intent_match = _default_engine.match(user_question)
+    return intent_match.query_info if intent_match else None
@@ -0,0 +1,157 @@
+import atexit
+import threading
+import time
+from typing import Dict, Optional
+from pymongo import MongoClient, monitoring
+from config import (
+    MONGODB_URI, MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE,
+    MONGODB_MAX_IDLE_TIME_MS, MONGODB_WAIT_QUEUE_TIMEOUT_MS
+)
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collecte les statistiques du pool de connexions d'un MongoClient"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.open_connections = 0
+        self.checked_out = 0
+        self.total_checkouts = 0
+        self.failed_checkouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections = max(0, self.open_connections - 1)
+
+    def connection_check_out_started(self, event):
+        # Début et fin d'un checkout ont lieu dans le même thread
+        self._local.started_at = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.failed_checkouts += 1
+
+    def connection_checked_out(self, event):
+        started_at = getattr(self._local, "started_at", None)
+        wait_ms = (time.perf_counter() - started_at) * 1000 if started_at else 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.total_checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def snapshot(self) -> Dict:
+        """Retourne une copie des compteurs courants"""
+        with self._lock:
+            return {
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "total_checkouts": self.total_checkouts,
+                "failed_checkouts": self.failed_checkouts,
+                "avg_wait_ms": round(self.total_wait_ms / self.total_checkouts, 3) if self.total_checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 3),
+            }
+
+
+class MongoClientRegistry:
+    """Registre des MongoClient partagés par toutes les sessions du processus"""
+
+    def __init__(self):
+        self._clients: Dict[str, MongoClient] = {}
+        self._listeners: Dict[str, PoolStatsListener] = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, uri: Optional[str] = None) -> MongoClient:
+        """
+        Retourne le client partagé pour une URI, créé à la première demande
+
+        Args:
+            uri: Chaîne de connexion (MONGODB_URI par défaut)
+
+        Returns:
+            MongoClient connecté (ping vérifié à la création)
+        """
+        uri = uri or MONGODB_URI
+        client = self._clients.get(uri)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(uri)
+            if client is None:
+                listener = PoolStatsListener()
+                client = MongoClient(
+                    uri,
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=MONGODB_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                    event_listeners=[listener],
+                )
+                try:
+                    client.admin.command('ping')
+                except Exception:
+                    client.close()
+                    raise
+                self._clients[uri] = client
+                self._listeners[uri] = listener
+            return client
+
+    def pool_stats(self, uri: Optional[str] = None) -> Dict:
+        """Retourne les statistiques du pool associé à une URI"""
+        listener = self._listeners.get(uri or MONGODB_URI)
+        if listener is None:
+            return {}
+        stats = listener.snapshot()
+        stats.update({
+            "max_pool_size": MONGODB_MAX_POOL_SIZE,
+            "min_pool_size": MONGODB_MIN_POOL_SIZE,
+        })
+        return stats
+
+    def close_all(self):
+        """Ferme tous les clients partagés (arrêt du processus)"""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._listeners.clear()
+
+
+_registry = MongoClientRegistry()
+atexit.register(_registry.close_all)
+
+
+def get_mongo_client(uri: Optional[str] = None) -> MongoClient:
+    """Retourne le MongoClient partagé du processus"""
+    return _registry.get_client(uri)
+
+
+def get_pool_stats(uri: Optional[str] = None) -> Dict:
+    """Retourne les statistiques du pool de connexions partagé"""
+    return _registry.pool_stats(uri)
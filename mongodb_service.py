@@ -1,58 +1,78 @@
-from pymongo import MongoClient
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 import json
-from bson import ObjectId
-from datetime import datetime
-from config import MONGODB_URI, MONGODB_DATABASE, MONGODB_COLLECTION
+import time
+from config import MONGODB_URI, MONGODB_DATABASE, MONGODB_COLLECTION, PIPELINE_MAX_TIME_MS, RESULT_PAGE_SIZE
+from result_cache import get_result_cache, canonical_query_key
+from mongo_pool import get_mongo_client, get_pool_stats
+from pipeline_optimizer import optimize_pipeline
+from serialization import to_serializable
+from index_advisor import get_index_advisor
+from rollups import get_rollup_manager
+from schema_inference import get_schema_inferrer
+from stats_service import get_stats_service
+from singleflight import get_singleflight
+from columnar_engine import get_columnar_engine
+import telemetry
+from pagination import (
+    ResultPage, encode_token, decode_token, get_path, page_order, range_filter,
+    with_tiebreaker, include_sort_fields
+)
 
 
 class MongoDBService:
     """Service pour interagir avec MongoDB Atlas - collection movies"""
     
-    def __init__(self):
-        self.client = None
+    def __init__(self, client=None):
+        """
+        Args:
+            client: MongoClient déjà construit (mongod local, benchmarks) ;
+                par défaut le client partagé du processus pour MONGODB_URI
+        """
+        self.client = client
         self.db = None
         self.collection = None
+        self.result_cache = None
+        self.last_optimization = None
+        self.index_advisor = None
+        self.rollups = None
+        self.last_route = None
+        self.columnar = None
+        self.last_engine = None
+        self.schema = None
+        self.stats = None
+        self.inflight = get_singleflight()
+        self.last_timings = {}
         self.connect()
     
     def _serialize_document(self, doc):
         """Convertit un document MongoDB en format JSON sérialisable"""
-        if doc is None:
-            return None
-        
-        if isinstance(doc, list):
-            return [self._serialize_document(item) for item in doc]
-        
-        if isinstance(doc, dict):
-            serialized = {}
-            for key, value in doc.items():
-                if isinstance(value, ObjectId):
-                    serialized[key] = str(value)
-                elif isinstance(value, datetime):
-                    serialized[key] = value.isoformat()
-                elif isinstance(value, dict):
-                    serialized[key] = self._serialize_document(value)
-                elif isinstance(value, list):
-                    serialized[key] = self._serialize_document(value)
-                else:
-                    serialized[key] = value
-            return serialized
-        
-        return doc
+        return to_serializable(doc)
     
     def connect(self):
-        """Établit la connexion à MongoDB Atlas"""
+        """Établit la connexion à MongoDB Atlas via le client partagé du processus"""
         try:
-            self.client = MongoClient(MONGODB_URI)
+            # Le ping n'est effectué qu'à la création du client partagé
+            if self.client is None:
+                self.client = get_mongo_client(MONGODB_URI)
             self.db = self.client[MONGODB_DATABASE]
             self.collection = self.db[MONGODB_COLLECTION]
-            # Test de connexion
-            self.client.admin.command('ping')
+            self.result_cache = get_result_cache(self.collection)
+            self.index_advisor = get_index_advisor(self.collection)
+            self.rollups = get_rollup_manager(self.db)
+            self.schema = get_schema_inferrer(self.collection)
+            self.stats = get_stats_service(self.db)
+            self.columnar = get_columnar_engine(self.collection)
             return True
         except Exception as e:
             print(f"Erreur de connexion MongoDB: {e}")
             return False
     
+    def get_schema_context(self) -> Optional[str]:
+        """Résumé compact du schéma déduit de la collection (None si indisponible)"""
+        if not self.schema:
+            return None
+        return self.schema.get_context()
+    
     def get_sample_document(self) -> Optional[Dict]:
         """Retourne un document d'exemple pour comprendre la structure"""
         try:
@@ -62,20 +82,19 @@ class MongoDBService:
             print(f"Erreur lors de la récupération du document d'exemple: {e}")
             return None
     
-    def get_collection_stats(self) -> Dict:
-        """Retourne les statistiques de la collection"""
-        try:
-            stats = self.db.command("collStats", MONGODB_COLLECTION)
-            total_docs = self.collection.count_documents({})
-            return {
-                "total_documents": total_docs,
-                "size_mb": round(stats.get("size", 0) / (1024 * 1024), 2),
-                "avg_document_size": stats.get("avgObjSize", 0),
-                "indexes": len(stats.get("indexSizes", {}))
-            }
-        except Exception as e:
-            print(f"Erreur lors de la récupération des statistiques: {e}")
+    def get_collection_stats(self, force_refresh: bool = False) -> Dict:
+        """
+        Retourne les statistiques de la collection (cache du processus)
+        
+        Args:
+            force_refresh: Relire immédiatement au lieu d'attendre le rafraîchissement de fond
+            
+        Returns:
+            Statistiques avec leur âge (age_seconds) et l'indicateur stale
+        """
+        if not self.stats:
             return {}
+        return self.stats.get(force_refresh)
     
     def execute_query(self, query_type: str, query: Dict) -> List[Dict]:
         """
@@ -88,16 +107,101 @@ class MongoDBService:
         Returns:
             Liste des résultats
         """
+        self.last_optimization = None
+        self.last_route = None
+        self.last_engine = None
+        self.last_timings = {}
+        cache_key = None
+        if self.result_cache:
+            cache_key = canonical_query_key(query_type, query)
+            cached_results = self.result_cache.get(cache_key)
+            telemetry.record_cache("result", cached_results is not None)
+            if cached_results is not None:
+                return cached_results
+        
+        try:
+            # Même requête déjà en cours dans une autre session : on attend son résultat
+            if self.inflight:
+                key = ("execute", cache_key or canonical_query_key(query_type, query))
+                results = self.inflight.do(key, lambda: self._run_query(query_type, query))
+            else:
+                results = self._run_query(query_type, query)
+        except Exception as e:
+            telemetry.record_error("execute")
+            print(f"Erreur lors de l'exécution de la requête: {e}")
+            return []
+        
+        telemetry.observe("mbot_result_rows", len(results), telemetry.SIZE_BUCKETS, query_type=query_type)
+        if cache_key:
+            self.result_cache.set(cache_key, results)
+        return results
+    
+    def _run_query(self, query_type: str, query: Dict) -> List[Dict]:
         if query_type == "aggregate":
-            return self.execute_aggregation(query)
-        else:
-            return self.find_movies(query)
+            return self._run_aggregation(query)
+        return self._run_find(query)
+    
+    def _run_aggregation(self, pipeline: List[Dict]) -> List[Dict]:
+        # Pipeline analytique calculé sur l'instantané colonnaire, sans aller-retour
+        if self.columnar:
+            started = time.perf_counter()
+            result = self.columnar.execute(pipeline)
+            if result is not None:
+                self.last_engine = "columnar"
+                self.last_timings = {"execute_ms": round((time.perf_counter() - started) * 1000, 3)}
+                telemetry.record_span("columnar", self.last_timings["execute_ms"], documents=len(result))
+                return result
+        
+        # Agrégations courantes servies par une collection de cumul si possible
+        route = self.rollups.route("aggregate", pipeline) if self.rollups else None
+        if route:
+            try:
+                result = self._aggregate(self.db[route.collection], route.pipeline)
+                self.last_route = route
+                return result
+            except Exception as e:
+                print(f"Cumul {route.collection} indisponible, exécution sur {MONGODB_COLLECTION}: {e}")
+                self.rollups.mark_unavailable()
+        
+        result = self._aggregate(self.collection, pipeline)
+        if self.index_advisor:
+            self.index_advisor.observe("aggregate", self.last_optimization.pipeline)
+        return result
+    
+    def _aggregate(self, collection, pipeline: List[Dict]) -> List[Dict]:
+        # Pipeline réécrit et borné (maxTimeMS, allowDiskUse, $limit final)
+        report = optimize_pipeline(pipeline)
+        self.last_optimization = report
+        started = time.perf_counter()
+        result = list(collection.aggregate(report.pipeline, **report.options))
+        return self._timed_serialize(result, started)
+    
+    def _run_find(self, query: Dict, limit: int = 10) -> List[Dict]:
+        cursor = self.collection.find(query).limit(limit)
+        if PIPELINE_MAX_TIME_MS:
+            cursor = cursor.max_time_ms(PIPELINE_MAX_TIME_MS)
+        started = time.perf_counter()
+        result = list(cursor)
+        if self.index_advisor:
+            self.index_advisor.observe("find", query)
+        return self._timed_serialize(result, started)
+    
+    def _timed_serialize(self, result: List, started: float) -> List[Dict]:
+        """Sérialise les documents lus et chronomètre exécution et sérialisation (ms)"""
+        executed = time.perf_counter()
+        serialized = self._serialize_document(result)
+        self.last_timings = {
+            "execute_ms": round((executed - started) * 1000, 3),
+            "serialize_ms": round((time.perf_counter() - executed) * 1000, 3),
+        }
+        telemetry.record_span("execute", self.last_timings["execute_ms"], documents=len(result))
+        telemetry.record_span("serialize", self.last_timings["serialize_ms"])
+        return serialized
     
     def execute_aggregation(self, pipeline: List[Dict]) -> List[Dict]:
         """Exécute une requête d'agrégation MongoDB"""
         try:
-            result = list(self.collection.aggregate(pipeline))
-            return self._serialize_document(result)
+            return self._run_aggregation(pipeline)
         except Exception as e:
             print(f"Erreur lors de l'exécution de l'agrégation: {e}")
             return []
@@ -105,13 +209,108 @@ class MongoDBService:
     def find_movies(self, query: Dict, limit: int = 10) -> List[Dict]:
         """Recherche des films selon des critères"""
         try:
-            result = list(self.collection.find(query).limit(limit))
-            return self._serialize_document(result)
+            return self._run_find(query, limit)
         except Exception as e:
             print(f"Erreur lors de la recherche de films: {e}")
             return []
     
+    def fetch_page(self, query_type: str, query: Dict, page_token: Optional[str] = None,
+                   page_size: int = RESULT_PAGE_SIZE, batch_size: Optional[int] = None,
+                   projection: Optional[Dict] = None,
+                   sort: Optional[List[Tuple[str, int]]] = None) -> ResultPage:
+        """
+        Retourne une page de résultats sans charger le reste du curseur
+        
+        La page suivante reprend après la dernière clé de tri (+ _id) lue,
+        sans $skip. Les pipelines dont la sortie n'a pas d'_id unique
+        ($count, $project sans _id...) sont paginés par $skip.
+        
+        Args:
+            query_type: "find" ou "aggregate"
+            query: Filtre ou pipeline d'agrégation
+            page_token: Jeton retourné par la page précédente (None pour la première)
+            page_size: Nombre de documents par page
+            batch_size: Taille des lots du curseur (par défaut une page par aller-retour)
+            projection: Projection appliquée côté serveur
+            sort: Tri d'un find, liste de (champ, 1 ou -1)
+            
+        Returns:
+            ResultPage (documents sérialisés et jeton de la page suivante)
+            
+        Raises:
+            ValueError: jeton invalide pour cette requête
+        """
+        state = decode_token(page_token, query_type, query) if page_token else {}
+        batch_size = batch_size or page_size + 1
+        try:
+            if query_type == "aggregate":
+                documents, order = self._aggregation_page(query, state, page_size, batch_size, projection)
+            else:
+                order = with_tiebreaker(sort)
+                filter_query = query
+                if "after" in state:
+                    filter_query = {"$and": [query, range_filter(order, state["after"])]}
+                cursor = self.collection.find(filter_query, include_sort_fields(projection, order))
+                cursor = cursor.sort(order).limit(page_size + 1).batch_size(batch_size)
+                if PIPELINE_MAX_TIME_MS:
+                    cursor = cursor.max_time_ms(PIPELINE_MAX_TIME_MS)
+                documents = list(cursor)
+        except Exception as e:
+            print(f"Erreur lors de la lecture de la page de résultats: {e}")
+            return ResultPage([], None, page_size)
+        
+        next_token = None
+        if len(documents) > page_size:
+            documents = documents[:page_size]
+            if order is None:
+                next_state = {"skip": state.get("skip", 0) + page_size}
+            else:
+                next_state = {"after": [get_path(documents[-1], field) for field, _ in order]}
+            next_token = encode_token(query_type, query, next_state)
+        return ResultPage(self._serialize_document(documents), next_token, page_size)
+    
+    def _aggregation_page(self, pipeline: List[Dict], state: Dict, page_size: int, batch_size: int,
+                          projection: Optional[Dict]):
+        route = self.rollups.route("aggregate", pipeline) if self.rollups else None
+        collection = self.db[route.collection] if route else self.collection
+        # Pas de $limit global : la taille de chaque page borne le transfert
+        report = optimize_pipeline(route.pipeline if route else pipeline, max_results=0)
+        order = page_order(report.pipeline)
+        
+        stages = list(report.pipeline)
+        if order is None:
+            if state.get("skip"):
+                stages.append({"$skip": state["skip"]})
+        else:
+            # Le $sort final du pipeline est complété par _id plutôt que répété
+            if stages and next(iter(stages[-1])) == "$sort":
+                stages.pop()
+            stages.append({"$sort": dict(order)})
+            if "after" in state:
+                stages.append({"$match": range_filter(order, state["after"])})
+        if projection:
+            stages.append({"$project": include_sort_fields(projection, order)})
+        stages.append({"$limit": page_size + 1})
+        
+        options = dict(report.options, batchSize=batch_size)
+        return list(collection.aggregate(stages, **options)), order
+    
+    def iter_pages(self, query_type: str, query: Dict, **kwargs) -> Iterator[ResultPage]:
+        """Parcourt tous les résultats page par page (mêmes options que fetch_page)"""
+        page_token = None
+        while True:
+            page = self.fetch_page(query_type, query, page_token=page_token, **kwargs)
+            yield page
+            if not page.has_more:
+                return
+            page_token = page.next_token
+    
+    def get_pool_stats(self) -> Dict:
+        """Retourne les statistiques du pool de connexions partagé"""
+        return get_pool_stats(MONGODB_URI)
+    
     def close_connection(self):
-        """Ferme la connexion MongoDB"""
-        if self.client:
-            self.client.close()
\ No newline at end of file
+        """Libère la connexion MongoDB (le client partagé reste ouvert pour les autres sessions)"""
+        self.client = None
+        self.db = None
+        self.collection = None
\ No newline at end of file
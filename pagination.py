@@ -0,0 +1,177 @@
+import base64
+from typing import Any, Dict, List, Optional, Tuple
+from bson import json_util
+from result_cache import canonical_query_key
+
+
+# Étapes après lesquelles les documents n'ont plus d'_id unique exploitable
+_UNKEYED_STAGES = {"$count", "$replaceRoot", "$replaceWith", "$unwind", "$facet", "$unset"}
+
+# Étapes qui produisent de nouveau un _id unique par document
+_REKEYING_STAGES = {"$group", "$bucket", "$bucketAuto", "$sortByCount"}
+
+# Étapes qui peuvent suivre le $sort final sans changer l'ordre si elles gardent les clés de tri
+_FIELD_STAGES = {"$project", "$set", "$addFields", "$unset"}
+
+
+class ResultPage:
+    """Une page de résultats et le jeton permettant de charger la suivante"""
+
+    def __init__(self, documents: List[Dict], next_token: Optional[str], page_size: int):
+        self.documents = documents
+        self.next_token = next_token
+        self.page_size = page_size
+
+    @property
+    def has_more(self) -> bool:
+        return self.next_token is not None
+
+    def to_dict(self) -> Dict:
+        return {"documents": self.documents, "next_token": self.next_token, "page_size": self.page_size}
+
+
+def query_fingerprint(query_type: str, query: Any) -> str:
+    return canonical_query_key(query_type, query)[:16]
+
+
+def encode_token(query_type: str, query: Any, state: Dict) -> str:
+    """Jeton opaque : position de reprise liée à la requête qui l'a produite"""
+    payload = json_util.dumps(dict(state, q=query_fingerprint(query_type, query)))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_token(token: str, query_type: str, query: Any) -> Dict:
+    """
+    Décode un jeton de page
+
+    Raises:
+        ValueError: jeton illisible ou produit par une autre requête
+    """
+    try:
+        state = json_util.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+    except Exception as e:
+        raise ValueError(f"Jeton de page invalide: {e}")
+    if not isinstance(state, dict) or state.pop("q", None) != query_fingerprint(query_type, query):
+        raise ValueError("Jeton de page invalide pour cette requête")
+    return state
+
+
+def get_path(document: Dict, path: str) -> Any:
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def with_tiebreaker(sort: Optional[List[Tuple[str, int]]]) -> List[Tuple[str, int]]:
+    """Ordre total : clés de tri demandées puis _id"""
+    order = [(field, direction) for field, direction in (sort or []) if field != "_id"]
+    id_direction = next((direction for field, direction in (sort or []) if field == "_id"), 1)
+    return order + [("_id", id_direction)]
+
+
+def page_order(pipeline: List[Dict]) -> Optional[List[Tuple[str, int]]]:
+    """
+    Ordre de pagination d'un pipeline : son $sort final (suivi au plus de
+    $limit/$skip et d'étapes qui gardent les clés de tri) complété par _id
+
+    Returns:
+        None si les documents produits n'ont pas d'_id unique ($count,
+        $project sans _id...) ou si les clés de tri sont modifiées après
+        le $sort : la pagination se fait alors par $skip
+    """
+    keyed = True
+    for stage in pipeline:
+        name = next(iter(stage))
+        if name in _REKEYING_STAGES:
+            keyed = True
+        elif name in _UNKEYED_STAGES or (name == "$project" and stage["$project"].get("_id") in (0, False)):
+            keyed = False
+    if not keyed:
+        return None
+    sort = None
+    reshaping = []
+    for stage in reversed(pipeline):
+        name = next(iter(stage))
+        if name in ("$limit", "$skip"):
+            continue
+        if name in _FIELD_STAGES:
+            reshaping.append(stage)
+            continue
+        if name == "$sort":
+            sort = [(field, direction) for field, direction in stage["$sort"].items()]
+        break
+    if sort and any(direction not in (1, -1) for _, direction in sort):
+        return None
+    order = with_tiebreaker(sort)
+    if sort and not all(_keeps_field(stage, field) for stage in reshaping for field, _ in order):
+        # Clés de tri modifiées après le $sort : pagination par $skip dans l'ordre du pipeline
+        return None
+    return order
+
+
+def _overlaps(path: str, other: str) -> bool:
+    return path == other or path.startswith(other + ".") or other.startswith(path + ".")
+
+
+def _keeps_field(stage: Dict, field: str) -> bool:
+    """Vrai si l'étape ($project, $set, $addFields, $unset) laisse le champ inchangé"""
+    name, spec = next(iter(stage.items()))
+    if name == "$unset":
+        removed = [spec] if isinstance(spec, str) else spec
+        return not any(_overlaps(field, path) for path in removed)
+    if name in ("$set", "$addFields"):
+        return not any(_overlaps(field, path) for path in spec)
+    # $project : inclusion (seuls les champs cités restent) ou exclusion
+    fields = {path: value for path, value in spec.items() if path != "_id"}
+    if field == "_id":
+        return spec.get("_id", 1) in (1, True)
+    if any(_overlaps(field, path) and value not in (0, 1, True, False) for path, value in fields.items()):
+        return False
+    if any(value in (1, True) for value in fields.values()):
+        return any(field == path or field.startswith(path + ".") for path, value in fields.items()
+                   if value in (1, True))
+    return not any(_overlaps(field, path) for path in fields)
+
+
+def range_filter(order: List[Tuple[str, int]], values: List[Any]) -> Dict:
+    """
+    Filtre des documents situés après values dans l'ordre order
+
+    (k1 > v1) ou (k1 = v1 et k2 > v2) ou ... ; pour un tri décroissant $lt.
+    Les valeurs nulles sont les plus petites, comme dans le tri MongoDB.
+    """
+    clauses = []
+    for index, (field, direction) in enumerate(order):
+        clause = {prefix_field: value for (prefix_field, _), value in zip(order[:index], values[:index])}
+        value = values[index]
+        if value is None:
+            if direction == -1:
+                continue
+            clause[field] = {"$ne": None}
+        elif direction == 1:
+            clause[field] = {"$gt": value}
+        else:
+            # $lt n'inclut pas les valeurs nulles, qui viennent pourtant après en ordre décroissant
+            clauses.append(dict(clause, **{field: None}))
+            clause[field] = {"$lt": value}
+        clauses.append(clause)
+    return {"$or": clauses} if clauses else {"_id": {"$exists": False}}
+
+
+def include_sort_fields(projection: Optional[Dict], order: Optional[List[Tuple[str, int]]]) -> Optional[Dict]:
+    """Ajoute les clés de tri à une projection par inclusion (nécessaires au jeton suivant)"""
+    if not projection or not order:
+        return projection
+    is_inclusion = any(value not in (0, False) for field, value in projection.items() if field != "_id")
+    if not is_inclusion:
+        return projection
+    projection = dict(projection)
+    for field, _ in order:
+        if field == "_id":
+            projection["_id"] = 1
+        elif not any(field == kept or field.startswith(kept + ".") for kept in projection):
+            projection[field] = 1
+    return projection
@@ -1,62 +1,232 @@
-import requests
 import json
-from typing import Dict, List
-from config import PERPLEXITY_API_KEY, PERPLEXITY_API_URL, PERPLEXITY_MODEL
+import hashlib
+import itertools
+from typing import Dict, Iterator, List, Optional
+from config import (
+    PERPLEXITY_API_KEY, PERPLEXITY_API_URL, PERPLEXITY_MODEL, LOCAL_FORMATTER_ENABLED, EXAMPLE_STORE_RECORD
+)
+from query_cache import get_query_cache, normalize_question
+from http_transport import get_transport
+from result_formatter import format_locally
+from result_compactor import compact_results, needs_complete_results
+from intent_engine import match_intent
+from example_store import get_example_store
+from singleflight import get_singleflight
+import telemetry
+
+
+# Partie fixe du prompt de traduction ; les exemples pertinents sont ajoutés par question
+QUERY_SYSTEM_PROMPT = """Tu es un expert en MongoDB et en analyse de données cinématographiques. 
+
+Ton rôle est de convertir des questions en langage naturel en requêtes MongoDB pour la collection 'movies'.
+
+SCHÉMA DE LA COLLECTION MOVIES:
+{schema_context}
+
+RÈGLES IMPORTANTES:
+- Pour les années, utilise le champ 'year' (nombre)
+- Pour les intervalles d'années: {{"year": {{"$gte": 2012, "$lte": 2014}}}}
+- Pour compter: utilise une requête aggregate avec $match et $count
+- Pour les top N: utilise $sort et $limit dans un pipeline d'agrégation
+- Pour les moyennes: utilise $group avec $avg
+- Pour montrer un document d'exemple: find avec un filtre vide {{}}
+
+RÉPONSE REQUISE - JSON valide uniquement:
+{{
+    "query_type": "find|aggregate",
+    "mongodb_query": {{...}} ou [...],
+    "explanation": "explication concise",
+    "estimated_results": "type de résultats"
+}}"""
+
+
+# Prompt de modification d'une requête précédente (questions de suivi) : ni schéma ni exemples
+FOLLOW_UP_SYSTEM_PROMPT = """Tu modifies une requête MongoDB existante sur la collection 'movies' pour répondre à une question de suivi.
+
+QUESTION PRÉCÉDENTE: {previous_question}
+
+REQUÊTE PRÉCÉDENTE ({query_type}):
+{mongodb_query}
+
+Applique uniquement le changement demandé (valeur modifiée, filtre ajouté ou retiré, nombre de résultats) et garde le reste de la requête à l'identique.
+
+RÉPONSE REQUISE - JSON valide uniquement:
+{{
+    "query_type": "find|aggregate",
+    "mongodb_query": {{...}} ou [...],
+    "explanation": "explication concise",
+    "estimated_results": "type de résultats"
+}}"""
+
+
+class SSEDecoder:
+    """
+    Décodeur incrémental d'un flux server-sent events de chat completion
+
+    Chaque événement "data: {...}" porte un delta de la réponse ; le flux
+    se termine par "data: [DONE]". Certains modèles renvoient le message
+    cumulé plutôt qu'un delta : seule la partie nouvelle est alors émise.
+    """
+    
+    def __init__(self):
+        self.emitted = ""
+        self.done = False
+        self.usage = None
+        self._data_lines = []
+    
+    def feed(self, raw_line) -> Optional[str]:
+        """Traite une ligne du flux et retourne le texte nouveau éventuel"""
+        line = raw_line.decode("utf-8") if isinstance(raw_line, bytes) else raw_line
+        if line:
+            if line.startswith("data:"):
+                self._data_lines.append(line[5:].lstrip())
+            return None
+        
+        # Ligne vide : fin de l'événement courant
+        if not self._data_lines:
+            return None
+        data = "\n".join(self._data_lines)
+        self._data_lines = []
+        if data == "[DONE]":
+            self.done = True
+            return None
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError:
+            return None
+        
+        # Décompte des tokens, en général porté par le dernier événement
+        self.usage = event.get("usage") or self.usage
+        choice = (event.get("choices") or [{}])[0]
+        delta = (choice.get("delta") or {}).get("content")
+        if delta is None:
+            message = (choice.get("message") or {}).get("content") or ""
+            delta = message[len(self.emitted):] if message.startswith(self.emitted) else ""
+        self.emitted += delta
+        return delta or None
+
+
+def _payload_key(payload: Dict) -> str:
+    """Empreinte d'une requête à l'API, pour regrouper les appels identiques"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
 
 
 class PerplexityService:
     """Service pour interagir avec l'API Perplexity"""
     
-    def __init__(self):
+    def __init__(self, api_url: Optional[str] = None):
+        """
+        Args:
+            api_url: Point d'accès compatible chat completions (serveur de test,
+                benchmarks) ; PERPLEXITY_API_URL par défaut
+        """
         self.api_key = PERPLEXITY_API_KEY
-        self.api_url = PERPLEXITY_API_URL
+        self.api_url = api_url or PERPLEXITY_API_URL
         self.model = PERPLEXITY_MODEL
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self.query_cache = get_query_cache()
+        self.transport = get_transport()
+        self.last_timings = {}
+        self.last_compaction = None
+        # Erreur du dernier formatage (réponse remplacée par les résultats bruts)
+        self.last_format_error = None
+        self.example_store = get_example_store()
+        self.inflight = get_singleflight()
+        self._prompt_prefix = (None, None)
     
-    def _get_standard_query(self, user_question: str) -> Dict:
-        """Retourne une requête standard pour les questions courantes"""
-        question_lower = user_question.lower()
-        
-        # Questions pour voir un document d'exemple (SANS critères spécifiques)
-        has_document_keywords = any(keyword in question_lower for keyword in [
-            "document", "exemple", "contenu d'un document", "structure", 
-            "voir un document", "montrer un document", "échantillon"
-        ])
-        
-        # Vérifier s'il y a des critères spécifiques (années, genres, etc.)
-        has_specific_criteria = any(criteria in question_lower for criteria in [
-            "en 20", "année", "genre", "réalisateur", "acteur", "note", 
-            "paru en", "sorti en", "de 19", "de 20", "entre", "avec",
-            "rating", "imdb", "director", "cast", "spielberg", "scorsese",
-            "supérieure", "inférieure", "action", "drame", "comédie",
-            "thriller", "horreur", "romance", "animation"
-        ])
-        
-        # Seulement si document demandé SANS critères spécifiques
-        if has_document_keywords and not has_specific_criteria:
-            return {
-                "query_type": "find",
-                "mongodb_query": {},
-                "explanation": "Récupération d'un document d'exemple de la collection movies",
-                "estimated_results": "Un document complet avec tous les champs disponibles"
-            }
+    def _cache_namespace(self, schema_context: str) -> str:
+        """Identifie le contexte de traduction (modèle + schéma) pour le cache"""
+        schema_hash = hashlib.sha256((schema_context or "").encode("utf-8")).hexdigest()[:16]
+        return f"{self.model}:{schema_hash}"
+    
+    def _get_standard_query(self, user_question: str) -> Optional[Dict]:
+        """Retourne une requête standard pour les questions courantes (moteur d'intentions)"""
+        return match_intent(user_question)
+    
+    def _lookup_query(self, user_question: str, schema_context: str):
+        """
+        Cherche une requête sans appel à l'API (questions standards puis cache)
+
+        Returns:
+            Tuple (requête trouvée ou None, namespace de cache)
+        """
+        # Vérifier d'abord les questions standards
+        with telemetry.span("intent"):
+            standard_query = self._get_standard_query(user_question)
+        if standard_query:
+            return standard_query, None
         
-        # Questions pour le total de films
-        if any(keyword in question_lower for keyword in [
-            "combien de films au total", "nombre total de films", "total de films",
-            "combien de films dans la collection", "taille de la collection"
-        ]):
+        # Puis le cache des questions déjà traduites
+        cache_namespace = self._cache_namespace(schema_context)
+        if self.query_cache:
+            cached_query = self.query_cache.get(user_question, cache_namespace)
+            telemetry.record_cache("query", cached_query is not None)
+            if cached_query:
+                return cached_query, cache_namespace
+        return None, cache_namespace
+    
+    def _system_prefix(self, schema_context: str) -> str:
+        """Partie fixe du prompt de traduction, construite une fois par contexte de schéma"""
+        cached_context, prefix = self._prompt_prefix
+        if prefix is None or cached_context != schema_context:
+            prefix = QUERY_SYSTEM_PROMPT.format(schema_context=schema_context)
+            self._prompt_prefix = (schema_context, prefix)
+        return prefix
+    
+    def _build_query_payload(self, user_question: str, schema_context: str) -> Dict:
+        """Construit la requête de traduction question → MongoDB envoyée à l'API"""
+        system_prompt = self._system_prefix(schema_context)
+        # Seuls les exemples proches de la question sont ajoutés à la partie fixe
+        examples = self.example_store.render(user_question) if self.example_store else ""
+        if examples:
+            system_prompt += "\n\n" + examples
+
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user", 
+                    "content": user_question
+                }
+            ],
+            "max_tokens": 1000,
+            "temperature": 0.0,  # Température très basse pour plus de consistance
+            "stream": False
+        }
+    
+    def _parse_query_content(self, content: str, user_question: str, cache_namespace: str) -> Dict:
+        """Interprète la réponse JSON du modèle et la met en cache si elle est valide"""
+        # Tenter de parser le JSON de la réponse
+        try:
+            # Nettoyer le contenu si nécessaire
+            content = content.strip()
+            if content.startswith("```json"):
+                content = content.replace("```json", "").replace("```", "").strip()
+            elif content.startswith("```"):
+                content = content.replace("```", "").strip()
+            
+            query_info = json.loads(content)
+            if self.query_cache and query_info.get("query_type") in ("find", "aggregate"):
+                self.query_cache.set(user_question, query_info, cache_namespace)
+            return query_info
+        except json.JSONDecodeError as e:
+            telemetry.record_error("parse")
+            print(f"Erreur de parsing JSON: {e}")
+            print(f"Contenu reçu: {content}")
+            # Si ce n'est pas du JSON valide, retourner une structure par défaut
             return {
-                "query_type": "aggregate",
-                "mongodb_query": [{"$count": "total"}],
-                "explanation": "Comptage du nombre total de films dans la collection",
-                "estimated_results": "Le nombre total de documents"
+                "query_type": "error",
+                "mongodb_query": {},
+                "explanation": f"Erreur de parsing JSON de l'API Perplexity. Contenu reçu: {content[:200]}...",
+                "estimated_results": "Aucun"
             }
-        
-        return None
     
     def generate_mongodb_query(self, user_question: str, schema_context: str) -> Dict:
         """
@@ -70,92 +240,84 @@ class PerplexityService:
             Dict contenant la requête MongoDB et l'explication
         """
         
-        # Vérifier d'abord les questions standards
-        standard_query = self._get_standard_query(user_question)
-        if standard_query:
-            return standard_query
+        known_query, cache_namespace = self._lookup_query(user_question, schema_context)
+        if known_query:
+            return known_query
+        
+        try:
+            # Une seule traduction pour les sessions qui posent la même question en même temps
+            if self.inflight:
+                key = ("generate", cache_namespace, normalize_question(user_question))
+                return self.inflight.do(key, lambda: self._request_query(user_question, schema_context, cache_namespace))
+            return self._request_query(user_question, schema_context, cache_namespace)
+                
+        except Exception as e:
+            return {
+                "query_type": "error",
+                "mongodb_query": {},
+                "explanation": f"Erreur API Perplexity: {str(e)}",
+                "estimated_results": "Aucun"
+            }
+    
+    def _request_query(self, user_question: str, schema_context: str, cache_namespace: str) -> Dict:
+        """Appel de traduction à l'API (exceptions propagées)"""
+        with telemetry.span("generate"):
+            payload = self._build_query_payload(user_question, schema_context)
+            
+            response = self.transport.post(self.api_url, headers=self.headers, json=payload)
+            self.last_timings = self.transport.last_timings()
+            response.raise_for_status()
+            
+            result = response.json()
+        telemetry.record_llm_call("generate", self.last_timings, result.get("usage"))
+        self.transport.record_usage(result.get("usage"))
+        content = result["choices"][0]["message"]["content"]
+        return self._parse_query_content(content, user_question, cache_namespace)
+    
+    def generate_follow_up_query(self, follow_up: str, previous_question: str, previous_query_info: Dict,
+                                 schema_context: str) -> Dict:
+        """
+        Fait modifier la requête précédente par le LLM pour une question de suivi
+        
+        Args:
+            follow_up: Question de suivi (« et seulement les films français ? »)
+            previous_question: Question à laquelle répondait la requête précédente
+            previous_query_info: Requête précédente (query_type, mongodb_query)
+            schema_context: Contexte du schéma (clé de cache seulement)
+            
+        Returns:
+            Dict contenant la requête MongoDB et l'explication
+        """
+        # Clé de cache : la question précédente et son suivi
+        question = f"{previous_question} — {follow_up}"
+        cache_namespace = self._cache_namespace(schema_context)
+        if self.query_cache:
+            cached_query = self.query_cache.get(question, cache_namespace)
+            telemetry.record_cache("query", cached_query is not None)
+            if cached_query:
+                return cached_query
         
-        system_prompt = f"""Tu es un expert en MongoDB et en analyse de données cinématographiques. 
-
-Ton rôle est de convertir des questions en langage naturel en requêtes MongoDB pour la collection 'movies'.
-
-SCHÉMA DE LA COLLECTION MOVIES:
-{schema_context}
-
-RÈGLES IMPORTANTES:
-- Pour les années, utilise le champ 'year' (nombre)
-- Pour les intervalles d'années: {{"year": {{"$gte": 2012, "$lte": 2014}}}}
-- Pour compter: utilise une requête aggregate avec $match et $count
-- Pour les top N: utilise $sort et $limit dans un pipeline d'agrégation
-- Pour les moyennes: utilise $group avec $avg
-
-EXEMPLES DE REQUÊTES STANDARDS:
-- Montrer un document: {{"query_type": "find", "mongodb_query": {{}}, "explanation": "Récupération d'un document d'exemple", "estimated_results": "Un document"}}
-- Compter films entre 2012-2014: [{{"$match": {{"year": {{"$gte": 2012, "$lte": 2014}}}}}}, {{"$count": "total"}}]
-- Top réalisateurs: [{{"$unwind": "$directors"}}, {{"$group": {{"_id": "$directors", "count": {{"$sum": 1}}}}}}, {{"$sort": {{"count": -1}}}}, {{"$limit": 5}}]
-- Notes moyennes par année: [{{"$match": {{"year": {{"$gte": 2005, "$lte": 2010}}, "imdb.rating": {{"$exists": true}}}}}}, {{"$group": {{"_id": "$year", "avgRating": {{"$avg": "$imdb.rating"}}}}}}, {{"$sort": {{"_id": 1}}}}]
-
-QUESTIONS STANDARDS ET LEURS REQUÊTES:
-- "document", "exemple", "contenu d'un document" → find vide {{}}
-- "combien", "nombre" → aggregate avec $count
-- "moyenne", "note moyenne" → aggregate avec $avg
-- "top", "meilleurs", "classement" → aggregate avec $sort + $limit
-
-RÉPONSE REQUISE - JSON valide uniquement:
-{{
-    "query_type": "find|aggregate",
-    "mongodb_query": {{...}} ou [...],
-    "explanation": "explication concise",
-    "estimated_results": "type de résultats"
-}}
-
-Question: {user_question}"""
-
         try:
+            system_prompt = FOLLOW_UP_SYSTEM_PROMPT.format(
+                previous_question=previous_question,
+                query_type=previous_query_info.get("query_type", "aggregate"),
+                mongodb_query=json.dumps(previous_query_info.get("mongodb_query", {}), ensure_ascii=False),
+            )
             payload = {
                 "model": self.model,
                 "messages": [
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user", 
-                        "content": user_question
-                    }
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": follow_up}
                 ],
                 "max_tokens": 1000,
-                "temperature": 0.0,  # Température très basse pour plus de consistance
+                "temperature": 0.0,
                 "stream": False
             }
-            
-            response = requests.post(self.api_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            
-            result = response.json()
-            content = result["choices"][0]["message"]["content"]
-            
-            # Tenter de parser le JSON de la réponse
-            try:
-                # Nettoyer le contenu si nécessaire
-                content = content.strip()
-                if content.startswith("```json"):
-                    content = content.replace("```json", "").replace("```", "").strip()
-                elif content.startswith("```"):
-                    content = content.replace("```", "").strip()
-                
-                return json.loads(content)
-            except json.JSONDecodeError as e:
-                print(f"Erreur de parsing JSON: {e}")
-                print(f"Contenu reçu: {content}")
-                # Si ce n'est pas du JSON valide, retourner une structure par défaut
-                return {
-                    "query_type": "error",
-                    "mongodb_query": {},
-                    "explanation": f"Erreur de parsing JSON de l'API Perplexity. Contenu reçu: {content[:200]}...",
-                    "estimated_results": "Aucun"
-                }
-                
+            if self.inflight:
+                key = ("follow_up", cache_namespace, _payload_key(payload))
+                return self.inflight.do(key, lambda: self._request_follow_up(payload, question, cache_namespace))
+            return self._request_follow_up(payload, question, cache_namespace)
+        
         except Exception as e:
             return {
                 "query_type": "error",
@@ -164,43 +326,56 @@ Question: {user_question}"""
                 "estimated_results": "Aucun"
             }
     
-    def format_results(self, query_results: List[Dict], user_question: str) -> str:
-        """
-        Formate les résultats de la requête MongoDB en réponse naturelle
-        
-        Args:
-            query_results: Résultats de la requête MongoDB
-            user_question: Question originale de l'utilisateur
+    def _request_follow_up(self, payload: Dict, question: str, cache_namespace: str) -> Dict:
+        """Appel de modification à l'API (exceptions propagées)"""
+        with telemetry.span("generate", follow_up=True):
+            response = self.transport.post(self.api_url, headers=self.headers, json=payload)
+            self.last_timings = self.transport.last_timings()
+            response.raise_for_status()
             
+            result = response.json()
+        telemetry.record_llm_call("follow_up", self.last_timings, result.get("usage"))
+        self.transport.record_usage(result.get("usage"))
+        content = result["choices"][0]["message"]["content"]
+        return self._parse_query_content(content, question, cache_namespace)
+    
+    def record_success(self, user_question: str, query_info: Dict, query_results: List[Dict]) -> bool:
+        """
+        Ajoute une traduction exécutée avec des résultats aux exemples du prompt
+
+        Les questions reconnues par le moteur d'intentions n'appellent pas
+        l'API et ne sont pas enregistrées ; EXAMPLE_STORE_RECORD=false
+        désactive l'enregistrement (exemples de départ et fichier existant seuls).
+        """
+        if not EXAMPLE_STORE_RECORD or not self.example_store or not query_results or query_info.get("query_type") not in ("find", "aggregate"):
+            return False
+        if self._get_standard_query(user_question):
+            return False
+        return self.example_store.add(user_question, query_info["query_type"], query_info.get("mongodb_query", {}))
+    
+    def _build_format_request(self, query_results: List[Dict], user_question: str):
+        """
+        Prépare la requête de formatage des résultats
+
         Returns:
-            Réponse formatée en langage naturel
+            Tuple (payload, résumé des résultats) à envoyer à l'API
         """
-        
-        if not query_results:
-            return "Aucun résultat trouvé pour votre question."
-        
         results_summary = f"Nombre de résultats: {len(query_results)}\n\n"
         
-        # Détecter les questions nécessitant tous les résultats
-        needs_complete_results = any(keyword in user_question.lower() for keyword in [
-            "pour toutes les années", "toutes les", "chaque année", "par année", 
-            "pour chaque", "détaillé", "complet", "tous les résultats"
-        ])
-        
-        if len(query_results) <= 10 or needs_complete_results:
-            results_summary += "Résultats complets:\n" + json.dumps(query_results, indent=2, ensure_ascii=False)
-        else:
-            results_summary += "Aperçu des premiers résultats:\n" + json.dumps(query_results[:5], indent=2, ensure_ascii=False)
-            results_summary += f"\n\n... et {len(query_results)-5} autres résultats."
+        # Tableau compact, ou résumé statistique au-delà du budget de tokens
+        needs_complete = needs_complete_results(user_question)
+        compaction = compact_results(query_results, user_question)
+        self.last_compaction = compaction
+        results_summary += compaction.text
         
         # Instructions adaptées selon le type de question
         complete_instruction = ""
-        if needs_complete_results:
+        if needs_complete:
             complete_instruction = "\n\nIMPORTANT: L'utilisateur demande TOUTES les données. Tu DOIS présenter CHAQUE résultat fourni dans les données, sans exception. Ne pas omettre ou résumer aucune donnée."
         
         format_prompt = f"""Voici les résultats d'une requête MongoDB pour la question: "{user_question}"
 
-DONNÉES:
+DONNÉES (tableaux : ligne « Colonnes » puis une ligne par résultat):
 {results_summary}
 
 Formate cette réponse de manière claire et professionnelle en:
@@ -211,25 +386,137 @@ Formate cette réponse de manière claire et professionnelle en:
 
 Réponse naturelle et accessible:"""
 
-        try:
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": format_prompt
-                    }
-                ],
-                "max_tokens": 2500 if needs_complete_results else 1500,
-                "temperature": 0.3,
-                "stream": False
-            }
+        payload = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": format_prompt
+                }
+            ],
+            "max_tokens": 2500 if needs_complete else 1500,
+            "temperature": 0.3,
+            "stream": False
+        }
+        return payload, results_summary
+    
+    def _format_locally(self, query_results: List[Dict], user_question: str) -> Optional[str]:
+        """Mise en forme locale sans appel à l'API, quand la forme des résultats le permet"""
+        if not LOCAL_FORMATTER_ENABLED:
+            return None
+        return format_locally(query_results, user_question)
+    
+    def format_results(self, query_results: List[Dict], user_question: str) -> str:
+        """
+        Formate les résultats de la requête MongoDB en réponse naturelle
+        
+        Args:
+            query_results: Résultats de la requête MongoDB
+            user_question: Question originale de l'utilisateur
             
-            response = requests.post(self.api_url, headers=self.headers, json=payload)
-            response.raise_for_status()
+        Returns:
+            Réponse formatée en langage naturel
+        """
+        
+        self.last_compaction = None
+        self.last_format_error = None
+        if not query_results:
+            return "Aucun résultat trouvé pour votre question."
+        
+        with telemetry.span("format") as attributes:
+            local_response = self._format_locally(query_results, user_question)
+            attributes["mode"] = "local" if local_response else "llm"
+            if local_response:
+                return local_response
             
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
+            payload, results_summary = self._build_format_request(query_results, user_question)
+
+            try:
+                # Même prompt (question et résultats) : un seul appel partagé
+                if self.inflight:
+                    return self.inflight.do(("format", _payload_key(payload)), lambda: self._request_format(payload))
+                return self._request_format(payload)
+                
+            except Exception as e:
+                telemetry.record_error("format")
+                self.last_format_error = str(e)
+                return f"Erreur lors du formatage: {str(e)}\n\nRésultats bruts:\n{results_summary}"
+    
+    def _request_format(self, payload: Dict) -> str:
+        """Appel de formatage à l'API (exceptions propagées)"""
+        response = self.transport.post(self.api_url, headers=self.headers, json=payload)
+        self.last_timings = self.transport.last_timings()
+        response.raise_for_status()
+        
+        result = response.json()
+        telemetry.record_llm_call("format", self.last_timings, result.get("usage"))
+        self.transport.record_usage(result.get("usage"))
+        return result["choices"][0]["message"]["content"]
+    
+    def format_results_stream(self, query_results: List[Dict], user_question: str) -> Iterator[str]:
+        """
+        Formate les résultats en diffusant la réponse au fil de la génération
+        
+        Args:
+            query_results: Résultats de la requête MongoDB
+            user_question: Question originale de l'utilisateur
             
-        except Exception as e:
-            return f"Erreur lors du formatage: {str(e)}\n\nRésultats bruts:\n{results_summary}"
\ No newline at end of file
+        Yields:
+            Fragments successifs de la réponse ; leur concaténation est
+            identique à ce que retournerait format_results
+        """
+        
+        self.last_compaction = None
+        self.last_format_error = None
+        if not query_results:
+            yield "Aucun résultat trouvé pour votre question."
+            return
+        
+        with telemetry.span("format") as attributes:
+            local_response = self._format_locally(query_results, user_question)
+            attributes["mode"] = "local" if local_response else "llm"
+            if local_response:
+                yield local_response
+                return
+            
+            payload, results_summary = self._build_format_request(query_results, user_question)
+            payload["stream"] = True
+            
+            received_any = False
+            try:
+                # Les sessions qui attendent le même texte relisent le flux déjà en cours
+                if self.inflight:
+                    chunks = self.inflight.stream(("format_stream", _payload_key(payload)),
+                                                  lambda: self._request_format_stream(payload))
+                else:
+                    chunks = self._request_format_stream(payload)
+                for chunk in chunks:
+                    received_any = True
+                    yield chunk
+            except Exception as e:
+                telemetry.record_error("format")
+                self.last_format_error = str(e)
+                prefix = "\n\n" if received_any else ""
+                yield f"{prefix}Erreur lors du formatage: {str(e)}\n\nRésultats bruts:\n{results_summary}"
+    
+    def _request_format_stream(self, payload: Dict) -> Iterator[str]:
+        """Appel de formatage en flux à l'API (exceptions propagées)"""
+        decoder = SSEDecoder()
+        with self.transport.post(self.api_url, headers=self.headers, json=payload, stream=True) as response:
+            self.last_timings = self.transport.last_timings()
+            response.raise_for_status()
+            yield from self._iter_sse_content(response, decoder)
+        telemetry.record_llm_call("format", self.last_timings, decoder.usage)
+        self.transport.record_usage(decoder.usage)
+    
+    @staticmethod
+    def _iter_sse_content(response, decoder: Optional[SSEDecoder] = None) -> Iterator[str]:
+        """Extrait le texte généré d'un flux server-sent events"""
+        decoder = decoder or SSEDecoder()
+        # Une ligne vide finale garantit le traitement du dernier événement
+        for line in itertools.chain(response.iter_lines(), [b""]):
+            delta = decoder.feed(line)
+            if delta:
+                yield delta
+            if decoder.done:
+                return
@@ -0,0 +1,313 @@
+import copy
+from typing import Any, Dict, List, Optional, Set
+from config import (
+    PIPELINE_MAX_RESULTS, PIPELINE_MAX_TIME_MS, PIPELINE_ALLOW_DISK_USE, PIPELINE_BATCH_SIZE
+)
+
+
+# Nombre approximatif de champs de premier niveau d'un document movies
+MOVIE_FIELD_COUNT = 22
+
+# Étapes qui remplacent les documents : les champs non référencés avant elles sont inutiles
+SHAPING_STAGES = {"$group", "$count", "$bucket", "$bucketAuto", "$sortByCount"}
+
+# Étapes dont les dépendances ne peuvent pas être déduites simplement
+OPAQUE_STAGES = {"$lookup", "$graphLookup", "$facet", "$replaceRoot", "$replaceWith",
+                 "$unionWith", "$merge", "$out", "$redact", "$setWindowFields", "$densify", "$fill"}
+
+# Étapes qui terminent le pipeline par un résultat borné
+BOUNDED_TERMINAL_STAGES = {"$count", "$limit"}
+
+
+class OptimizationReport:
+    """Pipeline original, pipeline réécrit, options d'exécution et gains estimés"""
+
+    def __init__(self, original: List[Dict], pipeline: List[Dict], options: Dict,
+                 changes: List[str], estimated_savings: List[str]):
+        self.original = original
+        self.pipeline = pipeline
+        self.options = options
+        self.changes = changes
+        self.estimated_savings = estimated_savings
+
+    @property
+    def rewritten(self) -> bool:
+        return self.pipeline != self.original
+
+    def to_dict(self) -> Dict:
+        return {
+            "original": self.original,
+            "optimized": self.pipeline,
+            "options": self.options,
+            "changes": self.changes,
+            "estimated_savings": self.estimated_savings,
+        }
+
+
+def _stage_name(stage: Dict) -> Optional[str]:
+    if isinstance(stage, dict) and len(stage) == 1:
+        return next(iter(stage))
+    return None
+
+
+def _collect_expression_paths(value: Any, paths: Set[str]) -> bool:
+    """
+    Collecte les chemins "$champ" d'une expression
+
+    Returns:
+        False si l'expression référence le document entier ($$ROOT/$$CURRENT)
+    """
+    if isinstance(value, str):
+        if value.startswith("$$"):
+            variable = value[2:].split(".")[0]
+            if variable in ("ROOT", "CURRENT"):
+                return False
+        elif value.startswith("$") and len(value) > 1:
+            paths.add(value[1:])
+        return True
+    if isinstance(value, dict):
+        return all(_collect_expression_paths(item, paths) for item in value.values())
+    if isinstance(value, list):
+        return all(_collect_expression_paths(item, paths) for item in value)
+    return True
+
+
+def _collect_match_paths(query: Any, paths: Set[str]) -> bool:
+    """Collecte les champs filtrés par un $match"""
+    if isinstance(query, list):
+        return all(_collect_match_paths(item, paths) for item in query)
+    if not isinstance(query, dict):
+        return True
+    for key, value in query.items():
+        if key == "$expr":
+            if not _collect_expression_paths(value, paths):
+                return False
+        elif key in ("$and", "$or", "$nor"):
+            if not _collect_match_paths(value, paths):
+                return False
+        elif key in ("$text", "$where", "$jsonSchema"):
+            return False
+        elif not key.startswith("$"):
+            paths.add(key)
+    return True
+
+
+def _stage_paths(stage: Dict) -> Optional[Set[str]]:
+    """Champs du document d'entrée utilisés par une étape (None si indéterminable)"""
+    name = _stage_name(stage)
+    if name is None or name in OPAQUE_STAGES:
+        return None
+    spec = stage[name]
+    paths: Set[str] = set()
+    if name == "$match":
+        return paths if _collect_match_paths(spec, paths) else None
+    if name == "$sort":
+        return set(spec.keys()) if isinstance(spec, dict) else None
+    if name == "$unwind":
+        path = spec.get("path") if isinstance(spec, dict) else spec
+        if not isinstance(path, str) or not path.startswith("$"):
+            return None
+        return {path[1:]}
+    if name in ("$limit", "$skip", "$count", "$sample"):
+        return paths
+    if name == "$project":
+        # Inclusion ou exclusion : les clés sont des chemins du document d'entrée
+        for key, value in spec.items():
+            paths.add(key)
+            if not _collect_expression_paths(value, paths):
+                return None
+        return paths
+    return paths if _collect_expression_paths(spec, paths) else None
+
+
+def _overlaps(path: str, others: Set[str]) -> bool:
+    """Vrai si path est égal, parent ou enfant d'un des chemins"""
+    for other in others:
+        if path == other or path.startswith(other + ".") or other.startswith(path + "."):
+            return True
+    return False
+
+
+def _hoist_matches(pipeline: List[Dict], changes: List[str]) -> List[Dict]:
+    """Remonte chaque $match avant les $sort et les $unwind qui ne le concernent pas"""
+    pipeline = list(pipeline)
+    moved = True
+    while moved:
+        moved = False
+        for index in range(1, len(pipeline)):
+            stage = pipeline[index]
+            previous = pipeline[index - 1]
+            if _stage_name(stage) != "$match":
+                continue
+            previous_name = _stage_name(previous)
+            match_paths: Set[str] = set()
+            if not _collect_match_paths(stage["$match"], match_paths):
+                continue
+            if previous_name == "$sort":
+                can_move = True
+            elif previous_name == "$unwind":
+                unwind_paths = _stage_paths(previous) or set()
+                spec = previous["$unwind"]
+                if isinstance(spec, dict) and spec.get("includeArrayIndex"):
+                    unwind_paths.add(spec["includeArrayIndex"])
+                can_move = bool(unwind_paths) and not any(_overlaps(path, unwind_paths) for path in match_paths)
+            else:
+                can_move = False
+            if can_move:
+                pipeline[index - 1], pipeline[index] = stage, previous
+                changes.append(f"$match remonté avant {previous_name}")
+                moved = True
+    return _merge_matches(_prefilter_unwinds(pipeline, changes), changes)
+
+
+def _is_element_filter(condition: Any) -> bool:
+    """Égalité ou $in sur des scalaires : vraie pour un élément si vraie pour le tableau"""
+    if isinstance(condition, (str, int, float, bool)):
+        return True
+    if isinstance(condition, dict) and len(condition) == 1:
+        operator, value = next(iter(condition.items()))
+        if operator == "$eq":
+            return isinstance(value, (str, int, float, bool))
+        if operator == "$in":
+            return isinstance(value, list) and all(isinstance(item, (str, int, float, bool)) for item in value)
+    return False
+
+
+def _prefilter_unwinds(pipeline: List[Dict], changes: List[str]) -> List[Dict]:
+    """
+    Duplique avant un $unwind le $match qui filtre les éléments déroulés
+
+    {"$unwind": "$genres"}, {"$match": {"genres": "Drama"}} : les films sans
+    "Drama" sont écartés avant d'être déroulés ; le $match d'origine reste
+    en place pour filtrer les éléments.
+    """
+    result: List[Dict] = []
+    for index, stage in enumerate(pipeline):
+        result.append(stage)
+        if index == 0 or _stage_name(stage) != "$match" or _stage_name(pipeline[index - 1]) != "$unwind":
+            continue
+        unwind = pipeline[index - 1]["$unwind"]
+        if isinstance(unwind, dict) and (unwind.get("includeArrayIndex") or unwind.get("preserveNullAndEmptyArrays")):
+            continue
+        unwind_path = (_stage_paths(pipeline[index - 1]) or {None}).pop()
+        query = stage["$match"]
+        if set(query) == {unwind_path} and _is_element_filter(query[unwind_path]):
+            if len(result) >= 3 and result[-3] == stage:
+                continue
+            result.insert(len(result) - 2, copy.deepcopy(stage))
+            changes.append(f"$match sur {unwind_path} dupliqué avant $unwind")
+    return result
+
+
+def _merge_matches(pipeline: List[Dict], changes: List[str]) -> List[Dict]:
+    """Fusionne les $match consécutifs"""
+    merged: List[Dict] = []
+    for stage in pipeline:
+        if merged and _stage_name(stage) == "$match" and _stage_name(merged[-1]) == "$match":
+            merged[-1] = {"$match": {"$and": [merged[-1]["$match"], stage["$match"]]}}
+            changes.append("$match consécutifs fusionnés")
+        else:
+            merged.append(stage)
+    return merged
+
+
+def _inject_projection(pipeline: List[Dict], changes: List[str], savings: List[str]) -> List[Dict]:
+    """Ajoute un $project des seuls champs utilisés avant la première étape de regroupement"""
+    shaping_index = next(
+        (index for index, stage in enumerate(pipeline) if _stage_name(stage) in SHAPING_STAGES), None
+    )
+    if shaping_index is None:
+        return pipeline
+
+    used_paths: Set[str] = set()
+    for stage in pipeline[:shaping_index + 1]:
+        if _stage_name(stage) == "$project":
+            return pipeline
+        stage_paths = _stage_paths(stage)
+        if stage_paths is None:
+            return pipeline
+        used_paths |= stage_paths
+
+    # Chemins minimaux : "imdb" couvre "imdb.rating"
+    roots = sorted(used_paths, key=len)
+    minimal: List[str] = []
+    for path in roots:
+        if not any(path == kept or path.startswith(kept + ".") for kept in minimal):
+            minimal.append(path)
+
+    projection: Dict[str, int] = {path: 1 for path in sorted(minimal)}
+    if not any(path == "_id" or path.startswith("_id.") for path in minimal):
+        projection["_id"] = 0
+
+    # Après les $match de tête, pour conserver l'utilisation des index
+    insert_at = 0
+    while insert_at < shaping_index and _stage_name(pipeline[insert_at]) == "$match":
+        insert_at += 1
+    pipeline = pipeline[:insert_at] + [{"$project": projection}] + pipeline[insert_at:]
+
+    kept_fields = len({path.split(".")[0] for path in minimal})
+    changes.append(f"$project ajouté : {', '.join(sorted(minimal)) or '_id'}")
+    reduction = max(0, round(100 * (1 - max(kept_fields, 1) / MOVIE_FIELD_COUNT)))
+    savings.append(
+        f"Documents réduits à {kept_fields} champ(s) sur ~{MOVIE_FIELD_COUNT} : "
+        f"~{reduction} % de données en moins entre les étapes"
+    )
+    return pipeline
+
+
+def _cap_results(pipeline: List[Dict], max_results: int, changes: List[str], savings: List[str]) -> List[Dict]:
+    """Ajoute un $limit final si rien ne borne la taille du résultat"""
+    if not max_results or not pipeline:
+        return pipeline
+    last_name = _stage_name(pipeline[-1])
+    if last_name in BOUNDED_TERMINAL_STAGES or last_name in ("$out", "$merge"):
+        return pipeline
+    if last_name == "$group" and pipeline[-1]["$group"].get("_id") is None:
+        return pipeline
+    changes.append(f"$limit {max_results} ajouté en fin de pipeline")
+    savings.append(f"Résultat plafonné à {max_results} documents")
+    return pipeline + [{"$limit": max_results}]
+
+
+def aggregate_options() -> Dict:
+    """Options d'exécution appliquées à chaque agrégation"""
+    options = {"allowDiskUse": PIPELINE_ALLOW_DISK_USE}
+    if PIPELINE_MAX_TIME_MS:
+        options["maxTimeMS"] = PIPELINE_MAX_TIME_MS
+    if PIPELINE_BATCH_SIZE:
+        options["batchSize"] = PIPELINE_BATCH_SIZE
+    return options
+
+
+def optimize_pipeline(pipeline: List[Dict], max_results: int = PIPELINE_MAX_RESULTS) -> OptimizationReport:
+    """
+    Réécrit un pipeline d'agrégation avant exécution
+
+    - remonte les $match avant $sort et $unwind quand c'est sans effet sur le résultat
+    - ajoute un $project des champs réellement utilisés avant un $group/$count
+    - plafonne la taille du résultat par un $limit final
+    - fixe maxTimeMS, allowDiskUse et batchSize
+
+    Args:
+        pipeline: Pipeline d'agrégation (non modifié)
+        max_results: Nombre maximal de documents retournés (0 pour désactiver)
+
+    Returns:
+        OptimizationReport décrivant la réécriture
+    """
+    original = copy.deepcopy(pipeline)
+    changes: List[str] = []
+    savings: List[str] = []
+    if not isinstance(pipeline, list) or not all(_stage_name(stage) for stage in pipeline):
+        return OptimizationReport(original, pipeline, aggregate_options(), changes, savings)
+
+    optimized = _hoist_matches(copy.deepcopy(pipeline), changes)
+    if any("avant $unwind" in change for change in changes):
+        savings.append("Filtre appliqué avant $unwind : moins de documents déroulés")
+    optimized = _inject_projection(optimized, changes, savings)
+    optimized = _cap_results(optimized, max_results, changes, savings)
+
+    options = aggregate_options()
+    if "maxTimeMS" in options:
+        savings.append(f"Exécution interrompue au-delà de {options['maxTimeMS']} ms")
+    return OptimizationReport(original, optimized, options, changes, savings)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, Optional
+from config import QUERY_CACHE_PATH, QUERY_CACHE_TTL, QUERY_CACHE_MAX_ENTRIES
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_COMBINING_MARKS_RE = re.compile(r"[\u0300-\u036f]")
+_TRAILING_PUNCTUATION_RE = re.compile(r"[\s?!.;:,]+$")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalise une question pour la rendre comparable
+
+    Minuscules, suppression des accents, espaces multiples réduits et
+    ponctuation finale retirée : "Combien de  films ?" et "combien de films"
+    donnent la même clé.
+    """
+    text = question or ""
+    if not text.isascii():
+        text = _COMBINING_MARKS_RE.sub("", unicodedata.normalize("NFKD", text))
+    text = _WHITESPACE_RE.sub(" ", text.lower()).strip()
+    return _TRAILING_PUNCTUATION_RE.sub("", text)
+
+
+class QueryCache:
+    """Cache persistant (SQLite) des traductions question → requête MongoDB"""
+
+    def __init__(self, path: str = QUERY_CACHE_PATH, ttl: int = QUERY_CACHE_TTL,
+                 max_entries: int = QUERY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._init_db()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Retourne une connexion SQLite propre au thread courant"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        """Crée la table du cache si nécessaire"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    key TEXT PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_query_cache_last_access "
+                "ON query_cache (last_access)"
+            )
+
+    @staticmethod
+    def make_key(question: str, namespace: str = "") -> str:
+        """Calcule la clé de cache d'une question normalisée"""
+        raw = f"{namespace}\x00{normalize_question(question)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, question: str, namespace: str = "") -> Optional[Dict]:
+        """
+        Retourne la requête mise en cache pour une question
+
+        Args:
+            question: Question de l'utilisateur
+            namespace: Contexte de la traduction (modèle, schéma...)
+
+        Returns:
+            Dict de la requête, ou None si absente ou expirée
+        """
+        key = self.make_key(question, namespace)
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, created_at FROM query_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            with conn:
+                if self.ttl and now - created_at > self.ttl:
+                    conn.execute("DELETE FROM query_cache WHERE key = ?", (key,))
+                    return None
+                conn.execute(
+                    "UPDATE query_cache SET last_access = ? WHERE key = ?", (now, key)
+                )
+            return json.loads(value)
+        except (sqlite3.Error, json.JSONDecodeError) as e:
+            print(f"Erreur de lecture du cache de requêtes: {e}")
+            return None
+
+    def set(self, question: str, query_info: Dict, namespace: str = ""):
+        """Enregistre la requête générée pour une question"""
+        key = self.make_key(question, namespace)
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO query_cache "
+                    "(key, question, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, normalize_question(question),
+                     json.dumps(query_info, ensure_ascii=False), now, now)
+                )
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"Erreur d'écriture du cache de requêtes: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Supprime les entrées expirées puis les moins récemment utilisées"""
+        if self.ttl:
+            conn.execute("DELETE FROM query_cache WHERE created_at < ?", (now - self.ttl,))
+        if self.max_entries:
+            conn.execute("""
+                DELETE FROM query_cache WHERE key IN (
+                    SELECT key FROM query_cache
+                    ORDER BY last_access DESC
+                    LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def clear(self):
+        """Vide entièrement le cache"""
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM query_cache")
+        except sqlite3.Error as e:
+            print(f"Erreur lors du vidage du cache de requêtes: {e}")
+
+    def count(self) -> int:
+        """Retourne le nombre d'entrées en cache"""
+        row = self._connection().execute("SELECT COUNT(*) FROM query_cache").fetchone()
+        return row[0] if row else 0
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> Optional[QueryCache]:
+    """Retourne le cache partagé du processus (None si désactivé)"""
+    global _shared_cache
+    if not QUERY_CACHE_PATH:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            try:
+                _shared_cache = QueryCache()
+            except (sqlite3.Error, OSError) as e:
+                print(f"Cache de requêtes indisponible: {e}")
+                return None
+        return _shared_cache
@@ -0,0 +1,273 @@
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from config import (
+    RATE_LIMIT_ENABLED, PERPLEXITY_RATE_LIMIT_RPM, PERPLEXITY_RATE_LIMIT_TPM, PERPLEXITY_CONCURRENCY_INITIAL,
+    PERPLEXITY_CONCURRENCY_MAX, PERPLEXITY_LATENCY_TARGET, PERPLEXITY_QUEUE_TIMEOUT
+)
+import telemetry
+
+
+# Priorités des appels LLM (la plus petite passe en premier)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch", PRIORITY_BACKGROUND: "background"}
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("mbot_llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def request_priority(priority: int) -> Iterator[None]:
+    """Priorité des appels LLM effectués dans ce bloc (questions de l'interface par défaut)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class RateLimitTimeout(TimeoutError):
+    """Appel LLM resté trop longtemps dans la file du limiteur"""
+
+
+class TokenBucket:
+    """
+    Seau à jetons rechargé de per_minute jetons par minute
+
+    La rafale est limitée à burst_seconds de recharge : un quota par minute
+    n'est pas consommé d'un coup au démarrage. Le débit peut être réduit
+    après un 429 (slow_down) puis remonte progressivement (speed_up).
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.max_rate = float(per_minute) / 60.0
+        self.rate = self.max_rate
+        self.capacity = max(1.0, self.max_rate * burst_seconds)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def slow_down(self):
+        self.rate = max(self.max_rate / 10, self.rate / 2)
+
+    def speed_up(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Secondes avant que amount jetons soient disponibles (0 si c'est déjà le cas)"""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate) if self.rate else 0.0
+
+
+class Permit:
+    """Autorisation d'un appel LLM, rendue au limiteur à la réception de la réponse"""
+
+    def __init__(self, limiter: "RateLimiter", estimated_tokens: int, waited_ms: float):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.waited_ms = waited_ms
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        """Libère la place d'appel simultané et ajuste la concurrence selon la réponse"""
+        if self._released:
+            return
+        self._released = True
+        self.limiter._release(self, status_code, time.monotonic() - self.started, retry_after)
+
+
+class RateLimiter:
+    """
+    Limiteur de débit côté client des appels à l'API Perplexity
+
+    Deux seaux à jetons bornent les requêtes et les tokens par minute ; le
+    nombre d'appels simultanés et le débit de requêtes s'adaptent (AIMD) :
+    hausse progressive tant que les appels réussissent, division par deux
+    sur un 429 ou une latence au-delà de latency_target. Les appels en attente forment une file de priorité :
+    les questions de l'interface passent avant le traitement par lots et
+    le préchargement. Un 429 suspend les admissions pendant Retry-After.
+    """
+
+    def __init__(self, requests_per_minute: float = PERPLEXITY_RATE_LIMIT_RPM,
+                 tokens_per_minute: float = PERPLEXITY_RATE_LIMIT_TPM,
+                 initial_concurrency: float = PERPLEXITY_CONCURRENCY_INITIAL,
+                 max_concurrency: float = PERPLEXITY_CONCURRENCY_MAX,
+                 latency_target: float = PERPLEXITY_LATENCY_TARGET,
+                 queue_timeout: float = PERPLEXITY_QUEUE_TIMEOUT):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_concurrency = max(1.0, float(max_concurrency))
+        self.concurrency_limit = min(self.max_concurrency, max(1.0, float(initial_concurrency)))
+        self.latency_target = latency_target
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.throttled = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._waits = {name: [0, 0.0, 0.0] for name in PRIORITY_NAMES.values()}  # nombre, total, max (ms)
+
+    def acquire(self, estimated_tokens: int = 0, priority: Optional[int] = None,
+                timeout: Optional[float] = None) -> Permit:
+        """
+        Attend son tour dans la file puis réserve une requête et estimated_tokens
+
+        Raises:
+            RateLimitTimeout: pas d'admission dans le délai (queue_timeout par défaut)
+        """
+        priority = current_priority() if priority is None else priority
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        started = time.monotonic()
+        deadline = started + (self.queue_timeout if timeout is None else timeout)
+        entry = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            self._publish_depth()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._admission_delay(entry, estimated_tokens, now)
+                    if wait == 0.0:
+                        heapq.heappop(self._queue)
+                        self._consume(estimated_tokens)
+                        self.in_flight += 1
+                        break
+                    if now >= deadline:
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                        raise RateLimitTimeout(f"Appel LLM ({name}) non admis après {now - started:.1f} s")
+                    # wait None : attente d'une libération (notify), sinon d'une recharge des seaux
+                    self._condition.wait(min(deadline - now, wait) if wait else deadline - now)
+            finally:
+                self._publish_depth()
+                self._condition.notify_all()
+
+            waited_ms = (time.monotonic() - started) * 1000
+            stats = self._waits.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += waited_ms
+            stats[2] = max(stats[2], waited_ms)
+        telemetry.observe("mbot_llm_queue_wait_seconds", waited_ms / 1000, priority=name)
+        return Permit(self, estimated_tokens, waited_ms)
+
+    def _admission_delay(self, entry, estimated_tokens: int, now: float) -> Optional[float]:
+        """0 si l'appel peut partir, None s'il attend une libération, sinon secondes avant recharge"""
+        if self._queue[0] != entry or self.in_flight >= int(self.concurrency_limit):
+            return None
+        if now < self.paused_until:
+            return self.paused_until - now
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, estimated_tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(amount))
+        return wait
+
+    def _consume(self, estimated_tokens: int):
+        if self.requests is not None:
+            self.requests.level -= 1
+        if self.tokens is not None:
+            self.tokens.level -= min(estimated_tokens, self.tokens.capacity)
+
+    def _release(self, permit: Permit, status_code: Optional[int], latency: float, retry_after: Optional[float]):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status_code == 429:
+                self.throttled += 1
+                telemetry.increment("mbot_llm_throttled_total")
+                # Le quota réel est plus bas que prévu : débit réduit, admissions suspendues
+                if self.requests is not None:
+                    self.requests.level = min(self.requests.level, 0.0)
+                self.paused_until = max(self.paused_until, now + (retry_after or 1.0))
+                self._decrease(now, latency)
+            elif status_code is not None and status_code < 500:
+                if latency > self.latency_target:
+                    self._decrease(now, latency)
+                else:
+                    # Augmentation additive : +1 après concurrency_limit appels réussis
+                    self.concurrency_limit = min(self.max_concurrency,
+                                                 self.concurrency_limit + 1 / self.concurrency_limit)
+                    if self.requests is not None:
+                        self.requests.speed_up()
+            telemetry.set_gauge("mbot_llm_concurrency_limit", int(self.concurrency_limit))
+            self._condition.notify_all()
+
+    def _decrease(self, now: float, latency: float):
+        # Une seule division par deux par latence observée : les réponses d'une même rafale comptent une fois
+        if now - self._last_decrease < max(1.0, latency):
+            return
+        self._last_decrease = now
+        self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+        if self.requests is not None:
+            self.requests.slow_down()
+
+    def record_usage(self, estimated_tokens: int, used_tokens: Optional[int]):
+        """Corrige le seau de tokens avec la consommation réelle (champ usage de la réponse)"""
+        if self.tokens is None or used_tokens is None:
+            return
+        with self._condition:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated_tokens - used_tokens)
+            self._condition.notify_all()
+
+    def _queue_depth(self) -> Dict[str, int]:
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _ in self._queue:
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            depth[name] = depth.get(name, 0) + 1
+        return depth
+
+    def _publish_depth(self):
+        for name, count in self._queue_depth().items():
+            telemetry.set_gauge("mbot_llm_queue_depth", count, priority=name)
+
+    def stats(self) -> Dict:
+        """État de la file et des seaux, pour l'interface et les diagnostics"""
+        with self._condition:
+            now = time.monotonic()
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.refill(now)
+            return {
+                "queue_depth": self._queue_depth(),
+                "in_flight": self.in_flight,
+                "concurrency_limit": int(self.concurrency_limit),
+                "requests_available": round(self.requests.level, 1) if self.requests else None,
+                "requests_per_minute": round(self.requests.rate * 60, 1) if self.requests else None,
+                "tokens_available": round(self.tokens.level) if self.tokens else None,
+                "throttled": self.throttled,
+                "paused_for_s": round(max(0.0, self.paused_until - now), 1),
+                "wait_ms": {name: {"count": count, "avg": round(total / count, 1) if count else 0.0,
+                                   "max": round(longest, 1)}
+                            for name, (count, total, longest) in self._waits.items()},
+            }
+
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """Retourne le limiteur partagé par toutes les sessions du processus (None si désactivé)"""
+    global _shared_limiter
+    if not RATE_LIMIT_ENABLED:
+        return None
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from config import RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL, RESULT_CACHE_WATCH_CHANGES
+from serialization import dumps_compact
+
+
+def _canonicalize(value: Any) -> Any:
+    """Normalise une requête : clés triées et nombres entiers uniformisés"""
+    if isinstance(value, dict):
+        # L'ordre des clés d'un $sort est significatif : on le conserve
+        return {
+            str(k): ([[str(sk), _canonicalize(sv)] for sk, sv in v.items()]
+                     if k == "$sort" and isinstance(v, dict) else _canonicalize(v))
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(item) for item in value]
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, int):
+        return int(value)
+    return value
+
+
+def canonical_query_key(query_type: str, query: Any) -> str:
+    """
+    Calcule une empreinte canonique de (query_type, query)
+
+    Deux pipelines qui ne diffèrent que par l'ordre des clés d'un même
+    document ou par 2015 / 2015.0 partagent la même clé. L'ordre des étapes
+    d'un pipeline est conservé car il change le résultat.
+    """
+    canonical = json.dumps(
+        [query_type, _canonicalize(query)],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Cache mémoire des résultats MongoDB, partagé par toutes les sessions du processus"""
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: int = RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, int, List[Dict]]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._watcher = None
+        self.watch_backoff_base = 1.0
+        self.watch_backoff_max = 300.0
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        """Retourne les résultats en cache pour une clé, ou None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, size, results = entry
+            if self.ttl and time.time() - stored_at > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return results
+
+    def set(self, key: str, results: List[Dict]):
+        """Enregistre des résultats sérialisés en respectant le budget mémoire"""
+        size = len(dumps_compact(results))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time(), size, results)
+            self._size += size
+            while self._size > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def invalidate(self):
+        """Vide le cache (appelé lors d'écritures sur la collection)"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict:
+        """Retourne les statistiques d'utilisation du cache"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def watch_collection(self, collection):
+        """
+        Invalide le cache dès qu'un change stream signale une écriture
+
+        Nécessite un replica set (cas de MongoDB Atlas). Le thread de
+        surveillance n'est démarré qu'une fois par processus ; il rouvre le
+        flux après une erreur, avec une attente croissante.
+        """
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(
+                target=self._watch_loop, args=(collection,),
+                name="result-cache-watcher", daemon=True
+            )
+            self._watcher.start()
+
+    def _watch_loop(self, collection):
+        # Flux interrompu (élection, réseau) : reprise après une attente croissante
+        failures = 0
+        while True:
+            try:
+                with collection.watch(
+                    [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete", "drop", "rename"]}}}]
+                ) as stream:
+                    if failures:
+                        # Des écritures ont pu être manquées pendant l'interruption
+                        self.invalidate()
+                        failures = 0
+                    for _ in stream:
+                        self.invalidate()
+            except Exception as e:
+                if not failures:
+                    print(f"Surveillance des modifications interrompue, cache basé sur le TTL en attendant la reprise: {e}")
+                failures += 1
+            time.sleep(min(self.watch_backoff_max, self.watch_backoff_base * 2 ** min(failures, 16)))
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_result_cache(collection=None) -> Optional[ResultCache]:
+    """
+    Retourne le cache de résultats partagé du processus
+
+    Args:
+        collection: Collection à surveiller si RESULT_CACHE_WATCH_CHANGES est actif
+
+    Returns:
+        Le cache partagé, ou None si désactivé
+    """
+    global _shared_cache
+    if RESULT_CACHE_MAX_BYTES <= 0:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResultCache()
+    if RESULT_CACHE_WATCH_CHANGES and collection is not None:
+        _shared_cache.watch_collection(collection)
+    return _shared_cache
@@ -0,0 +1,221 @@
+import json
+import statistics
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from config import FORMAT_RESULTS_TOKEN_BUDGET
+from serialization import dumps_compact
+
+
+# Demandes explicites de l'ensemble des données : résultats transmis sans résumé
+COMPLETE_KEYWORDS = [
+    "pour toutes les années", "toutes les", "chaque année", "par année",
+    "pour chaque", "détaillé", "complet", "tous les résultats",
+]
+
+# Approximation du découpage en tokens pour du JSON/français (~4 caractères par token)
+CHARS_PER_TOKEN = 4
+
+SAMPLE_ROWS = 5
+SAMPLE_TEXT_LENGTH = 200
+TOP_VALUES = 5
+TOP_VALUE_LENGTH = 60
+
+
+def needs_complete_results(user_question: str) -> bool:
+    """Indique si l'utilisateur demande explicitement toutes les données"""
+    question_lower = user_question.lower()
+    return any(keyword in question_lower for keyword in COMPLETE_KEYWORDS)
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class CompactionReport:
+    """Texte des résultats transmis au LLM et économie de tokens réalisée"""
+
+    def __init__(self, text: str, mode: str, rows: int, baseline_tokens: int):
+        self.text = text
+        self.mode = mode
+        self.rows = rows
+        self.baseline_tokens = baseline_tokens
+        self.tokens = estimate_tokens(text)
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.baseline_tokens - self.tokens
+
+    @property
+    def savings_percent(self) -> float:
+        if not self.baseline_tokens:
+            return 0.0
+        return round(100 * self.saved_tokens / self.baseline_tokens, 1)
+
+    def to_dict(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "rows": self.rows,
+            "tokens": self.tokens,
+            "baseline_tokens": self.baseline_tokens,
+            "saved_tokens": self.saved_tokens,
+            "savings_percent": self.savings_percent,
+        }
+
+
+def _flatten(document: Dict, prefix: str = "") -> Dict:
+    """Sous-documents aplatis en colonnes pointées : {"imdb": {"rating": 7}} → {"imdb.rating": 7}"""
+    flat = {}
+    for key, value in document.items():
+        column = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flat.update(_flatten(value, column + "."))
+        else:
+            flat[column] = value
+    return flat
+
+
+def _table(results: List[Dict]) -> Tuple[List[str], List[List[Any]]]:
+    flat_results = [_flatten(result) if isinstance(result, dict) else {"valeur": result} for result in results]
+    columns: List[str] = []
+    seen = set()
+    for flat in flat_results:
+        for column in flat:
+            if column not in seen:
+                seen.add(column)
+                columns.append(column)
+    return columns, [[flat.get(column) for column in columns] for flat in flat_results]
+
+
+def _shorten(value: Any, max_length: int) -> Any:
+    if isinstance(value, str) and len(value) > max_length:
+        return value[:max_length] + "…"
+    return value
+
+
+def encode_rows(results: List[Dict], max_text_length: Optional[int] = None) -> str:
+    """
+    Encodage tabulaire compact : une ligne d'en-tête puis une ligne JSON par résultat
+
+    Les noms de champs ne sont écrits qu'une fois, sans indentation. Les
+    textes longs sont tronqués si max_text_length est fourni.
+    """
+    columns, rows = _table(results)
+    if max_text_length:
+        rows = [[_shorten(value, max_text_length) for value in row] for row in rows]
+    lines = ["Colonnes: " + dumps_compact(columns)]
+    lines.extend(dumps_compact(row) for row in rows)
+    return "\n".join(lines)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.3g}" if abs(value) < 1 else f"{value:.2f}"
+
+
+def _trend(xs: List[float], ys: List[float]) -> Optional[float]:
+    """Pente de la droite des moindres carrés"""
+    if len(xs) < 3:
+        return None
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if not variance:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+
+def summarize(results: List[Dict]) -> str:
+    """
+    Résumé statistique des colonnes d'un tableau de résultats
+
+    Colonnes numériques : min/max/moyenne/quartiles ; colonnes texte ou
+    listes : valeurs les plus fréquentes ; tendance des métriques quand une
+    colonne d'années est présente.
+    """
+    columns, rows = _table(results)
+    lines = [f"Résumé de {len(rows)} résultats:"]
+    year_column = None
+    numeric_columns = []
+    for index, column in enumerate(columns):
+        values = [row[index] for row in rows if row[index] is not None]
+        if not values:
+            continue
+        numbers = [value for value in values if _is_number(value)]
+        if len(numbers) == len(values):
+            if all(isinstance(value, int) and 1870 <= value <= 2100 for value in numbers) and \
+                    column in ("_id", "year", "annee", "_id.year") and year_column is None:
+                year_column = index
+                lines.append(f"- {column}: de {min(numbers)} à {max(numbers)} ({len(set(numbers))} valeurs)")
+                continue
+            numeric_columns.append(index)
+            quartiles = statistics.quantiles(numbers, n=4) if len(numbers) > 1 else [numbers[0]] * 3
+            lines.append(
+                f"- {column}: min {_format_number(min(numbers))}, max {_format_number(max(numbers))}, "
+                f"moyenne {_format_number(statistics.fmean(numbers))}, "
+                f"quartiles {' / '.join(_format_number(q) for q in quartiles)}"
+            )
+        else:
+            counter = Counter()
+            for value in values:
+                for item in (value if isinstance(value, list) else [value]):
+                    counter[item if isinstance(item, (str, int, float, bool)) else dumps_compact(item)] += 1
+            top = ", ".join(f"{_shorten(str(value), TOP_VALUE_LENGTH)} ({count})" for value, count in counter.most_common(TOP_VALUES))
+            lines.append(f"- {column}: {len(counter)} valeurs distinctes, les plus fréquentes: {top}")
+
+    if year_column is not None:
+        for index in numeric_columns:
+            points = [(row[year_column], row[index]) for row in rows
+                      if _is_number(row[year_column]) and _is_number(row[index])]
+            slope = _trend([x for x, _ in points], [y for _, y in points])
+            if slope is not None:
+                lines.append(f"- Tendance de {columns[index]}: {'+' if slope >= 0 else ''}{_format_number(slope)} par an")
+    return "\n".join(lines)
+
+
+def _baseline_text(results: List[Dict], complete: bool) -> str:
+    """Données transmises avant compaction (JSON indenté, aperçu de 5 lignes au-delà de 10), référence des économies"""
+    if len(results) <= 10 or complete:
+        return "Résultats complets:\n" + json.dumps(results, indent=2, ensure_ascii=False)
+    return ("Aperçu des premiers résultats:\n" + json.dumps(results[:5], indent=2, ensure_ascii=False)
+            + f"\n\n... et {len(results) - 5} autres résultats.")
+
+
+def compact_results(results: List[Dict], user_question: str,
+                    budget: int = FORMAT_RESULTS_TOKEN_BUDGET) -> CompactionReport:
+    """
+    Prépare les résultats à insérer dans le prompt de formatage
+
+    Les lignes sont encodées en tableau compact. Au-delà de 10 résultats
+    sans demande de l'ensemble des données, elles ne sont transmises en
+    entier que si le tableau reste sous le budget et pas plus long que
+    l'aperçu historique ; sinon un résumé statistique avec quelques lignes
+    d'exemple, ou à défaut un aperçu compact des premières lignes, les
+    remplace. Les demandes complètes restent exactes et complètes.
+
+    Args:
+        results: Résultats sérialisés de la requête
+        user_question: Question de l'utilisateur
+        budget: Nombre de tokens estimé au-delà duquel les lignes sont résumées
+
+    Returns:
+        CompactionReport (texte, mode "complet", "résumé" ou "aperçu", tokens économisés)
+    """
+    complete = needs_complete_results(user_question)
+    baseline_tokens = estimate_tokens(_baseline_text(results, complete))
+    previewed = len(results) > 10 and not complete
+
+    rows_text = "Résultats complets:\n" + encode_rows(results)
+    rows_tokens = estimate_tokens(rows_text)
+    if complete or (rows_tokens <= budget and (not previewed or rows_tokens <= baseline_tokens)):
+        return CompactionReport(rows_text, "complet", len(results), baseline_tokens)
+
+    text = (summarize(results) + f"\n\nExemples ({SAMPLE_ROWS} premiers résultats):\n"
+            + encode_rows(results[:SAMPLE_ROWS], SAMPLE_TEXT_LENGTH))
+    if not previewed or estimate_tokens(text) <= baseline_tokens:
+        return CompactionReport(text, "résumé", len(results), baseline_tokens)
+
+    text = (f"Aperçu des {SAMPLE_ROWS} premiers résultats:\n" + encode_rows(results[:SAMPLE_ROWS], SAMPLE_TEXT_LENGTH)
+            + f"\n\n... et {len(results) - SAMPLE_ROWS} autres résultats.")
+    return CompactionReport(text, "aperçu", len(results), baseline_tokens)
@@ -0,0 +1,224 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+
+# Demandes d'analyse qui justifient un passage par le LLM
+COMMENTARY_KEYWORDS = [
+    "analyse", "analyser", "commente", "commentaire", "explique", "explication",
+    "pourquoi", "interprete", "interprète", "interprétation", "tendance",
+    "contexte", "insight", "conclusion", "que peut-on dire", "résume", "résumé",
+]
+
+# Libellés des champs fréquents dans les résultats
+FIELD_LABELS = {
+    "_id": "Valeur",
+    "total": "Nombre total",
+    "count": "Nombre",
+    "nombre": "Nombre",
+    "nb_films": "Nombre de films",
+    "avgRating": "Note moyenne",
+    "avg_rating": "Note moyenne",
+    "averageRating": "Note moyenne",
+    "moyenne": "Moyenne",
+    "maxRating": "Note maximale",
+    "minRating": "Note minimale",
+    "totalVotes": "Total des votes",
+    "title": "Titre",
+    "year": "Année",
+    "directors": "Réalisateurs",
+    "genres": "Genres",
+    "cast": "Acteurs",
+    "countries": "Pays",
+    "runtime": "Durée (min)",
+    "imdb.rating": "Note IMDb",
+    "imdb.votes": "Votes IMDb",
+    "released": "Sortie",
+    "imdb": "IMDb",
+    "tomatoes": "Rotten Tomatoes",
+    "awards": "Récompenses",
+    "plot": "Résumé",
+    "fullplot": "Résumé complet",
+    "languages": "Langues",
+    "rated": "Classification",
+    "writers": "Scénaristes",
+}
+
+# Colonnes affichées pour une liste de films, dans cet ordre
+DOCUMENT_COLUMNS = ["title", "year", "directors", "genres", "imdb.rating", "runtime", "released"]
+
+MAX_TABLE_ROWS = 200
+MAX_DOCUMENT_ROWS = 20
+
+_CAMEL_CASE_RE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+
+def _is_scalar(value: Any) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _label(field: str) -> str:
+    """Libellé lisible d'un nom de champ"""
+    if field in FIELD_LABELS:
+        return FIELD_LABELS[field]
+    words = _CAMEL_CASE_RE.sub(" ", field.replace("_", " ").replace(".", " ")).strip()
+    return words[:1].upper() + words[1:]
+
+
+def _format_value(value: Any) -> str:
+    """Formate une valeur à la française (espaces de milliers, virgule décimale)"""
+    if value is None:
+        return "—"
+    if isinstance(value, bool):
+        return "oui" if value else "non"
+    if isinstance(value, int):
+        return f"{value:,}".replace(",", "\u202f") if abs(value) >= 10000 else str(value)
+    if isinstance(value, float):
+        text = f"{value:,.2f}".replace(",", "\u202f").replace(".", ",")
+        return text.rstrip("0").rstrip(",") if "," in text else text
+    if isinstance(value, list):
+        return ", ".join(_format_value(item) for item in value[:5]) + (" …" if len(value) > 5 else "")
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value).replace("|", "\\|").replace("\n", " ")
+
+
+def _get_path(document: Dict, path: str) -> Any:
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _markdown_table(headers: List[str], rows: List[List[Any]]) -> str:
+    lines = [
+        "| " + " | ".join(headers) + " |",
+        "| " + " | ".join("---" for _ in headers) + " |",
+    ]
+    for row in rows:
+        lines.append("| " + " | ".join(_format_value(value) for value in row) + " |")
+    return "\n".join(lines)
+
+
+def wants_commentary(user_question: str) -> bool:
+    """Indique si l'utilisateur attend une analyse rédigée plutôt qu'un simple résultat"""
+    question_lower = user_question.lower()
+    return any(keyword in question_lower for keyword in COMMENTARY_KEYWORDS)
+
+
+def _format_scalar(result: Dict) -> Optional[str]:
+    """Un seul document portant une seule valeur numérique : {"total": 1234}"""
+    fields = {key: value for key, value in result.items() if not (key == "_id" and value is None)}
+    if len(fields) != 1:
+        return None
+    field, value = next(iter(fields.items()))
+    if not _is_number(value):
+        return None
+    return f"**{_label(field)} : {_format_value(value)}**"
+
+
+def _format_grouped(results: List[Dict]) -> Optional[str]:
+    """Paires _id / métriques issues d'un $group : [{"_id": 2015, "avgRating": 6.8}]"""
+    if len(results) > MAX_TABLE_ROWS:
+        return None
+    metric_fields = []
+    for result in results:
+        if "_id" not in result:
+            return None
+        for key, value in result.items():
+            if key == "_id":
+                continue
+            if not _is_scalar(value):
+                return None
+            if key not in metric_fields:
+                metric_fields.append(key)
+    # Des documents de films projetés relèvent de _format_documents
+    if not metric_fields or "title" in metric_fields:
+        return None
+
+    # _id composé ({"decade": 1990, "genre": "Drama"}) : une colonne par clé
+    id_values = [result["_id"] for result in results]
+    if all(isinstance(value, dict) and all(_is_scalar(v) for v in value.values()) for value in id_values):
+        id_fields = []
+        for value in id_values:
+            id_fields.extend(key for key in value if key not in id_fields)
+        headers = [_label(key) for key in id_fields]
+        rows = [[result["_id"].get(key) for key in id_fields] for result in results]
+    elif all(_is_scalar(value) or isinstance(value, list) for value in id_values):
+        is_year = all(isinstance(value, int) and 1870 <= value <= 2100 for value in id_values)
+        headers = ["Année" if is_year else _label("_id")]
+        rows = [[result["_id"]] for result in results]
+    else:
+        return None
+
+    headers += [_label(field) for field in metric_fields]
+    for row, result in zip(rows, results):
+        row.extend(result.get(field) for field in metric_fields)
+
+    count_label = "résultat" if len(results) == 1 else "résultats"
+    return f"**{len(results)} {count_label}**\n\n" + _markdown_table(headers, rows)
+
+
+def _format_single_document(document: Dict) -> Optional[str]:
+    """Un film complet : liste de tous ses champs"""
+    if "title" not in document:
+        return None
+    lines = [f"**{_format_value(document['title'])}**", ""]
+    for field, value in document.items():
+        if field in ("_id", "title"):
+            continue
+        if isinstance(value, dict):
+            lines.append(f"- **{_label(field)}** :")
+            lines.extend(f"  - {_label(key)} : {_format_value(sub_value)}" for key, sub_value in value.items())
+        else:
+            lines.append(f"- **{_label(field)}** : {_format_value(value)}")
+    return "\n".join(lines)
+
+
+def _format_documents(results: List[Dict]) -> Optional[str]:
+    """Liste de films : tableau des champs principaux"""
+    if len(results) == 1:
+        return _format_single_document(results[0])
+    if len(results) > MAX_DOCUMENT_ROWS:
+        return None
+    columns = [column for column in DOCUMENT_COLUMNS
+               if any(_get_path(result, column) is not None for result in results)]
+    if "title" not in columns:
+        return None
+    rows = [[_get_path(result, column) for column in columns] for result in results]
+    count_label = "film" if len(results) == 1 else "films"
+    return f"**{len(results)} {count_label}**\n\n" + _markdown_table([_label(c) for c in columns], rows)
+
+
+def format_locally(query_results: List[Dict], user_question: str) -> Optional[str]:
+    """
+    Met en forme les résultats sans appel au LLM quand leur forme le permet
+
+    Formes reconnues : valeur unique ($count, moyenne globale), paires
+    _id / métriques ($group), liste de films. Retourne None pour les autres
+    formes ou si l'utilisateur demande une analyse, afin de laisser le LLM
+    rédiger la réponse.
+
+    Args:
+        query_results: Résultats sérialisés de la requête MongoDB
+        user_question: Question originale de l'utilisateur
+
+    Returns:
+        Réponse en markdown, ou None
+    """
+    if not query_results or wants_commentary(user_question):
+        return None
+    if not all(isinstance(result, dict) for result in query_results):
+        return None
+
+    if len(query_results) == 1:
+        scalar_answer = _format_scalar(query_results[0])
+        if scalar_answer:
+            return scalar_answer
+    return _format_grouped(query_results) or _format_documents(query_results)
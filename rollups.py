@@ -0,0 +1,487 @@
+import argparse
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from config import (
+    MONGODB_URI, MONGODB_DATABASE, MONGODB_COLLECTION,
+    ROLLUPS_ENABLED, ROLLUPS_WATCH_CHANGES, ROLLUPS_REFRESH_INTERVAL, ROLLUPS_MAX_AGE
+)
+from result_cache import get_result_cache
+
+
+# À incrémenter quand la définition des cumuls change : les anciens sont ignorés
+ROLLUP_VERSION = 1
+
+# Cumuls disponibles : dimensions (champ du cumul → champ source) et tableau déroulé
+ROLLUPS = {
+    "year": {"dimensions": {"year": "year"}, "unwind": None},
+    "genre_year": {"dimensions": {"genre": "genres", "year": "year"}, "unwind": "genres"},
+    "director_year": {"dimensions": {"director": "directors", "year": "year"}, "unwind": "directors"},
+}
+
+# Cumul utilisé quand une question filtre sur une valeur d'un champ tableau sans le dérouler
+ARRAY_ROLLUPS = {"genres": "genre_year", "directors": "director_year"}
+
+# Champ source tableau → dimension du cumul
+ROLLUP_DIMENSION = {"genres": "genre", "directors": "director"}
+
+# Filtres sur la note compatibles avec les cumuls
+NUMERIC_RATING_FILTERS = ({"$type": "number"}, {"$type": "double"})
+EXISTING_RATING_FILTERS = ({"$exists": True},)
+
+AVAILABILITY_CHECK_INTERVAL = 60  # secondes
+
+_NUMERIC_RATING = {"$cond": [{"$isNumber": "$imdb.rating"}, "$imdb.rating", None]}
+
+
+def rollup_collection_name(rollup: str, source: str = MONGODB_COLLECTION) -> str:
+    return f"{source}_rollup_{rollup}"
+
+
+def build_pipeline(rollup: str, target: str, stamp: float, years: Optional[List] = None) -> List[Dict]:
+    """Pipeline de (re)construction d'un cumul, éventuellement limité à certaines années"""
+    definition = ROLLUPS[rollup]
+    pipeline: List[Dict] = []
+    if years is not None:
+        pipeline.append({"$match": {"year": {"$in": years}}})
+    if definition["unwind"]:
+        pipeline.append({"$unwind": "$" + definition["unwind"]})
+    pipeline += [
+        {"$group": {
+            "_id": {dimension: "$" + source for dimension, source in definition["dimensions"].items()},
+            "count": {"$sum": 1},
+            "rating_sum": {"$sum": _NUMERIC_RATING},
+            "rating_count": {"$sum": {"$cond": [{"$isNumber": "$imdb.rating"}, 1, 0]}},
+            "rating_min": {"$min": _NUMERIC_RATING},
+            "rating_max": {"$max": _NUMERIC_RATING},
+        }},
+        {"$addFields": dict(
+            {dimension: "$_id." + dimension for dimension in definition["dimensions"]},
+            refreshed_at=stamp
+        )},
+        {"$merge": {"into": target, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+    return pipeline
+
+
+class RollupRoute:
+    """Pipeline réécrit pour être servi par une collection de cumul"""
+
+    def __init__(self, rollup: str, collection: str, pipeline: List[Dict]):
+        self.rollup = rollup
+        self.collection = collection
+        self.pipeline = pipeline
+
+    def to_dict(self) -> Dict:
+        return {"rollup": self.rollup, "collection": self.collection, "pipeline": self.pipeline}
+
+
+def _stage_name(stage: Any) -> Optional[str]:
+    if isinstance(stage, dict) and len(stage) == 1:
+        return next(iter(stage))
+    return None
+
+
+def _flatten_filter(query: Any) -> Optional[List[Tuple[str, Any]]]:
+    """Liste (champ, condition) d'un $match, None si $or/$expr/$text..."""
+    if not isinstance(query, dict):
+        return None
+    conditions = []
+    for key, value in query.items():
+        if key == "$and" and isinstance(value, list):
+            for clause in value:
+                clause_conditions = _flatten_filter(clause)
+                if clause_conditions is None:
+                    return None
+                conditions += clause_conditions
+        elif key.startswith("$"):
+            return None
+        else:
+            conditions.append((key, value))
+    return conditions
+
+
+def _rename_references(expression: Any, mapping: Dict[str, str]) -> Tuple[Any, bool]:
+    """
+    Remplace les références "$champ" du document source par celles du cumul
+
+    Returns:
+        (expression réécrite, False si un champ absent du cumul est référencé)
+    """
+    if isinstance(expression, str) and expression.startswith("$"):
+        if expression.startswith("$$"):
+            return expression, False
+        field = expression[1:]
+        if field not in mapping:
+            return expression, False
+        return "$" + mapping[field], True
+    if isinstance(expression, dict):
+        renamed = {}
+        for key, value in expression.items():
+            renamed[key], valid = _rename_references(value, mapping)
+            if not valid:
+                return expression, False
+        return renamed, True
+    if isinstance(expression, list):
+        renamed_items = []
+        for item in expression:
+            renamed_item, valid = _rename_references(item, mapping)
+            if not valid:
+                return expression, False
+            renamed_items.append(renamed_item)
+        return renamed_items, True
+    return expression, True
+
+
+def _rewrite_group(group: Dict, mapping: Dict[str, str], rating_filter: Optional[str]) -> Optional[Tuple[Dict, Optional[Dict]]]:
+    """
+    Traduit un $group sur les films en $group sur les lignes du cumul
+
+    Returns:
+        ($group réécrit, $project final pour les moyennes ou None), ou None
+        si un accumulateur n'a pas d'équivalent dans le cumul
+    """
+    group_id, valid = _rename_references(group.get("_id"), mapping)
+    if not valid:
+        return None
+
+    rewritten: Dict[str, Any] = {"_id": group_id}
+    final_fields: Dict[str, Any] = {}
+    has_average = False
+    for field, accumulator in group.items():
+        if field == "_id":
+            continue
+        if not isinstance(accumulator, dict) or len(accumulator) != 1:
+            return None
+        operator, argument = next(iter(accumulator.items()))
+        if operator == "$sum" and argument == 1 and not isinstance(argument, bool):
+            # Le filtre $exists compte aussi les notes non numériques ("") : pas d'équivalent
+            if rating_filter == "exists":
+                return None
+            rewritten[field] = {"$sum": "$rating_count" if rating_filter == "numeric" else "$count"}
+        elif argument != "$imdb.rating":
+            return None
+        elif operator == "$sum":
+            rewritten[field] = {"$sum": "$rating_sum"}
+        elif operator in ("$min", "$max"):
+            rewritten[field] = {operator: "$rating_" + operator[1:]}
+        elif operator == "$avg":
+            # $avg ignore les valeurs non numériques : somme et nombre des notes numériques
+            rewritten[f"__{field}_sum"] = {"$sum": "$rating_sum"}
+            rewritten[f"__{field}_count"] = {"$sum": "$rating_count"}
+            final_fields[field] = {"$cond": [
+                {"$gt": [f"$__{field}_count", 0]},
+                {"$divide": [f"$__{field}_sum", f"$__{field}_count"]},
+                None,
+            ]}
+            has_average = True
+            continue
+        else:
+            return None
+        final_fields[field] = "$" + field
+
+    # Ordre des champs de sortie identique au $group d'origine
+    return rewritten, ({"$project": final_fields} if has_average else None)
+
+
+def rewrite_for_rollup(query_type: str, query: Any, source: str = MONGODB_COLLECTION) -> Optional[RollupRoute]:
+    """
+    Réécrit un pipeline pour qu'il lise une collection de cumul
+
+    Formes reconnues : $match sur l'année (et la note), $unwind éventuel de
+    genres ou directors, puis $group ou $count ; les étapes suivantes sont
+    conservées telles quelles. Les filtres sur un genre ou un réalisateur
+    précis sans $unwind sont servis par le cumul genre/réalisateur.
+
+    Returns:
+        RollupRoute, ou None si le pipeline ne peut pas être servi par un cumul
+    """
+    if query_type != "aggregate" or not isinstance(query, list):
+        return None
+
+    filters_before: List[Tuple[str, Any]] = []
+    filters_after: List[Tuple[str, Any]] = []
+    unwind: Optional[str] = None
+    index = 0
+    while index < len(query):
+        stage = query[index]
+        name = _stage_name(stage)
+        if name == "$match":
+            conditions = _flatten_filter(stage["$match"])
+            if conditions is None:
+                return None
+            (filters_after if unwind else filters_before).extend(conditions)
+        elif name == "$unwind" and unwind is None:
+            spec = stage["$unwind"]
+            path = spec.get("path") if isinstance(spec, dict) and len(spec) == 1 else spec
+            if not isinstance(path, str) or path[1:] not in ARRAY_ROLLUPS:
+                return None
+            unwind = path[1:]
+        else:
+            break
+        index += 1
+    if index >= len(query):
+        return None
+
+    head = query[index]
+    rest = list(query[index + 1:])
+    if _stage_name(head) == "$count":
+        group = {"_id": None, head["$count"]: {"$sum": 1}}
+        rest = [{"$project": {"_id": 0}}] + rest
+    elif _stage_name(head) == "$group":
+        group = head["$group"]
+    else:
+        return None
+
+    rollup = ARRAY_ROLLUPS[unwind] if unwind else "year"
+    rollup_match: List[Dict] = []
+    rating_filter = None
+    for field, condition in filters_before:
+        if field == "year":
+            rollup_match.append({"year": condition})
+        elif field == "imdb.rating" and condition in NUMERIC_RATING_FILTERS + EXISTING_RATING_FILTERS:
+            if rating_filter != "exists":
+                rating_filter = "numeric" if condition in NUMERIC_RATING_FILTERS else "exists"
+        elif field in ARRAY_ROLLUPS and unwind is None and rollup == "year" and isinstance(condition, str):
+            # Un film contient une seule fois un genre donné : une ligne (genre, année) par film
+            rollup = ARRAY_ROLLUPS[field]
+            rollup_match.append({ROLLUP_DIMENSION[field]: condition})
+        else:
+            return None
+    for field, condition in filters_after:
+        if field == "year":
+            rollup_match.append({"year": condition})
+        elif field == unwind:
+            rollup_match.append({ROLLUP_DIMENSION[field]: condition})
+        else:
+            return None
+
+    mapping = {"year": "year"}
+    if unwind:
+        mapping[unwind] = ROLLUP_DIMENSION[unwind]
+    rewritten_group = _rewrite_group(group, mapping, rating_filter)
+    if rewritten_group is None:
+        return None
+    new_group, final_project = rewritten_group
+
+    pipeline: List[Dict] = []
+    if rollup_match:
+        pipeline.append({"$match": rollup_match[0] if len(rollup_match) == 1 else {"$and": rollup_match}})
+    pipeline.append({"$group": new_group})
+    if final_project:
+        pipeline.append(final_project)
+    pipeline += rest
+    return RollupRoute(rollup, rollup_collection_name(rollup, source), pipeline)
+
+
+class RollupManager:
+    """
+    Construction, rafraîchissement et routage des collections de cumul
+
+    Les cumuls sont reconstruits par $merge ; un rafraîchissement limité à
+    quelques années remplace leurs lignes puis supprime celles qui n'ont pas
+    été réécrites. Le routage n'est actif qu'une fois les cumuls construits
+    dans la version courante ; sans suivi des modifications de la
+    collection source, il s'arrête quand le dernier rafraîchissement date
+    de plus de max_age secondes.
+    """
+
+    def __init__(self, db, source: str = MONGODB_COLLECTION):
+        self.db = db
+        self.source = source
+        self.meta = db[f"{source}_rollups_meta"]
+        self._lock = threading.Lock()
+        self.max_age = ROLLUPS_MAX_AGE
+        self._available: Optional[bool] = None
+        self._refreshed_at = 0.0
+        self._checked_at = 0.0
+        self._watching = False
+        self._dirty_years: Set[Any] = set()
+        self._full_refresh_needed = False
+        self._threads_started = False
+
+    def build(self, years: Optional[Iterable] = None) -> Dict[str, int]:
+        """
+        Construit tous les cumuls, ou ne rafraîchit que les années indiquées
+
+        Returns:
+            Nombre de lignes de chaque cumul
+        """
+        year_list = sorted(set(years), key=str) if years is not None else None
+        stamp = time.time()
+        source = self.db[self.source]
+        rows = {}
+        for rollup in ROLLUPS:
+            target = rollup_collection_name(rollup, self.source)
+            list(source.aggregate(build_pipeline(rollup, target, stamp, year_list), allowDiskUse=True))
+            stale = {"refreshed_at": {"$lt": stamp}}
+            if year_list is not None:
+                stale["year"] = {"$in": year_list}
+            self.db[target].delete_many(stale)
+            self.db[target].create_index("year")
+            rows[rollup] = self.db[target].estimated_document_count()
+
+        meta = {"version": ROLLUP_VERSION, "refreshed_at": stamp, "rows": rows}
+        if year_list is None:
+            meta["built_at"] = stamp
+        self.meta.update_one({"_id": self.source}, {"$set": meta}, upsert=True)
+        with self._lock:
+            self._available = True
+            self._refreshed_at = stamp
+            self._checked_at = time.monotonic()
+
+        result_cache = get_result_cache()
+        if result_cache:
+            result_cache.invalidate()
+        return rows
+
+    def status(self) -> Optional[Dict]:
+        """Métadonnées des cumuls (None s'ils n'ont jamais été construits)"""
+        return self.meta.find_one({"_id": self.source})
+
+    def is_available(self) -> bool:
+        """Vrai si les cumuls existent dans la version courante et sont à jour (vérifié au plus toutes les 60 s)"""
+        with self._lock:
+            if self._available is not None and time.monotonic() - self._checked_at < AVAILABILITY_CHECK_INTERVAL:
+                return self._available and self._is_fresh(self._refreshed_at)
+        try:
+            status = self.status()
+            available = bool(status) and status.get("version") == ROLLUP_VERSION
+            refreshed_at = status.get("refreshed_at", 0.0) if status else 0.0
+        except Exception as e:
+            print(f"Erreur lors de la vérification des cumuls: {e}")
+            available, refreshed_at = False, 0.0
+        with self._lock:
+            self._available = available
+            self._refreshed_at = refreshed_at
+            self._checked_at = time.monotonic()
+            return available and self._is_fresh(refreshed_at)
+
+    def _is_fresh(self, refreshed_at: float) -> bool:
+        # Avec le suivi des modifications, les cumuls sont rafraîchis à chaque écriture
+        if self._watching or not self.max_age:
+            return True
+        return time.time() - refreshed_at <= self.max_age
+
+    def mark_unavailable(self):
+        """Désactive le routage jusqu'à la prochaine vérification"""
+        with self._lock:
+            self._available = False
+            self._checked_at = time.monotonic()
+
+    def route(self, query_type: str, query: Any) -> Optional[RollupRoute]:
+        """Réécriture vers un cumul si elle est possible et les cumuls disponibles"""
+        route = rewrite_for_rollup(query_type, query, self.source)
+        if route is None or not self.is_available():
+            return None
+        return route
+
+    def mark_dirty(self, years: Optional[Iterable] = None):
+        """Signale des années modifiées (None : reconstruction complète)"""
+        with self._lock:
+            if years is None:
+                self._full_refresh_needed = True
+            else:
+                self._dirty_years.update(years)
+
+    def refresh_pending(self) -> Optional[Dict[str, int]]:
+        """Applique les rafraîchissements signalés depuis le dernier appel"""
+        with self._lock:
+            full_refresh, years = self._full_refresh_needed, self._dirty_years
+            self._full_refresh_needed, self._dirty_years = False, set()
+        if full_refresh:
+            return self.build()
+        if years:
+            return self.build(years)
+        return None
+
+    def start_background_refresh(self):
+        """
+        Suit les écritures sur la collection source et rafraîchit les années touchées
+
+        Nécessite un replica set (change streams). Les modifications de
+        l'année d'un film et les suppressions entraînent une reconstruction
+        complète, l'ancienne année n'étant pas connue.
+        """
+        with self._lock:
+            if self._threads_started:
+                return
+            self._threads_started = True
+            self._watching = True
+        threading.Thread(target=self._watch_loop, name="rollups-watcher", daemon=True).start()
+        threading.Thread(target=self._refresh_loop, name="rollups-refresh", daemon=True).start()
+
+    def _watch_loop(self):
+        try:
+            with self.db[self.source].watch(full_document="updateLookup") as stream:
+                for change in stream:
+                    operation = change.get("operationType")
+                    updated_fields = change.get("updateDescription", {}).get("updatedFields", {})
+                    document = change.get("fullDocument") or {}
+                    if operation in ("insert", "replace", "update") and "year" not in updated_fields and document:
+                        self.mark_dirty([document.get("year")])
+                    else:
+                        self.mark_dirty()
+        except Exception as e:
+            print(f"Surveillance des modifications indisponible, cumuls rafraîchis manuellement: {e}")
+        finally:
+            # Plus de rafraîchissement automatique : l'âge des cumuls borne à nouveau le routage
+            with self._lock:
+                self._watching = False
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(ROLLUPS_REFRESH_INTERVAL)
+            try:
+                self.refresh_pending()
+            except Exception as e:
+                print(f"Erreur lors du rafraîchissement des cumuls: {e}")
+
+
+_shared_manager = None
+_shared_manager_lock = threading.Lock()
+
+
+def get_rollup_manager(db=None) -> Optional[RollupManager]:
+    """
+    Retourne le gestionnaire de cumuls partagé du processus
+
+    Returns:
+        RollupManager, ou None si les cumuls sont désactivés
+    """
+    global _shared_manager
+    if not ROLLUPS_ENABLED:
+        return None
+    with _shared_manager_lock:
+        if _shared_manager is None and db is not None:
+            _shared_manager = RollupManager(db)
+            if ROLLUPS_WATCH_CHANGES:
+                _shared_manager.start_background_refresh()
+        return _shared_manager
+
+
+def main():
+    """Construction des cumuls (python rollups.py --build)"""
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Collections de cumul de la collection movies")
+    parser.add_argument("--uri", default=MONGODB_URI, help="Chaîne de connexion")
+    parser.add_argument("--build", action="store_true", help="Construire tous les cumuls")
+    parser.add_argument("--refresh", nargs="+", type=int, metavar="ANNÉE", help="Rafraîchir certaines années")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri or "mongodb://localhost:27017")
+    manager = RollupManager(client[MONGODB_DATABASE])
+    if args.build or args.refresh:
+        started = time.perf_counter()
+        rows = manager.build(args.refresh)
+        print(f"✅ Cumuls {'rafraîchis' if args.refresh else 'construits'} en {time.perf_counter() - started:.1f} s")
+        for rollup, count in rows.items():
+            print(f"   {rollup_collection_name(rollup)} : {count} lignes")
+    else:
+        status = manager.status()
+        print(status if status else "Cumuls non construits : python rollups.py --build")
+
+
+if __name__ == "__main__":
+    main()
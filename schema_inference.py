@@ -0,0 +1,336 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from bson import ObjectId, Decimal128, Int64
+from config import (
+    MONGODB_URI, MONGODB_DATABASE, MONGODB_COLLECTION, SCHEMA_SAMPLE_SIZE, SCHEMA_CACHE_PATH, SCHEMA_MAX_AGE
+)
+
+
+# Version du format du résumé : un cache écrit par une autre version est ignoré
+SCHEMA_FORMAT_VERSION = 1
+
+# Distinctes suivies par champ au-delà desquelles la cardinalité est notée "> N"
+CARDINALITY_CAP = 50
+EXAMPLE_VALUES = 3
+EXAMPLE_LENGTH = 40
+# Longueur moyenne au-delà de laquelle un texte est décrit sans exemples
+FREE_TEXT_LENGTH = 60
+# Champs présents dans moins de cette fraction de l'échantillon omis du résumé
+MIN_PRESENCE = 0.01
+# Délai avant une nouvelle tentative d'échantillonnage après un échec (secondes)
+RETRY_DELAY = 60
+
+
+def type_name(value: Any) -> str:
+    """Nom du type BSON d'une valeur"""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, Int64):
+        return "long"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, Decimal128):
+        return "decimal"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime):
+        return "date"
+    if isinstance(value, ObjectId):
+        return "objectId"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    return type(value).__name__
+
+
+class _FieldStats:
+    """Statistiques d'un chemin de champ sur l'échantillon"""
+
+    def __init__(self):
+        self.present = 0
+        self.types: Counter = Counter()
+        self.values: Counter = Counter()
+        self.overflow = False
+        self.minimum = None
+        self.maximum = None
+        self.text_length = 0
+        self.text_count = 0
+
+    def add_value(self, value: Any):
+        value_type = type_name(value)
+        if value_type in ("int", "long", "double", "date"):
+            self.minimum = value if self.minimum is None else min(self.minimum, value)
+            self.maximum = value if self.maximum is None else max(self.maximum, value)
+        if value_type == "string":
+            self.text_length += len(value)
+            self.text_count += 1
+        if value_type in ("string", "int", "long", "bool"):
+            if value in self.values or len(self.values) < CARDINALITY_CAP:
+                self.values[value] += 1
+            else:
+                self.overflow = True
+
+
+def _walk(document: Dict, fields: Dict[str, _FieldStats], prefix: str = ""):
+    for key, value in document.items():
+        path = f"{prefix}{key}"
+        stats = fields.setdefault(path, _FieldStats())
+        stats.present += 1
+        if isinstance(value, list):
+            element_types = sorted({type_name(item) for item in value}) or ["?"]
+            stats.types["array<" + "|".join(element_types) + ">"] += 1
+            for item in value:
+                if isinstance(item, dict):
+                    _walk(item, fields, path + ".")
+                elif not isinstance(item, list):
+                    stats.add_value(item)
+        elif isinstance(value, dict):
+            stats.types["object"] += 1
+            _walk(value, fields, path + ".")
+        else:
+            stats.types[type_name(value)] += 1
+            stats.add_value(value)
+
+
+def infer_schema(documents: List[Dict]) -> Dict[str, Dict]:
+    """
+    Déduit la structure d'un échantillon de documents
+
+    Un chemin pointé par champ (les sous-documents des tableaux suivent la
+    notation pointée de MongoDB), avec ses types, sa fréquence de présence,
+    sa cardinalité, ses bornes et ses valeurs les plus fréquentes.
+    """
+    fields: Dict[str, _FieldStats] = {}
+    for document in documents:
+        _walk(document, fields)
+
+    total = len(documents) or 1
+    schema = {}
+    for path, stats in fields.items():
+        entry = {
+            "types": [value_type for value_type, _ in stats.types.most_common()],
+            "presence": round(stats.present / total, 3),
+        }
+        if stats.values:
+            entry["distinct"] = len(stats.values)
+            entry["distinct_capped"] = stats.overflow
+        if stats.minimum is not None:
+            entry["min"] = stats.minimum.isoformat()[:10] if isinstance(stats.minimum, datetime) else stats.minimum
+            entry["max"] = stats.maximum.isoformat()[:10] if isinstance(stats.maximum, datetime) else stats.maximum
+        if stats.text_count and stats.text_length / stats.text_count > FREE_TEXT_LENGTH:
+            entry["free_text"] = True
+        elif stats.values and not isinstance(next(iter(stats.values)), int):
+            # Ordre déterministe (fréquence puis valeur) : le texte du résumé reste stable d'un échantillon à l'autre
+            ranked = sorted(stats.values.items(), key=lambda item: (-item[1], str(item[0])))
+            entry["examples"] = [value for value, _ in ranked[:EXAMPLE_VALUES]]
+        schema[path] = entry
+    return schema
+
+
+def _example(value: Any) -> str:
+    text = str(value)
+    if len(text) > EXAMPLE_LENGTH:
+        text = text[:EXAMPLE_LENGTH] + "…"
+    return json.dumps(text, ensure_ascii=False)
+
+
+def render_schema(schema: Dict[str, Dict], source: str) -> str:
+    """
+    Résumé textuel compact du schéma, destiné au prompt de génération
+
+    Une ligne par champ : types, présence si partielle, cardinalité ou
+    bornes, quelques exemples de valeurs.
+    """
+    lines = [
+        f"### Schéma de la collection {source} (déduit d'un échantillon)",
+        "Champs (chemin: type, présence, cardinalité/bornes, exemples). "
+        "Les sous-champs s'interrogent en notation pointée, y compris dans les tableaux.",
+    ]
+    for path, entry in schema.items():
+        if entry["presence"] < MIN_PRESENCE:
+            continue
+        parts = ["|".join(entry["types"])]
+        if entry["presence"] < 1:
+            parts.append(f"présent {entry['presence'] * 100:.0f} %")
+        if "min" in entry:
+            parts.append(f"{entry['min']} → {entry['max']}")
+        if entry.get("free_text"):
+            parts.append("texte libre")
+        elif "distinct" in entry and not ("min" in entry and entry["distinct_capped"]):
+            parts.append(f"{'>' if entry['distinct_capped'] else ''}{entry['distinct']} valeurs distinctes")
+        if entry.get("examples"):
+            parts.append("ex: " + ", ".join(_example(value) for value in entry["examples"]))
+        lines.append(f"- {path}: " + ", ".join(parts))
+    return "\n".join(lines)
+
+
+def _structure(schema: Dict[str, Dict]) -> List:
+    """Chemins et types, sans les statistiques qui varient d'un échantillon à l'autre"""
+    return sorted([path, entry["types"]] for path, entry in schema.items() if entry["presence"] >= MIN_PRESENCE)
+
+
+class SchemaInferrer:
+    """
+    Résumé du schéma de la collection, déduit par $sample et mis en cache
+
+    Le résumé est écrit sur disque avec un tampon de version (format,
+    collection, taille d'échantillon) : les sessions suivantes le relisent
+    sans interroger MongoDB. Passé max_age, il est recalculé dans un thread
+    de fond ; si la structure (chemins et types) n'a pas changé, le texte
+    précédent est conservé pour ne pas invalider le cache des traductions,
+    indexé par le contexte de schéma.
+    """
+
+    def __init__(self, collection, cache_path: Optional[str] = SCHEMA_CACHE_PATH,
+                 sample_size: int = SCHEMA_SAMPLE_SIZE, max_age: int = SCHEMA_MAX_AGE):
+        self.collection = collection
+        self.source = collection.full_name
+        self.cache_path = cache_path
+        self.sample_size = sample_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._failed_at = 0.0
+        self.summary: Optional[Dict] = self._load()
+
+    def _stamp(self) -> Dict:
+        return {"version": SCHEMA_FORMAT_VERSION, "source": self.source, "sample_size": self.sample_size}
+
+    def _load(self) -> Optional[Dict]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                summary = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Résumé de schéma illisible ({self.cache_path}): {e}")
+            return None
+        if summary.get("stamp") != self._stamp():
+            return None
+        return summary
+
+    def _save(self, summary: Dict):
+        if not self.cache_path:
+            return
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = self.cache_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(temporary_path, self.cache_path)
+
+    def build(self) -> Dict:
+        """Échantillonne la collection, déduit le schéma et l'enregistre"""
+        documents = list(self.collection.aggregate([{"$sample": {"size": self.sample_size}}]))
+        schema = infer_schema(documents)
+        with self._lock:
+            previous = self.summary
+        if previous and _structure(previous["fields"]) == _structure(schema):
+            text = previous["text"]
+        else:
+            text = render_schema(schema, self.source)
+        summary = {
+            "stamp": self._stamp(),
+            "built_at": time.time(),
+            "sampled": len(documents),
+            "fields": schema,
+            "text": text,
+        }
+        self._save(summary)
+        with self._lock:
+            self.summary = summary
+        return summary
+
+    def is_stale(self) -> bool:
+        with self._lock:
+            summary = self.summary
+        return summary is None or (self.max_age > 0 and time.time() - summary["built_at"] > self.max_age)
+
+    def refresh_in_background(self):
+        """Recalcule le résumé dans un thread de fond (un seul à la fois)"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="schema-refresh", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.build()
+        except Exception as e:
+            print(f"Erreur lors du rafraîchissement du schéma: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get_context(self) -> Optional[str]:
+        """
+        Texte du schéma pour le prompt
+
+        Returns:
+            Le résumé en cache (rafraîchi en arrière-plan s'il est périmé),
+            calculé immédiatement s'il n'existe pas encore, ou None si la
+            collection est inaccessible
+        """
+        with self._lock:
+            summary = self.summary
+        if summary is None:
+            if time.time() - self._failed_at < RETRY_DELAY:
+                return None
+            try:
+                summary = self.build()
+            except Exception as e:
+                self._failed_at = time.time()
+                print(f"Schéma non déduit de la collection: {e}")
+                return None
+        elif self.is_stale():
+            self.refresh_in_background()
+        return summary["text"]
+
+
+_shared_inferrer = None
+_shared_inferrer_lock = threading.Lock()
+
+
+def get_schema_inferrer(collection=None) -> Optional[SchemaInferrer]:
+    """Retourne le résumé de schéma partagé du processus"""
+    global _shared_inferrer
+    with _shared_inferrer_lock:
+        if _shared_inferrer is None and collection is not None:
+            _shared_inferrer = SchemaInferrer(collection)
+        return _shared_inferrer
+
+
+def main():
+    """Affiche le résumé de schéma (python schema_inference.py --refresh pour le recalculer)"""
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Résumé du schéma de la collection movies")
+    parser.add_argument("--refresh", action="store_true", help="Rééchantillonner la collection")
+    parser.add_argument("--uri", default=MONGODB_URI, help="Chaîne de connexion")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri or "mongodb://localhost:27017")
+    collection = client[MONGODB_DATABASE][MONGODB_COLLECTION]
+    inferrer = SchemaInferrer(collection)
+    if args.refresh or inferrer.summary is None:
+        inferrer.build()
+    text = inferrer.get_context()
+    print(text)
+    print(f"\n~{len(text) // 4} tokens, {inferrer.summary['sampled']} documents échantillonnés")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import json
+from datetime import datetime, date
+from decimal import Decimal
+from typing import Any, Callable, Dict
+from uuid import UUID
+from bson import ObjectId, Decimal128, Int64, Timestamp, Regex, Binary
+
+
+# Conversion des types BSON/Python non JSON, indexée par type exact
+TYPE_CONVERTERS: Dict[type, Callable[[Any], Any]] = {
+    ObjectId: str,
+    datetime: datetime.isoformat,
+    date: date.isoformat,
+    Decimal128: lambda value: float(value.to_decimal()),
+    Decimal: float,
+    Int64: int,
+    UUID: str,
+    Timestamp: lambda value: value.as_datetime().isoformat(),
+    Regex: lambda value: value.pattern,
+    Binary: lambda value: value.hex(),
+    bytes: lambda value: value.hex(),
+}
+
+# Types renvoyés tels quels (comparaison de type exacte, plus rapide qu'isinstance)
+_PASSTHROUGH_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+def _convert_other(value: Any) -> Any:
+    """Conversion d'un type absent de TYPE_CONVERTERS (sous-classes comprises)"""
+    for value_type in type(value).__mro__[1:]:
+        converter = TYPE_CONVERTERS.get(value_type)
+        if converter is not None:
+            return converter(value)
+        if value_type in _PASSTHROUGH_TYPES:
+            return value
+    if isinstance(value, tuple):
+        return [to_serializable(item) for item in value]
+    return str(value)
+
+
+def to_serializable(value: Any) -> Any:
+    """
+    Convertit un résultat MongoDB en objets JSON natifs (dict, list, str, nombres)
+
+    Un seul parcours avec répartition par type exact : les valeurs scalaires
+    ne coûtent qu'une recherche dans un frozenset, seuls les dicts et les
+    listes sont recopiés.
+    """
+    value_type = type(value)
+    if value_type in _PASSTHROUGH_TYPES:
+        return value
+    if value_type is dict:
+        result = {}
+        for key, item in value.items():
+            item_type = type(item)
+            if item_type in _PASSTHROUGH_TYPES:
+                result[key] = item
+            elif item_type is dict or item_type is list:
+                result[key] = to_serializable(item)
+            else:
+                converter = TYPE_CONVERTERS.get(item_type)
+                result[key] = converter(item) if converter else to_serializable(item)
+        return result
+    if value_type is list:
+        result_list = []
+        append = result_list.append
+        for item in value:
+            item_type = type(item)
+            if item_type in _PASSTHROUGH_TYPES:
+                append(item)
+            else:
+                converter = TYPE_CONVERTERS.get(item_type)
+                append(converter(item) if converter else to_serializable(item))
+        return result_list
+    converter = TYPE_CONVERTERS.get(value_type)
+    if converter is not None:
+        return converter(value)
+    if isinstance(value, dict):
+        return to_serializable(dict(value))
+    if isinstance(value, list):
+        return to_serializable(list(value))
+    return _convert_other(value)
+
+
+def _json_default(value: Any) -> Any:
+    converter = TYPE_CONVERTERS.get(type(value))
+    if converter is not None:
+        return converter(value)
+    if isinstance(value, dict):
+        return dict(value)
+    return _convert_other(value)
+
+
+_compact_encoder = json.JSONEncoder(default=_json_default, separators=(",", ":"), ensure_ascii=False)
+
+
+def dumps_compact(value: Any) -> str:
+    """
+    Encode directement un résultat MongoDB en JSON compact
+
+    L'encodeur C de json parcourt dicts et listes ; seuls ObjectId, datetime
+    et les autres types BSON repassent par Python via _json_default. Évite la
+    copie intermédiaire de to_serializable quand seul le texte JSON est utile.
+    """
+    return _compact_encoder.encode(value)
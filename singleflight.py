@@ -0,0 +1,171 @@
+import contextvars
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional
+from config import SINGLEFLIGHT_ENABLED, SINGLEFLIGHT_TIMEOUT
+import telemetry
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Le calcul partagé n'a pas abouti dans le délai d'attente"""
+
+
+class _Call:
+    """Calcul en cours partagé par les appels de même clé"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class _Stream:
+    """Flux en cours : fragments déjà reçus, relus par chaque appelant"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.chunks: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Regroupement des appels identiques simultanés, pour tout le processus
+
+    Le premier appel d'une clé (le meneur) effectue le calcul ; les appels
+    de même clé arrivant pendant ce calcul l'attendent et reçoivent le même
+    résultat, ou la même exception. Rien n'est conservé une fois le calcul
+    terminé : la mise en cache reste l'affaire des caches existants.
+    """
+
+    def __init__(self, timeout: float = SINGLEFLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _Stream] = {}
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._streams)
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Exécute fn, ou attend le calcul identique déjà en cours
+
+        Args:
+            key: Identifiant du calcul ; le premier élément d'un tuple sert
+                d'étiquette aux métriques
+            fn: Calcul sans argument
+            timeout: Attente maximale d'un appel suiveur (secondes)
+
+        Raises:
+            SingleFlightTimeout: le calcul du meneur dépasse le délai
+            Exception: celle levée par fn chez le meneur
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        operation = _operation(key)
+        telemetry.increment("mbot_coalesced_requests_total", operation=operation)
+        started = time.perf_counter()
+        finished = call.done.wait(self.timeout if timeout is None else timeout)
+        telemetry.record_span("coalesced", (time.perf_counter() - started) * 1000, operation=operation)
+        if not finished:
+            raise SingleFlightTimeout(f"Calcul partagé « {operation} » toujours en cours")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stream(self, key: Hashable, produce: Callable[[], Iterator[str]],
+               timeout: Optional[float] = None) -> Iterator[str]:
+        """
+        Diffuse un flux de fragments, partagé avec les appels identiques
+
+        Le flux source est consommé par un thread de fond qui conserve les
+        fragments : chaque appelant les relit tous depuis le début, et
+        l'abandon d'un lecteur (rerun Streamlit) n'interrompt pas les autres.
+        """
+        with self._lock:
+            shared = self._streams.get(key)
+            leader = shared is None
+            if leader:
+                shared = self._streams[key] = _Stream()
+        if leader:
+            # Le contexte (trace de la question) suit le thread de fond
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._drain, key, shared, produce),
+                             name="singleflight-stream", daemon=True).start()
+        else:
+            telemetry.increment("mbot_coalesced_requests_total", operation=_operation(key))
+        return self._read(shared, self.timeout if timeout is None else timeout)
+
+    def _drain(self, key: Hashable, shared: _Stream, produce: Callable[[], Iterator[str]]):
+        try:
+            for chunk in produce():
+                with shared.condition:
+                    shared.chunks.append(chunk)
+                    shared.condition.notify_all()
+        except BaseException as e:
+            shared.error = e
+        finally:
+            with self._lock:
+                del self._streams[key]
+            with shared.condition:
+                shared.finished = True
+                shared.condition.notify_all()
+
+    @staticmethod
+    def _read(shared: _Stream, timeout: float) -> Iterator[str]:
+        position = 0
+        while True:
+            with shared.condition:
+                if not shared.condition.wait_for(
+                        lambda: len(shared.chunks) > position or shared.finished, timeout):
+                    raise SingleFlightTimeout("Flux partagé sans nouveau fragment dans le délai")
+                chunks = shared.chunks[position:]
+                finished = shared.finished
+            for chunk in chunks:
+                yield chunk
+            position += len(chunks)
+            if finished and position >= len(shared.chunks):
+                if shared.error is not None:
+                    raise shared.error
+                return
+
+
+def _operation(key: Hashable) -> str:
+    return str(key[0]) if isinstance(key, tuple) and key else "call"
+
+
+_shared_flight = None
+_shared_flight_lock = threading.Lock()
+
+
+def get_singleflight() -> Optional[SingleFlight]:
+    """Retourne le regroupement d'appels partagé par toutes les sessions (None si désactivé)"""
+    global _shared_flight
+    if not SINGLEFLIGHT_ENABLED:
+        return None
+    with _shared_flight_lock:
+        if _shared_flight is None:
+            _shared_flight = SingleFlight()
+        return _shared_flight
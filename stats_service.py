@@ -0,0 +1,104 @@
+import threading
+import time
+from typing import Dict, Optional
+from config import MONGODB_COLLECTION, STATS_REFRESH_INTERVAL
+
+
+class CollectionStatsService:
+    """
+    Statistiques de la collection mises en cache pour tout le processus
+
+    Le nombre de documents vient d'estimated_document_count (métadonnées,
+    sans parcours de la collection) et la taille de collStats. Les valeurs
+    sont relues au plus une fois par refresh_interval, dans un thread de
+    fond : un rerun Streamlit ne déclenche aucune commande MongoDB.
+    """
+
+    def __init__(self, db, collection_name: str = MONGODB_COLLECTION,
+                 refresh_interval: int = STATS_REFRESH_INTERVAL):
+        self.db = db
+        self.collection_name = collection_name
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._stats: Optional[Dict] = None
+        self._refreshed_at = 0.0
+        self._refreshing = False
+        self.last_error: Optional[str] = None
+
+    def fetch(self) -> Dict:
+        """Interroge MongoDB (deux commandes légères) et met le cache à jour"""
+        try:
+            total_docs = self.db[self.collection_name].estimated_document_count()
+            stats = self.db.command("collStats", self.collection_name)
+        except Exception as e:
+            with self._lock:
+                self.last_error = str(e)
+            raise
+        result = {
+            "total_documents": total_docs,
+            "size_mb": round(stats.get("size", 0) / (1024 * 1024), 2),
+            "avg_document_size": stats.get("avgObjSize", 0),
+            "indexes": len(stats.get("indexSizes", {})),
+        }
+        with self._lock:
+            self._stats = result
+            self._refreshed_at = time.time()
+            self.last_error = None
+        return result
+
+    def refresh_in_background(self):
+        """Relit les statistiques dans un thread de fond (un seul à la fois)"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="collection-stats", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.fetch()
+        except Exception as e:
+            print(f"Erreur lors du rafraîchissement des statistiques: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self, force_refresh: bool = False) -> Dict:
+        """
+        Statistiques en cache, avec leur âge
+
+        Returns:
+            Dict avec total_documents, size_mb, avg_document_size, indexes,
+            refreshed_at, age_seconds et stale (âge supérieur à
+            refresh_interval) ; vide si aucune lecture n'a encore réussi
+        """
+        with self._lock:
+            stats, refreshed_at = self._stats, self._refreshed_at
+        if stats is None or force_refresh:
+            # Première lecture (ou demande explicite) : synchrone
+            try:
+                stats = self.fetch()
+            except Exception as e:
+                print(f"Erreur lors de la récupération des statistiques: {e}")
+                if stats is None:
+                    return {}
+            with self._lock:
+                refreshed_at = self._refreshed_at
+        age = time.time() - refreshed_at
+        stale = age > self.refresh_interval
+        if stale:
+            self.refresh_in_background()
+        return dict(stats, refreshed_at=refreshed_at, age_seconds=round(age, 1), stale=stale)
+
+
+_shared_stats = None
+_shared_stats_lock = threading.Lock()
+
+
+def get_stats_service(db=None) -> Optional[CollectionStatsService]:
+    """Retourne le service de statistiques partagé du processus"""
+    global _shared_stats
+    with _shared_stats_lock:
+        if _shared_stats is None and db is not None:
+            _shared_stats = CollectionStatsService(db)
+        return _shared_stats
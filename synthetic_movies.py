@@ -0,0 +1,91 @@
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List
+from bson import ObjectId
+
+
+# Vocabulaire proche de sample_mflix.movies
+GENRES = ["Drama", "Comedy", "Romance", "Crime", "Thriller", "Action", "Adventure", "Documentary",
+          "Horror", "Biography", "Family", "Mystery", "Fantasy", "Sci-Fi", "Animation", "History",
+          "Music", "War", "Short", "Musical", "Sport", "Western"]
+COUNTRIES = ["USA", "UK", "France", "Germany", "Canada", "Italy", "Japan", "India", "Spain", "Australia"]
+LANGUAGES = ["English", "French", "Spanish", "German", "Italian", "Japanese", "Hindi", "Russian"]
+RATINGS = ["PG", "PG-13", "R", "G", "NOT RATED", "UNRATED", "TV-14", "APPROVED"]
+FIRST_NAMES = ["John", "Mary", "Robert", "Patricia", "Michael", "Linda", "David", "Barbara", "Jean",
+               "Claire", "Akira", "Sofia", "Luis", "Ingrid", "Pedro", "Agnès", "François", "Wong"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Miller", "Davis", "Garcia", "Martin",
+              "Bernard", "Kurosawa", "Almodóvar", "Bergman", "Varda", "Truffaut", "Kar-wai", "Lee"]
+WORDS = ["love", "city", "night", "war", "family", "secret", "journey", "dream", "murder", "river",
+         "king", "stranger", "summer", "detective", "island", "memory", "revenge", "escape", "town"]
+
+
+def _person(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[:1].upper() + text[1:] + "."
+
+
+def generate_movie(rng: random.Random) -> Dict:
+    """Un document de film avec la forme et les types BSON de sample_mflix"""
+    year = rng.randint(1903, 2016)
+    released = datetime(year, 1, 1) + timedelta(days=rng.randint(0, 364))
+    rating = round(rng.uniform(1.5, 9.5), 1)
+    movie = {
+        "_id": ObjectId(),
+        "plot": _sentence(rng, rng.randint(15, 35)),
+        "genres": rng.sample(GENRES, rng.randint(1, 3)),
+        "runtime": rng.randint(60, 180),
+        "cast": [_person(rng) for _ in range(rng.randint(2, 4))],
+        "num_mflix_comments": rng.randint(0, 12),
+        "poster": f"https://m.media-amazon.com/images/M/{rng.getrandbits(64):x}.jpg",
+        "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title(),
+        "fullplot": " ".join(_sentence(rng, rng.randint(12, 25)) for _ in range(rng.randint(3, 8))),
+        "languages": rng.sample(LANGUAGES, rng.randint(1, 2)),
+        "released": released,
+        "directors": [_person(rng) for _ in range(rng.choice([1, 1, 1, 2]))],
+        "writers": [f"{_person(rng)} (screenplay)" for _ in range(rng.randint(1, 3))],
+        "rated": rng.choice(RATINGS),
+        "awards": {
+            "wins": rng.randint(0, 20),
+            "nominations": rng.randint(0, 30),
+            "text": f"{rng.randint(0, 20)} wins & {rng.randint(0, 30)} nominations.",
+        },
+        "lastupdated": f"2015-0{rng.randint(1, 9)}-1{rng.randint(0, 9)} 00:0{rng.randint(0, 9)}:00.000000000",
+        "year": year,
+        "imdb": {"rating": rating, "votes": rng.randint(5, 1500000), "id": rng.randint(1, 4000000)},
+        "countries": rng.sample(COUNTRIES, rng.randint(1, 2)),
+        "type": "movie",
+        "tomatoes": {
+            "viewer": {"rating": round(rng.uniform(1, 5), 1), "numReviews": rng.randint(0, 500000),
+                       "meter": rng.randint(0, 100)},
+            "dvd": released + timedelta(days=rng.randint(90, 900)),
+            "critic": {"rating": round(rng.uniform(1, 10), 1), "numReviews": rng.randint(0, 300),
+                       "meter": rng.randint(0, 100)},
+            "lastUpdated": datetime(2015, 8, rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59)),
+            "rotten": rng.randint(0, 100),
+            "production": f"{rng.choice(LAST_NAMES)} Pictures",
+            "fresh": rng.randint(0, 200),
+        },
+    }
+    # Champs absents d'une partie de la collection, comme dans sample_mflix
+    if rng.random() < 0.3:
+        movie["metacritic"] = rng.randint(10, 100)
+    if rng.random() < 0.2:
+        del movie["tomatoes"]
+    return movie
+
+
+def generate_movies(count: int, seed: int = 42) -> List[Dict]:
+    """Corpus reproductible de count films"""
+    rng = random.Random(seed)
+    return [generate_movie(rng) for _ in range(count)]
+
+
+def iter_movies(count: int, seed: int = 42) -> Iterator[Dict]:
+    """Variante paresseuse de generate_movies"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield generate_movie(rng)
@@ -0,0 +1,360 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import (
+    TELEMETRY_ENABLED, TELEMETRY_METRICS_PORT, TELEMETRY_RECENT_TRACES, OTEL_EXPORTER_OTLP_ENDPOINT
+)
+
+
+# Bornes des histogrammes (format Prometheus, "le" = inférieur ou égal)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000)
+
+METRIC_HELP = {
+    "mbot_stage_duration_seconds": "Durée des étapes du traitement d'une question",
+    "mbot_question_duration_seconds": "Durée totale du traitement d'une question",
+    "mbot_cache_requests_total": "Consultations des caches (hit/miss)",
+    "mbot_llm_tokens_total": "Tokens consommés par l'API LLM",
+    "mbot_llm_retries_total": "Nouvelles tentatives d'appel à l'API LLM",
+    "mbot_result_rows": "Nombre de documents renvoyés par requête",
+    "mbot_errors_total": "Erreurs par étape",
+    "mbot_coalesced_requests_total": "Appels servis par un calcul identique déjà en cours",
+    "mbot_llm_throttled_total": "Réponses 429 de l'API LLM",
+    "mbot_follow_ups_total": "Questions de suivi par mode de modification de la requête précédente",
+    "mbot_llm_queue_wait_seconds": "Attente dans la file du limiteur de débit LLM",
+    "mbot_llm_queue_depth": "Appels LLM en attente dans la file du limiteur",
+    "mbot_llm_concurrency_limit": "Appels LLM simultanés autorisés (AIMD)",
+}
+
+
+class Span:
+    """Étape chronométrée d'une question"""
+
+    def __init__(self, name: str, start_ns: int, duration_ms: float, attributes: Optional[Dict] = None):
+        self.name = name
+        self.start_ns = start_ns
+        self.duration_ms = duration_ms
+        self.attributes = attributes or {}
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "duration_ms": round(self.duration_ms, 3), "attributes": self.attributes}
+
+
+class Trace:
+    """Étapes d'une question, de sa réception à la réponse formatée"""
+
+    def __init__(self, name: str, attributes: Optional[Dict] = None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.spans: List[Span] = []
+        self.duration_ms: Optional[float] = None
+
+    def add(self, span: Span):
+        self.spans.append(span)
+
+    def breakdown(self) -> List[Tuple[str, float]]:
+        """Durée cumulée par étape (ms), dans l'ordre d'apparition"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        return list(totals.items())
+
+    def finish(self) -> "Trace":
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._started) * 1000
+        return self
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "duration_ms": self.duration_ms, "attributes": self.attributes,
+                "spans": [span.to_dict() for span in self.spans]}
+
+
+class MetricsRegistry:
+    """Compteurs, jauges et histogrammes étiquetés, exposés au format texte Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[Tuple, float]] = {}
+        self.gauges: Dict[str, Dict[Tuple, float]] = {}
+        self.histograms: Dict[str, Dict[Tuple, List]] = {}
+        self.buckets: Dict[str, Tuple] = {}
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, buckets: Tuple = DURATION_BUCKETS, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.buckets.setdefault(name, buckets)
+            series = self.histograms.setdefault(name, {})
+            # [compte par borne..., somme, nombre]
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * len(self.buckets[name]) + [0.0, 0]
+            for index, bound in enumerate(self.buckets[name]):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def value(self, name: str, **labels) -> float:
+        with self._lock:
+            key = tuple(sorted(labels.items()))
+            return self.counters.get(name, {}).get(key, self.gauges.get(name, {}).get(key, 0))
+
+    def render(self) -> str:
+        """Exposition au format texte Prometheus 0.0.4"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)} {value}")
+            for name, series in sorted(self.gauges.items()):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} gauge")
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, state in series.items():
+                    for bound, count in zip(self.buckets[name], state):
+                        lines.append(f"{name}_bucket{_labels(key + (('le', _number(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {state[-1]}")
+                    lines.append(f"{name}_sum{_labels(key)} {state[-2]}")
+                    lines.append(f"{name}_count{_labels(key)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _labels(key: Tuple) -> str:
+    if not key:
+        return ""
+    escaped = (f'{label}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for label, value in key)
+    return "{" + ",".join(escaped) + "}"
+
+
+registry = MetricsRegistry()
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("mbot_trace", default=None)
+_recent_traces: deque = deque(maxlen=TELEMETRY_RECENT_TRACES)
+_recent_lock = threading.Lock()
+
+
+def start_trace(name: str = "question", **attributes) -> Trace:
+    """Démarre la trace d'une question ; les étapes suivantes du même contexte s'y rattachent"""
+    trace = Trace(name, attributes)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def finish_trace(trace: Optional[Trace] = None) -> Optional[Trace]:
+    """Clôt la trace courante, l'ajoute aux traces récentes et l'exporte (OTLP)"""
+    trace = trace or _current_trace.get()
+    if trace is None:
+        return None
+    trace.finish()
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    if TELEMETRY_ENABLED:
+        registry.observe("mbot_question_duration_seconds", trace.duration_ms / 1000)
+        with _recent_lock:
+            _recent_traces.append(trace)
+        _export(trace)
+    return trace
+
+
+def record_span(name: str, duration_ms: float, **attributes):
+    """Enregistre une étape déjà chronométrée (durée en ms)"""
+    if not TELEMETRY_ENABLED:
+        return
+    registry.observe("mbot_stage_duration_seconds", duration_ms / 1000, stage=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        start_ns = time.time_ns() - int(duration_ms * 1_000_000)
+        trace.add(Span(name, start_ns, duration_ms, attributes))
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Dict]:
+    """
+    Chronomètre une étape
+
+    Le dictionnaire produit peut recevoir des attributs pendant l'étape ;
+    une exception est comptée dans mbot_errors_total puis propagée.
+    """
+    started = time.perf_counter()
+    try:
+        yield attributes
+    except Exception as e:
+        attributes["error"] = type(e).__name__
+        record_error(name)
+        raise
+    finally:
+        record_span(name, (time.perf_counter() - started) * 1000, **attributes)
+
+
+def increment(name: str, value: float = 1, **labels):
+    if TELEMETRY_ENABLED:
+        registry.increment(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    if TELEMETRY_ENABLED:
+        registry.set_gauge(name, value, **labels)
+
+
+def observe(name: str, value: float, buckets: Tuple = DURATION_BUCKETS, **labels):
+    if TELEMETRY_ENABLED:
+        registry.observe(name, value, buckets, **labels)
+
+
+def record_cache(cache: str, hit: bool):
+    increment("mbot_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def record_error(stage: str):
+    increment("mbot_errors_total", stage=stage)
+
+
+def record_llm_call(call: str, timings: Dict, usage: Optional[Dict] = None):
+    """Tentatives supplémentaires et tokens (champ usage de la réponse) d'un appel LLM"""
+    retries = max(0, timings.get("attempts", 1) - 1)
+    if retries:
+        increment("mbot_llm_retries_total", retries, call=call)
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage and usage.get(kind):
+            increment("mbot_llm_tokens_total", usage[kind], call=call, kind=kind.split("_")[0])
+
+
+def recent_percentile(q: float, min_samples: int = 1) -> Optional[float]:
+    """
+    Percentile (ms) de la durée des dernières questions traitées par le processus
+
+    None tant que moins de min_samples traces récentes sont disponibles : en
+    deçà de 100 traces, le p99 n'est que le maximum observé.
+    """
+    with _recent_lock:
+        durations = sorted(trace.duration_ms for trace in _recent_traces)
+    if not durations or len(durations) < min_samples:
+        return None
+    return durations[min(len(durations) - 1, int(len(durations) * q / 100))]
+
+
+def slowest_traces(q: float = 99) -> List[Trace]:
+    """Traces récentes au-delà du percentile q, les plus lentes d'abord"""
+    threshold = recent_percentile(q)
+    if threshold is None:
+        return []
+    with _recent_lock:
+        traces = [trace for trace in _recent_traces if trace.duration_ms >= threshold]
+    return sorted(traces, key=lambda trace: -trace.duration_ms)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = TELEMETRY_METRICS_PORT) -> Optional[int]:
+    """
+    Expose /metrics (format Prometheus) dans un thread de fond, une fois par processus
+
+    Returns:
+        Port d'écoute, ou None si l'export est désactivé (port 0) ou le port indisponible
+    """
+    global _metrics_server
+    if not TELEMETRY_ENABLED or not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            try:
+                _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                print(f"Endpoint de métriques indisponible sur le port {port}: {e}")
+                return None
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics-endpoint", daemon=True).start()
+        return _metrics_server.server_address[1]
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def _otel_tracer():
+    """Traceur OpenTelemetry (OTLP/HTTP) si OTEL_EXPORTER_OTLP_ENDPOINT est défini et le SDK installé"""
+    global _tracer
+    if not OTEL_EXPORTER_OTLP_ENDPOINT:
+        return None
+    with _tracer_lock:
+        if _tracer is None:
+            try:
+                from opentelemetry.sdk.resources import Resource
+                from opentelemetry.sdk.trace import TracerProvider
+                from opentelemetry.sdk.trace.export import BatchSpanProcessor
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            except ImportError:
+                print("Export OpenTelemetry ignoré : pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-http")
+                _tracer = False
+                return None
+            provider = TracerProvider(resource=Resource.create({"service.name": "mbot"}))
+            endpoint = OTEL_EXPORTER_OTLP_ENDPOINT.rstrip("/") + "/v1/traces"
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+            _tracer = provider.get_tracer("mbot")
+        return _tracer or None
+
+
+def _export(trace: Trace):
+    tracer = _otel_tracer()
+    if tracer is None:
+        return
+    try:
+        from opentelemetry import trace as otel_trace
+        root = tracer.start_span(trace.name, start_time=trace.start_ns, attributes=trace.attributes)
+        context = otel_trace.set_span_in_context(root)
+        for item in trace.spans:
+            child = tracer.start_span(item.name, context=context, start_time=item.start_ns,
+                                      attributes={key: str(value) for key, value in item.attributes.items()})
+            child.end(end_time=item.start_ns + int(item.duration_ms * 1_000_000))
+        root.end(end_time=trace.start_ns + int(trace.duration_ms * 1_000_000))
+    except Exception as e:
+        print(f"Erreur lors de l'export OpenTelemetry: {e}")
@@ -129,6 +129,1513 @@ def test_schema_loading():
         print(f"❌ Erreur lecture CLAUDE.md: {e}")
         return False
 
+def test_query_cache():
+    """Test le cache persistant des traductions question → requête"""
+    print("\n🗃️ Test du cache de requêtes...")
+    
+    try:
+        import tempfile
+        from query_cache import QueryCache
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = QueryCache(os.path.join(tmp_dir, "cache.sqlite3"), ttl=3600, max_entries=2)
+            query_info = {"query_type": "aggregate", "mongodb_query": [{"$count": "total"}]}
+            cache.set("Combien de films sont sortis en 2015 ?", query_info)
+            
+            if cache.get("combien de films  sont SORTIS en 2015") != query_info:
+                print("❌ La question normalisée n'est pas retrouvée dans le cache")
+                return False
+            
+            cache.set("question 2", query_info)
+            cache.set("question 3", query_info)
+            if cache.count() != 2:
+                print("❌ L'éviction LRU n'a pas été appliquée")
+                return False
+        
+        print("✅ Cache de requêtes fonctionnel")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur cache de requêtes: {e}")
+        return False
+
+def test_result_cache():
+    """Test le cache de résultats MongoDB (budget mémoire, TTL, LRU, clé canonique, surveillance)"""
+    print("\n💾 Test du cache de résultats...")
+    
+    try:
+        import threading
+        import time
+        from result_cache import ResultCache, canonical_query_key
+        from serialization import dumps_compact
+        
+        first = [{"_id": 2015, "count": 10}]
+        entry_size = len(dumps_compact(first))
+        cache = ResultCache(max_bytes=entry_size * 2, ttl=3600)
+        cache.set("a", first)
+        cache.set("b", [{"_id": 2016, "count": 11}])
+        cache.get("a")
+        cache.set("c", [{"_id": 2017, "count": 12}])
+        if cache.get("b") is not None or cache.get("a") != first or cache.stats()["size_bytes"] > entry_size * 2:
+            print(f"❌ Éviction LRU ou budget mémoire incorrects: {cache.stats()}")
+            return False
+        cache.set("big", [{"title": "x" * entry_size * 3}])
+        if cache.get("big") is not None:
+            print("❌ Un résultat plus grand que le budget ne doit pas être conservé")
+            return False
+        
+        cache.ttl = 1
+        cache._entries["a"] = (time.time() - 5,) + cache._entries["a"][1:]
+        if cache.get("a") is not None:
+            print("❌ Une entrée expirée doit être ignorée")
+            return False
+        
+        pipeline = [{"$match": {"year": 2015, "genres": "Drama"}}, {"$sort": {"year": -1, "title": 1}}]
+        reordered = [{"$match": {"genres": "Drama", "year": 2015.0}}, {"$sort": {"year": -1, "title": 1}}]
+        resorted = [{"$match": {"year": 2015, "genres": "Drama"}}, {"$sort": {"title": 1, "year": -1}}]
+        if canonical_query_key("aggregate", pipeline) != canonical_query_key("aggregate", reordered):
+            print("❌ L'ordre des clés d'un filtre ne doit pas changer la clé")
+            return False
+        if canonical_query_key("aggregate", pipeline) == canonical_query_key("aggregate", resorted):
+            print("❌ L'ordre des clés d'un $sort doit changer la clé")
+            return False
+        
+        # Change stream interrompu : la surveillance reprend et invalide de nouveau
+        reopened = threading.Event()
+        
+        class Stream:
+            def __init__(self, events, error=None):
+                self.events, self.error = events, error
+            
+            def __enter__(self):
+                return self
+            
+            def __exit__(self, *args):
+                return False
+            
+            def __iter__(self):
+                yield from self.events
+                if self.error:
+                    raise self.error
+                reopened.set()
+                threading.Event().wait()
+        
+        class Collection:
+            def __init__(self):
+                self.streams = [Stream([], ConnectionError("élection")), Stream([{"operationType": "insert"}])]
+            
+            def watch(self, pipeline):
+                return self.streams.pop(0)
+        
+        watched = ResultCache(max_bytes=entry_size * 2, ttl=0)
+        watched.watch_backoff_base = 0.01
+        watched.set("a", first)
+        watched.watch_collection(Collection())
+        if not reopened.wait(2) or watched.get("a") is not None:
+            print("❌ La surveillance doit reprendre après une erreur du change stream")
+            return False
+        
+        print("✅ Cache de résultats fonctionnel")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur cache de résultats: {e}")
+        return False
+
+def test_mongo_pool():
+    """Test le registre des clients MongoDB partagés et les compteurs du pool"""
+    print("\n🏊 Test du pool de connexions MongoDB...")
+    
+    try:
+        import mongo_pool
+        from mongo_pool import MongoClientRegistry, PoolStatsListener
+        
+        created = []
+        
+        class FakeClient:
+            def __init__(self, uri, **options):
+                self.uri = uri
+                self.options = options
+                self.closed = False
+                self.admin = self
+                created.append(self)
+            
+            def command(self, name):
+                return {"ok": 1}
+            
+            def close(self):
+                self.closed = True
+        
+        real_client = mongo_pool.MongoClient
+        mongo_pool.MongoClient = FakeClient
+        try:
+            registry = MongoClientRegistry()
+            first = registry.get_client("mongodb://pool-a")
+            again = registry.get_client("mongodb://pool-a")
+            other = registry.get_client("mongodb://pool-b")
+        finally:
+            mongo_pool.MongoClient = real_client
+        if first is not again or first is other or len(created) != 2:
+            print(f"❌ Une même URI doit partager un seul client ({len(created)} créés)")
+            return False
+        listener = first.options["event_listeners"][0]
+        if not isinstance(listener, PoolStatsListener) or "maxPoolSize" not in first.options:
+            print("❌ Le client doit être créé avec les options du pool et le listener")
+            return False
+        
+        # Événements du pool simulés : deux checkouts, un checkin
+        listener.connection_created(None)
+        listener.connection_created(None)
+        for _ in range(2):
+            listener.connection_check_out_started(None)
+            listener.connection_checked_out(None)
+        listener.connection_checked_in(None)
+        listener.connection_check_out_failed(None)
+        stats = registry.pool_stats("mongodb://pool-a")
+        if (stats["open_connections"], stats["checked_out"], stats["total_checkouts"], stats["failed_checkouts"]) \
+                != (2, 1, 2, 1):
+            print(f"❌ Compteurs du pool incorrects: {stats}")
+            return False
+        
+        registry.close_all()
+        if not first.closed or registry.pool_stats("mongodb://pool-a"):
+            print("❌ close_all doit fermer les clients partagés")
+            return False
+        
+        print(f"✅ Pool de connexions fonctionnel (attente moyenne {stats['avg_wait_ms']} ms)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur pool de connexions: {e}")
+        return False
+
+def test_http_transport():
+    """Test le transport HTTP (retry sur 503 + chronométrage) contre un serveur local"""
+    print("\n🌐 Test du transport HTTP...")
+    
+    try:
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from http_transport import HTTPTransport
+        
+        calls = []
+        
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                calls.append(self.path)
+                if len(calls) == 1:
+                    self.send_response(503)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = json.dumps({"choices": [{"message": {"content": "ok"}}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            transport = HTTPTransport(connect_timeout=1, read_timeout=2, max_retries=2, backoff_base=0.01)
+            url = f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+            response = transport.post(url, headers={}, json={"model": "stub"})
+            timings = transport.last_timings()
+        finally:
+            server.shutdown()
+        
+        if response.status_code != 200 or timings.get("attempts") != 2:
+            print(f"❌ Nouvelle tentative non effectuée: {response.status_code}, {timings}")
+            return False
+        
+        print(f"✅ Transport HTTP fonctionnel ({timings.get('total_ms')} ms, {timings.get('attempts')} tentatives)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur transport HTTP: {e}")
+        return False
+
+def test_async_pipeline():
+    """Test le pipeline asynchrone (httpx + Motor) contre un serveur local et une collection simulée"""
+    print("\n⚡ Test du pipeline asynchrone...")
+    
+    try:
+        import asyncio
+        import json
+        import threading
+        import time
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from async_services import AsyncPerplexityService, AsyncMongoDBService, AsyncQuestionPipeline
+        
+        # Délai de réponse par question : les chronométrages ne doivent pas se mélanger
+        delays = {"films de nolan": 0.3, "films de villeneuve": 0.05}
+        calls = []
+        
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                question = payload["messages"][-1]["content"].lower()
+                calls.append(question)
+                if calls.count(question) == 1 and "villeneuve" in question:
+                    self.send_response(503)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                translation = "convertir" in payload["messages"][0]["content"]
+                time.sleep(next((delay for name, delay in delays.items() if name in question), 0) if translation else 0)
+                content = json.dumps({"query_type": "find", "mongodb_query": {"directors": question.title()},
+                                      "explanation": "stub", "estimated_results": "films"}) if translation else "Réponse"
+                usage = {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+                body = json.dumps({"choices": [{"message": {"content": content}}], "usage": usage}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        class Cursor:
+            def __init__(self, query):
+                self.query = query
+            
+            def limit(self, count):
+                return self
+            
+            def max_time_ms(self, value):
+                return self
+            
+            async def to_list(self, length=None):
+                return [{"title": f"Film de {self.query['directors']}", "year": 2010}]
+        
+        class Collection:
+            def find(self, query):
+                return Cursor(query)
+        
+        # Limiteur qui accorde tout de suite et note la consommation réelle transmise
+        recorded_usage = []
+        
+        class Permit:
+            waited_ms = 0.0
+            
+            def release(self, status_code=None, retry_after=None):
+                pass
+        
+        class RecordingLimiter:
+            def acquire(self, estimated_tokens):
+                return Permit()
+            
+            def record_usage(self, estimated_tokens, used_tokens):
+                recorded_usage.append((estimated_tokens, used_tokens))
+        
+        import telemetry
+        prompt_tokens = telemetry.registry.value("mbot_llm_tokens_total", call="generate", kind="prompt")
+        
+        mongodb_service = AsyncMongoDBService.__new__(AsyncMongoDBService)
+        mongodb_service.collection = Collection()
+        mongodb_service.result_cache = None
+        mongodb_service.client = type("Client", (), {"close": lambda self: None})()
+        
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            perplexity_service = AsyncPerplexityService(f"http://127.0.0.1:{server.server_address[1]}/chat/completions")
+            perplexity_service.query_cache = None
+            perplexity_service.example_store = None
+            limiter = perplexity_service.transport.limiter
+            perplexity_service.transport.limiter = RecordingLimiter()
+            perplexity_service._format_locally = lambda results, question: None
+            
+            async def run():
+                pipeline = AsyncQuestionPipeline(perplexity_service, mongodb_service, max_concurrency=2)
+                try:
+                    return await pipeline.answer_many(["Films de Nolan", "Films de Villeneuve"])
+                finally:
+                    await pipeline.aclose()
+            
+            started = time.perf_counter()
+            nolan, villeneuve = asyncio.run(run())
+            elapsed = time.perf_counter() - started
+        finally:
+            server.shutdown()
+            perplexity_service.transport.limiter = limiter
+        
+        if not nolan["results"][0]["title"].endswith("Nolan") or villeneuve["formatted_response"] != "Réponse":
+            print(f"❌ Réponses incorrectes: {nolan}, {villeneuve}")
+            return False
+        nolan_call = nolan["timings"]["llm_calls"]["generate"]
+        villeneuve_call = villeneuve["timings"]["llm_calls"]["generate"]
+        if nolan_call["total_ms"] < 300 or villeneuve_call["total_ms"] >= 300 or villeneuve_call["attempts"] != 2:
+            print(f"❌ Chronométrages mélangés entre questions: {nolan_call}, {villeneuve_call}")
+            return False
+        if elapsed >= 0.6:
+            print(f"❌ Questions non traitées en parallèle ({elapsed:.2f} s)")
+            return False
+        # Même suivi que le service synchrone : consommation réelle au limiteur et métriques par appel
+        if len(recorded_usage) != 4 or any(used != 120 or not estimated for estimated, used in recorded_usage):
+            print(f"❌ Consommation réelle non transmise au limiteur: {recorded_usage}")
+            return False
+        if telemetry.TELEMETRY_ENABLED and \
+                telemetry.registry.value("mbot_llm_tokens_total", call="generate", kind="prompt") != prompt_tokens + 200:
+            print("❌ Appels asynchrones absents des métriques")
+            return False
+        
+        print(f"✅ Pipeline asynchrone fonctionnel ({elapsed * 1000:.0f} ms pour 2 questions)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur pipeline asynchrone: {e}")
+        return False
+
+def test_sse_decoding():
+    """Test le décodage du flux SSE de formatage et le repli en cas d'erreur en cours de flux"""
+    print("\n📡 Test du décodage SSE...")
+    
+    try:
+        import requests
+        from perplexity_service import PerplexityService, SSEDecoder
+        
+        class ChunkedRaw:
+            """Corps de réponse livré par morceaux arbitraires, comme sur le réseau"""
+            def __init__(self, chunks):
+                self.chunks = chunks
+            
+            def stream(self, chunk_size, decode_content=True):
+                yield from self.chunks
+        
+        chunks = [
+            b'data: {"choices": [{"delta": {"content": "Bon"}}]}\n',
+            b'\ndata: {"choices": [{"del',
+            b'ta": {"content": "jour"}}]}\n\n: commentaire\n\ndata: {"choices": [{"delta": {"content": " !"}}],',
+            b' "usage": {"prompt_tokens": 30, "completion_tokens": 12}}\n\ndata: [DO',
+            b'NE]\n\ndata: {"choices": [{"delta": {"content": "ignored"}}]}\n\n',
+        ]
+        response = requests.Response()
+        response.raw = ChunkedRaw(chunks)
+        decoder = SSEDecoder()
+        text = "".join(PerplexityService._iter_sse_content(response, decoder))
+        if text != "Bonjour !" or not decoder.done:
+            print(f"❌ Flux mal décodé: {text!r}")
+            return False
+        if decoder.usage != {"prompt_tokens": 30, "completion_tokens": 12}:
+            print(f"❌ Décompte de tokens du dernier événement perdu: {decoder.usage}")
+            return False
+        
+        # Messages cumulés plutôt que deltas : seule la partie nouvelle est émise
+        cumulative = SSEDecoder()
+        deltas = []
+        for line in ['data: {"choices": [{"message": {"content": "Le"}}]}', "",
+                     'data: {"choices": [{"message": {"content": "Le film"}}]}', ""]:
+            delta = cumulative.feed(line)
+            if delta:
+                deltas.append(delta)
+        if deltas != ["Le", " film"]:
+            print(f"❌ Messages cumulés mal décodés: {deltas}")
+            return False
+        
+        # Erreur après une réponse partielle : le texte reçu est suivi des résultats bruts
+        def broken_stream(payload):
+            yield "Début de réponse"
+            raise ConnectionError("connexion interrompue")
+        
+        service = PerplexityService()
+        service.inflight = None
+        service._format_locally = lambda results, question: None
+        service._request_format_stream = broken_stream
+        output = "".join(service.format_results_stream([{"title": "Inception", "year": 2010}], "Films de 2010"))
+        if not output.startswith("Début de réponse\n\nErreur lors du formatage: connexion interrompue") \
+                or "Inception" not in output:
+            print(f"❌ Repli après une réponse partielle incorrect: {output!r}")
+            return False
+        
+        print("✅ Décodage SSE fonctionnel")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur décodage SSE: {e}")
+        return False
+
+def test_local_formatter():
+    """Test la mise en forme locale des résultats simples"""
+    print("\n📝 Test du formateur local...")
+    
+    try:
+        from result_formatter import format_locally
+        
+        count_answer = format_locally([{"total": 1234}], "Combien de films sont sortis en 2015 ?")
+        grouped_answer = format_locally(
+            [{"_id": 2015, "avgRating": 6.8}, {"_id": 2016, "avgRating": 6.9}],
+            "Note moyenne par année ?"
+        )
+        commentary_answer = format_locally([{"total": 1234}], "Analyse le nombre de films")
+        
+        if not count_answer or "1234" not in count_answer:
+            print(f"❌ Comptage mal formaté: {count_answer}")
+            return False
+        if not grouped_answer or "| Année |" not in grouped_answer:
+            print(f"❌ Tableau _id/métrique mal formaté: {grouped_answer}")
+            return False
+        if commentary_answer is not None:
+            print("❌ Une demande d'analyse doit passer par le LLM")
+            return False
+        
+        print("✅ Formateur local fonctionnel")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur formateur local: {e}")
+        return False
+
+def test_intent_engine():
+    """Test la reconnaissance des questions courantes sans appel au LLM"""
+    print("\n🎯 Test du moteur d'intentions...")
+    
+    try:
+        from intent_engine import match_intent
+        
+        expected = {
+            "Combien de films sont sortis entre 2012 et 2014 ?": "count",
+            "Quelle est la note moyenne des films parus en 2015 ?": "average_rating",
+            "Quels sont les 5 réalisateurs qui ont produit le plus de films entre 2000 et 2015 ?": "top_directors",
+            "Quel est le genre le plus populaire par décennie entre 1970 et 2010 ?": "genre_per_decade",
+            "Peux-tu me montrer le contenu d'un document de la collection ?": "sample_document",
+            "Combien de films avec Tom Hanks ?": None,
+            # Regroupement demandé : aucun modèle de classement ne répond par groupe
+            "Quel est le premier film de chaque année ?": None,
+            "Quels sont les réalisateurs les plus prolifiques par décennie ?": None,
+            "Quels sont les genres les plus populaires par réalisateur ?": None,
+            "Combien de films depuis toujours ?": None,
+        }
+        
+        for question, intent in expected.items():
+            query_info = match_intent(question)
+            found = query_info.get("intent") if query_info else None
+            if found != intent:
+                print(f"❌ {question} → {found} (attendu: {intent})")
+                return False
+        
+        top_directors = match_intent("Quels sont les 5 réalisateurs qui ont produit le plus de films entre 2000 et 2015 ?")
+        if top_directors["mongodb_query"][0] != {"$match": {"year": {"$gte": 2000, "$lte": 2015}}}:
+            print("❌ Paramètres mal extraits pour le top réalisateurs")
+            return False
+        
+        for question in ("Combien de films dans les années 1990 ?", "Combien de films dans les années 90 ?"):
+            decade = match_intent(question)
+            if not decade or decade["parameters"] != {"year_range": [1990, 1999]}:
+                print(f"❌ Décennie mal extraite: {question} → {decade and decade['parameters']}")
+                return False
+        
+        bounds = {
+            "Combien de films sont sortis depuis 2010 ?": {"$gte": 2010, "$lte": 2100},
+            "Combien de films sont sortis jusqu'en 2010 ?": {"$gte": 1870, "$lte": 2010},
+            "Quel est le nombre de films par année depuis 2010": {"$gte": 2010, "$lte": 2100},
+        }
+        for question, condition in bounds.items():
+            bounded = match_intent(question)
+            if not bounded or bounded["mongodb_query"][0] != {"$match": {"year": condition}}:
+                print(f"❌ Borne d'années mal traduite: {question} → {bounded and bounded['mongodb_query']}")
+                return False
+        
+        # Superlatif au singulier : un seul réalisateur, pas le top par défaut
+        prolific = match_intent("Qui est le réalisateur le plus prolifique ?")
+        if not prolific or prolific["mongodb_query"][-1] != {"$limit": 1}:
+            print(f"❌ Réalisateur le plus prolifique: {prolific and prolific['mongodb_query']}")
+            return False
+        plural = match_intent("Quels réalisateurs ont réalisé le plus de films ?")
+        if not plural or plural["mongodb_query"][-1] != {"$limit": 5}:
+            print("❌ Le top des réalisateurs au pluriel doit garder 5 résultats")
+            return False
+        
+        print("✅ Moteur d'intentions fonctionnel")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur moteur d'intentions: {e}")
+        return False
+
+def test_pipeline_optimizer():
+    """Test la réécriture des pipelines d'agrégation avant exécution"""
+    print("\n⚙️ Test de l'optimiseur de pipelines...")
+    
+    try:
+        from pipeline_optimizer import optimize_pipeline
+        
+        pipeline = [
+            {"$unwind": "$directors"},
+            {"$match": {"year": {"$gte": 2000, "$lte": 2015}}},
+            {"$group": {"_id": "$directors", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}}
+        ]
+        report = optimize_pipeline(pipeline, max_results=100)
+        stages = [next(iter(stage)) for stage in report.pipeline]
+        
+        if stages != ["$match", "$project", "$unwind", "$group", "$sort", "$limit"]:
+            print(f"❌ Pipeline mal réécrit: {stages}")
+            return False
+        if report.pipeline[1]["$project"] != {"directors": 1, "year": 1, "_id": 0}:
+            print(f"❌ Projection incorrecte: {report.pipeline[1]}")
+            return False
+        if pipeline[0] != {"$unwind": "$directors"}:
+            print("❌ Le pipeline d'origine ne doit pas être modifié")
+            return False
+        
+        count_report = optimize_pipeline([{"$match": {"year": 2015}}, {"$count": "total"}])
+        if count_report.pipeline[-1] != {"$count": "total"}:
+            print("❌ Un $count ne doit pas être suivi d'un $limit")
+            return False
+        
+        print("✅ Optimiseur de pipelines fonctionnel")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur optimiseur de pipelines: {e}")
+        return False
+
+def test_index_advisor():
+    """Test les propositions d'index à partir d'un explain()"""
+    print("\n🗂 Test du conseiller d'index...")
+    
+    try:
+        from index_advisor import IndexAdvisor, propose_index
+        
+        if propose_index(["genres", "directors"], [("imdb.rating", -1)], ["year"]) != [
+            ("genres", 1), ("imdb.rating", -1), ("year", 1)
+        ]:
+            print("❌ Index ESR incorrect (un seul champ tableau attendu)")
+            return False
+        
+        explain = {
+            "queryPlanner": {"winningPlan": {"stage": "LIMIT", "inputStage": {"stage": "COLLSCAN"}}},
+            "executionStats": {"totalDocsExamined": 21349, "nReturned": 120, "executionTimeMillis": 30}
+        }
+        advisor = IndexAdvisor(None, sample_rate=0, profile_path=None)
+        advisor._existing_indexes = lambda: [[("_id", 1)]]
+        advisor.record("find", {"year": 2015, "genres": "Drama"}, explain)
+        advisor.record("find", {"year": 1999, "genres": "Comedy"}, explain)
+        recommendations = advisor.recommendations()
+        
+        if len(recommendations) != 1 or recommendations[0]["explained"] != 2:
+            print(f"❌ Familles de requêtes mal regroupées: {recommendations}")
+            return False
+        if recommendations[0]["index"] != [("year", 1), ("genres", 1)]:
+            print(f"❌ Index proposé incorrect: {recommendations[0]['index']}")
+            return False
+        
+        # explain() rejoue le pipeline réellement exécuté, borné par maxTimeMS
+        from config import PIPELINE_MAX_TIME_MS
+        from pipeline_optimizer import optimize_pipeline
+        commands = []
+        
+        class FakeDatabase:
+            def command(self, command):
+                commands.append(command)
+                return explain
+        
+        class FakeCollection:
+            name = "movies"
+            database = FakeDatabase()
+        
+        pipeline = [{"$unwind": "$directors"}, {"$match": {"year": 2015}},
+                    {"$group": {"_id": "$directors", "count": {"$sum": 1}}}]
+        IndexAdvisor(FakeCollection(), sample_rate=0, profile_path=None).explain("aggregate", pipeline)
+        explained = commands[0]["explain"]
+        if explained["pipeline"] != optimize_pipeline(pipeline).pipeline:
+            print(f"❌ explain() doit porter sur le pipeline optimisé: {explained['pipeline']}")
+            return False
+        if PIPELINE_MAX_TIME_MS and explained.get("maxTimeMS") != PIPELINE_MAX_TIME_MS:
+            print("❌ explain() sans maxTimeMS")
+            return False
+        
+        print("✅ Conseiller d'index fonctionnel")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur conseiller d'index: {e}")
+        return False
+
+def test_rollups():
+    """Test la réécriture des agrégations courantes vers les collections de cumul"""
+    print("\n📦 Test du routage vers les cumuls...")
+    
+    try:
+        from rollups import rewrite_for_rollup
+        
+        top_directors = rewrite_for_rollup("aggregate", [
+            {"$match": {"year": {"$gte": 2000, "$lte": 2015}}},
+            {"$unwind": "$directors"},
+            {"$group": {"_id": "$directors", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 5}
+        ])
+        if not top_directors or top_directors.rollup != "director_year":
+            print("❌ Top réalisateurs non servi par le cumul réalisateur/année")
+            return False
+        if top_directors.pipeline[1] != {"$group": {"_id": "$director", "count": {"$sum": "$count"}}}:
+            print(f"❌ $group mal réécrit: {top_directors.pipeline[1]}")
+            return False
+        
+        average = rewrite_for_rollup("aggregate", [
+            {"$match": {"year": 2015, "imdb.rating": {"$exists": True}}},
+            {"$group": {"_id": None, "avgRating": {"$avg": "$imdb.rating"}}}
+        ])
+        if not average or average.rollup != "year" or "avgRating" not in average.pipeline[-1]["$project"]:
+            print("❌ Note moyenne non servie par le cumul annuel")
+            return False
+        
+        cast_filter = rewrite_for_rollup("aggregate", [
+            {"$match": {"cast": "Tom Hanks"}}, {"$count": "total"}
+        ])
+        if cast_filter is not None:
+            print("❌ Un filtre hors dimensions des cumuls doit rester sur movies")
+            return False
+        
+        # Sans suivi des modifications, un cumul trop ancien n'est plus utilisé
+        import time
+        from rollups import ROLLUP_VERSION, RollupManager
+        
+        class FakeMeta:
+            def __init__(self, refreshed_at):
+                self.status = {"_id": "movies", "version": ROLLUP_VERSION, "refreshed_at": refreshed_at}
+            
+            def find_one(self, query):
+                return self.status
+        
+        count_2015 = [{"$match": {"year": 2015}}, {"$count": "total"}]
+        for age, routed in ((10, True), (7200, False)):
+            meta = FakeMeta(time.time() - age)
+            manager = RollupManager({"movies_rollups_meta": meta})
+            manager.max_age = 3600
+            if (manager.route("aggregate", count_2015) is not None) != routed:
+                print(f"❌ Cumul rafraîchi il y a {age} s {'non ' if routed else ''}utilisé")
+                return False
+        manager._watching = True
+        if manager.route("aggregate", count_2015) is None:
+            print("❌ Cumul suivi par les change streams ignoré")
+            return False
+        
+        print("✅ Routage vers les cumuls fonctionnel")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur routage des cumuls: {e}")
+        return False
+
+def test_serialization():
+    """Test la sérialisation des types BSON en JSON"""
+    print("\n🧬 Test de la sérialisation...")
+    
+    try:
+        import json
+        from datetime import datetime
+        from bson import ObjectId, Decimal128
+        from serialization import to_serializable, dumps_compact
+        from synthetic_movies import generate_movies
+        
+        object_id = ObjectId()
+        document = {
+            "_id": object_id,
+            "released": datetime(2015, 6, 1),
+            "imdb": {"rating": 7.5, "votes": 1200},
+            "genres": ["Drama", "Comedy"],
+            "tomatoes": {"dvd": datetime(2016, 1, 5), "price": Decimal128("9.99")},
+        }
+        serialized = to_serializable(document)
+        if serialized["_id"] != str(object_id) or serialized["released"] != "2015-06-01T00:00:00":
+            print(f"❌ ObjectId/datetime mal convertis: {serialized}")
+            return False
+        if serialized["tomatoes"] != {"dvd": "2016-01-05T00:00:00", "price": 9.99}:
+            print(f"❌ Documents imbriqués mal convertis: {serialized['tomatoes']}")
+            return False
+        
+        movies = generate_movies(50)
+        if json.loads(dumps_compact(movies)) != to_serializable(movies):
+            print("❌ dumps_compact et to_serializable divergent")
+            return False
+        
+        print("✅ Sérialisation fonctionnelle")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur sérialisation: {e}")
+        return False
+
+def test_pagination():
+    """Test les jetons de page et la reprise par clé de tri"""
+    print("\n📄 Test de la pagination...")
+    
+    try:
+        from bson import ObjectId
+        from pagination import encode_token, decode_token, page_order, range_filter
+        
+        pipeline = [
+            {"$group": {"_id": "$year", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 20}
+        ]
+        order = page_order(pipeline)
+        if order != [("count", -1), ("_id", 1)]:
+            print(f"❌ Ordre de pagination incorrect: {order}")
+            return False
+        if page_order([{"$match": {"year": 2015}}, {"$count": "total"}]) is not None:
+            print("❌ Un $count doit être paginé par $skip")
+            return False
+        projected = [
+            {"$match": {"year": 2015, "imdb.rating": {"$gt": 8}}},
+            {"$sort": {"imdb.rating": -1}},
+            {"$limit": 10},
+            {"$project": {"title": 1, "year": 1, "imdb.rating": 1}},
+        ]
+        if page_order(projected) != [("imdb.rating", -1), ("_id", 1)]:
+            print(f"❌ Un $project qui garde les clés de tri doit conserver l'ordre: {page_order(projected)}")
+            return False
+        projected[-1] = {"$project": {"title": 1, "year": 1}}
+        if page_order(projected) is not None:
+            print("❌ Un $project sans les clés de tri doit être paginé par $skip")
+            return False
+        
+        last_id = ObjectId()
+        token = encode_token("find", {"year": 2015}, {"after": [last_id]})
+        if decode_token(token, "find", {"year": 2015}) != {"after": [last_id]}:
+            print("❌ Jeton de page mal décodé")
+            return False
+        try:
+            decode_token(token, "find", {"year": 2016})
+            print("❌ Un jeton d'une autre requête doit être refusé")
+            return False
+        except ValueError:
+            pass
+        
+        if range_filter([("_id", 1)], [last_id]) != {"$or": [{"_id": {"$gt": last_id}}]}:
+            print("❌ Filtre de reprise incorrect")
+            return False
+        
+        print("✅ Pagination fonctionnelle")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur pagination: {e}")
+        return False
+
+def test_result_compactor():
+    """Test la compaction des résultats sous budget de tokens"""
+    print("\n🗜️ Test de la compaction des résultats...")
+    
+    try:
+        from result_compactor import compact_results, encode_rows
+        
+        rows = [{"_id": year, "avgRating": 6.5, "count": 100} for year in range(1950, 2016)]
+        encoded = encode_rows(rows)
+        if encoded.count("avgRating") != 1:
+            print("❌ Les noms de colonnes doivent n'apparaître qu'une fois")
+            return False
+        
+        summary = compact_results(rows[:10], "Note moyenne par décennie ?", budget=20)
+        if summary.mode != "résumé" or "- avgRating: min 6.50" not in summary.text:
+            print(f"❌ Résumé attendu au-delà du budget: {summary.mode}")
+            return False
+        
+        # Plus de 10 résultats sans demande complète : jamais plus long que l'aperçu historique
+        for results in (rows, [{"_id": f"Réalisateur {index}", "count": index} for index in range(120)]):
+            preview = compact_results(results, "Note moyenne par décennie ?")
+            if preview.savings_percent < 0 or preview.mode == "complet":
+                print(f"❌ Prompt plus long que l'aperçu historique: {preview.to_dict()}")
+                return False
+        
+        complete = compact_results(rows, "Note moyenne pour toutes les années ?", budget=50)
+        if summary.tokens >= complete.tokens:
+            print("❌ Le résumé doit être plus court que les lignes complètes")
+            return False
+        if complete.mode != "complet" or complete.text.count("\n") != len(rows) + 1:
+            print("❌ Une demande complète doit transmettre toutes les lignes")
+            return False
+        
+        print(f"✅ Compaction fonctionnelle ({complete.savings_percent:.0f} % économisés en mode complet)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur compaction: {e}")
+        return False
+
+def test_schema_inference():
+    """Test le résumé de schéma déduit d'un échantillon et son cache disque"""
+    print("\n🧬 Test de l'inférence de schéma...")
+    
+    try:
+        import tempfile
+        from synthetic_movies import generate_movies
+        from schema_inference import SchemaInferrer
+        
+        class SampleCollection:
+            full_name = "sample_mflix.movies"
+            
+            def __init__(self):
+                self.calls = 0
+            
+            def aggregate(self, pipeline):
+                self.calls += 1
+                return generate_movies(pipeline[0]["$sample"]["size"], seed=self.calls)
+        
+        cache_path = os.path.join(tempfile.mkdtemp(), "schema.json")
+        inferrer = SchemaInferrer(SampleCollection(), cache_path=cache_path, sample_size=200)
+        context = inferrer.get_context()
+        for expected in ("- imdb.rating: double", "- genres: array<string>", "- tomatoes.viewer.rating:"):
+            if expected not in context:
+                print(f"❌ Champ absent du résumé: {expected}")
+                return False
+        
+        # Nouvelle session : relu depuis le disque, sans échantillonnage
+        reloaded = SchemaInferrer(SampleCollection(), cache_path=cache_path, sample_size=200)
+        if reloaded.get_context() != context or reloaded.collection.calls:
+            print("❌ Le résumé en cache doit être réutilisé")
+            return False
+        # Même structure sur un autre échantillon : texte inchangé (cache des traductions conservé)
+        reloaded.build()
+        if reloaded.get_context() != context:
+            print("❌ Le texte du résumé doit rester stable à structure identique")
+            return False
+        
+        print(f"✅ Schéma déduit (~{len(context) // 4} tokens) et mis en cache")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur inférence de schéma: {e}")
+        return False
+
+def test_example_store():
+    """Test la sélection des exemples de traduction par similarité (BM25)"""
+    print("\n📚 Test du magasin d'exemples...")
+    
+    try:
+        import tempfile
+        from example_store import ExampleStore
+        
+        path = os.path.join(tempfile.mkdtemp(), "examples.jsonl")
+        store = ExampleStore(path=path, k=2)
+        selected = store.select("Quels films avec Brad Pitt sont les mieux notés ?")
+        if not selected or len(selected) > 2 or "cast" not in str(selected):
+            print(f"❌ Exemples sélectionnés inattendus: {selected}")
+            return False
+        if store.render("bonjour") != "":
+            print("❌ Aucun exemple attendu pour une question sans rapport")
+            return False
+        
+        pipeline = [{"$match": {"languages": "Japanese"}}, {"$count": "total"}]
+        if not store.add("Combien de films en japonais ?", "aggregate", pipeline):
+            print("❌ Traduction validée non enregistrée")
+            return False
+        if store.add("combien de films en japonais", "aggregate", pipeline):
+            print("❌ Une question déjà connue ne doit pas être dupliquée")
+            return False
+        
+        reloaded = ExampleStore(path=path, k=1)
+        if reloaded.select("Combien de films japonais dans la base ?")[0]["mongodb_query"] != pipeline:
+            print("❌ Exemple enregistré non retrouvé après rechargement")
+            return False
+        
+        # Au-delà de max_entries, les traductions les plus anciennes laissent leur place
+        rotating_path = os.path.join(tempfile.mkdtemp(), "examples.jsonl")
+        rotating = ExampleStore(path=rotating_path, k=1, max_entries=2)
+        for country in ("Mexico", "Brazil", "Norway", "Egypt", "Chile"):
+            if not rotating.add(f"Combien de films du pays {country} ?", "aggregate",
+                                [{"$match": {"countries": country}}, {"$count": "total"}]):
+                print(f"❌ Traduction refusée une fois le plafond atteint: {country}")
+                return False
+        learned = [example["question"] for example in rotating.examples[rotating._seeds:]]
+        if learned != ["Combien de films du pays Egypt ?", "Combien de films du pays Chile ?"]:
+            print(f"❌ Rotation incorrecte: {learned}")
+            return False
+        if rotating.select("films du pays Mexico")[0]["question"].endswith("Mexico ?"):
+            print("❌ Exemple retiré encore présent dans l'index")
+            return False
+        with open(rotating_path, encoding="utf-8") as f:
+            lines = f.readlines()
+        compacted = ExampleStore(path=rotating_path, max_entries=2)
+        if len(lines) > 4 or [example["question"] for example in compacted.examples[compacted._seeds:]] != learned:
+            print(f"❌ Fichier d'exemples non compacté ({len(lines)} lignes)")
+            return False
+        
+        print(f"✅ Sélection BM25 fonctionnelle ({len(reloaded.examples)} exemples)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur magasin d'exemples: {e}")
+        return False
+
+def test_benchmark_harness():
+    """Test le serveur Perplexity simulé et le calcul des percentiles du benchmark"""
+    print("\n⏱️ Test du banc de mesure hors ligne...")
+    
+    try:
+        from bench_e2e import FakePerplexityServer, percentile
+        from perplexity_service import PerplexityService
+        
+        if percentile([1, 2, 3, 4, 5], 50) != 3 or percentile([10, 20], 95) != 19.5:
+            print("❌ Percentiles incorrects")
+            return False
+        
+        recorded = {"Films avec Tom Hanks": {"query_type": "find", "mongodb_query": {"cast": "Tom Hanks"},
+                                              "explanation": "test", "estimated_results": "Films"}}
+        server = FakePerplexityServer(recorded).start()
+        try:
+            service = PerplexityService(api_url=server.url)
+            service.query_cache = None
+            query_info = service.generate_mongodb_query("Films avec Tom Hanks ?", "")
+        finally:
+            server.stop()
+        if query_info.get("mongodb_query") != {"cast": "Tom Hanks"} or server.requests != 1:
+            print(f"❌ Réponse enregistrée non rejouée: {query_info}")
+            return False
+        
+        print("✅ Banc de mesure fonctionnel")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur banc de mesure: {e}")
+        return False
+
+def test_telemetry():
+    """Test les traces par étape et l'exposition des métriques au format Prometheus"""
+    print("\n📡 Test de la télémétrie...")
+    
+    try:
+        import telemetry
+        
+        # Compteurs partagés du processus : d'autres tests ont pu enregistrer des erreurs de formatage
+        format_errors = telemetry.registry.value("mbot_errors_total", stage="format")
+        retries = telemetry.registry.value("mbot_llm_retries_total", call="generate")
+        prompt_tokens = telemetry.registry.value("mbot_llm_tokens_total", call="generate", kind="prompt")
+        trace = telemetry.start_trace("question")
+        with telemetry.span("intent"):
+            pass
+        telemetry.record_span("execute", 12.5, documents=3)
+        try:
+            with telemetry.span("format"):
+                raise ValueError("test")
+        except ValueError:
+            pass
+        telemetry.record_cache("query", True)
+        telemetry.record_llm_call("generate", {"attempts": 3}, {"prompt_tokens": 120, "completion_tokens": 40})
+        telemetry.finish_trace(trace)
+        
+        if [name for name, _ in trace.breakdown()] != ["intent", "execute", "format"]:
+            print(f"❌ Étapes de la trace inattendues: {trace.breakdown()}")
+            return False
+        if telemetry.current_trace() is not None or trace.duration_ms is None:
+            print("❌ La trace doit être close")
+            return False
+        
+        if telemetry.registry.value("mbot_errors_total", stage="format") != format_errors + 1:
+            print("❌ Erreur de l'étape format non comptée")
+            return False
+        if telemetry.registry.value("mbot_llm_retries_total", call="generate") != retries + 2 or \
+                telemetry.registry.value("mbot_llm_tokens_total", call="generate", kind="prompt") != prompt_tokens + 120:
+            print("❌ Tentatives ou tokens de l'appel generate non comptés")
+            return False
+        
+        metrics = telemetry.registry.render()
+        for expected in ('mbot_stage_duration_seconds_count{stage="execute"}',
+                         'mbot_errors_total{stage="format"}',
+                         'mbot_llm_retries_total{call="generate"}',
+                         'mbot_llm_tokens_total{call="generate",kind="prompt"}',
+                         'mbot_cache_requests_total{cache="query",result="hit"}'):
+            if expected not in metrics:
+                print(f"❌ Métrique absente: {expected}")
+                return False
+        
+        with telemetry._recent_lock:
+            recent = len(telemetry._recent_traces)
+        if telemetry.recent_percentile(99, min_samples=recent + 1) is not None:
+            print("❌ Pas de p99 avec trop peu de traces récentes")
+            return False
+        if recent and telemetry.recent_percentile(99, min_samples=recent) is None:
+            print("❌ p99 attendu avec assez de traces récentes")
+            return False
+        
+        print("✅ Télémétrie fonctionnelle")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur télémétrie: {e}")
+        return False
+
+def test_stats_service():
+    """Test le cache des statistiques de collection et son indicateur de fraîcheur"""
+    print("\n📊 Test du service de statistiques...")
+    
+    try:
+        import time
+        from stats_service import CollectionStatsService
+        
+        class StatsDatabase:
+            def __init__(self):
+                self.commands = 0
+            
+            def __getitem__(self, name):
+                return self
+            
+            def estimated_document_count(self):
+                self.commands += 1
+                return 21349
+            
+            def count_documents(self, query):
+                raise AssertionError("count_documents ne doit plus être appelé")
+            
+            def command(self, name, collection):
+                self.commands += 1
+                return {"size": 32 * 1024 * 1024, "avgObjSize": 1500, "indexSizes": {"_id_": 1, "year_1": 1}}
+        
+        db = StatsDatabase()
+        service = CollectionStatsService(db, "movies", refresh_interval=60)
+        first = service.get()
+        for _ in range(5):
+            stats = service.get()
+        if db.commands != 2 or stats["total_documents"] != 21349 or stats["stale"]:
+            print(f"❌ Les reruns doivent être servis par le cache ({db.commands} commandes)")
+            return False
+        
+        service._refreshed_at -= 120
+        if not service.get()["stale"]:
+            print("❌ Des statistiques anciennes doivent être signalées")
+            return False
+        time.sleep(0.2)
+        if db.commands != 4 or service.get()["stale"]:
+            print("❌ Le rafraîchissement de fond n'a pas eu lieu")
+            return False
+        
+        print(f"✅ Statistiques en cache ({first['indexes']} index, {first['size_mb']} Mo)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur service de statistiques: {e}")
+        return False
+
+def test_warmup():
+    """Test les réponses précalculées et le préchargement des questions connues"""
+    print("\n🔥 Test du préchargement...")
+    
+    try:
+        import time
+        from warmup import WarmupManager
+        from query_cache import normalize_question
+        
+        class WarmupPerplexity:
+            example_store = None
+            
+            def __init__(self):
+                self.calls = []
+            
+            def generate_mongodb_query(self, question, schema_context):
+                self.calls.append(question)
+                return {"query_type": "aggregate", "mongodb_query": [{"$count": "total"}], "explanation": "Comptage"}
+            
+            def format_results(self, results, question):
+                return f"{results[0]['total']} films"
+        
+        class WarmupMongo:
+            def execute_query(self, query_type, mongodb_query):
+                return [{"total": 3}]
+        
+        questions = [
+            "Combien de films sont sortis entre 2012 et 2014 ?",
+            "Combien de films sont sortis en 2015 ?",
+        ]
+        perplexity = WarmupPerplexity()
+        manager = WarmupManager(perplexity, WarmupMongo(), questions=questions[:1], interval=60)
+        if manager.warm() != 1 or manager.get("combien de films sont sortis entre 2012 et 2014")["formatted_response"] != "3 films":
+            print("❌ La réponse de l'exemple doit être précalculée")
+            return False
+        
+        manager.questions = questions
+        queued = manager.prefetch("Combien de films")
+        for _ in range(50):
+            if manager.get(questions[1]):
+                break
+            time.sleep(0.02)
+        if queued != [questions[1]] or not manager.get(questions[1]) or manager.prefetch("Combien"):
+            print(f"❌ Préchargement inattendu: {queued}")
+            return False
+        
+        manager._answers[normalize_question(questions[0])]["computed_at"] -= 121
+        if manager.get(questions[0]) is not None:
+            print("❌ Une réponse expirée ne doit plus être servie")
+            return False
+        
+        print(f"✅ Préchargement fonctionnel ({len(perplexity.calls)} traductions)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur préchargement: {e}")
+        return False
+
+def test_batch_runner():
+    """Test le traitement par lots : déduplication, parallélisme et reprise"""
+    print("\n📦 Test du traitement par lots...")
+    
+    try:
+        import tempfile
+        import time
+        from batch_runner import run_batch
+        
+        class BatchPerplexity:
+            def __init__(self):
+                self.calls = []
+                self.fail = {"combien de films en 2003"}
+            
+            def generate_mongodb_query(self, question, schema_context):
+                self.calls.append(question)
+                time.sleep(0.05)
+                if question.lower().rstrip(" ?") in self.fail:
+                    return {"query_type": "error", "mongodb_query": {}, "explanation": "Erreur API Perplexity: 503"}
+                return {"query_type": "find", "mongodb_query": {"year": 2000}, "explanation": "Films"}
+            
+            def record_success(self, question, query_info, results):
+                pass
+            
+            def format_results(self, results, question):
+                return f"{len(results)} films"
+        
+        class BatchMongo:
+            def execute_query(self, query_type, mongodb_query):
+                return [{"title": "Gladiator", "year": 2000}]
+        
+        questions = [f"Combien de films en {year} ?" for year in range(2000, 2008)]
+        questions += ["combien de films en 2000", "Combien de  films en 2001 ?"]
+        perplexity = BatchPerplexity()
+        with tempfile.TemporaryDirectory() as directory:
+            output = f"{directory}/batch.jsonl"
+            summary = run_batch(questions, output, concurrency=4, perplexity_service=perplexity,
+                                mongodb_service=BatchMongo(), schema_context="")
+            if summary["unique"] != 8 or len(perplexity.calls) != 8 or summary["errors"] != 1:
+                print(f"❌ Déduplication incorrecte: {summary}")
+                return False
+            if summary["duration_s"] > 0.05 * 8 * 0.75:
+                print(f"❌ Les questions doivent être traitées en parallèle ({summary['duration_s']} s)")
+                return False
+            
+            perplexity.fail = set()
+            resumed = run_batch(questions, output, concurrency=4, perplexity_service=perplexity,
+                                mongodb_service=BatchMongo(), schema_context="")
+            with open(output, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+            if resumed["skipped"] != 7 or resumed["processed"] != 1 or len(lines) != 9:
+                print(f"❌ La reprise doit ne retraiter que la question en erreur: {resumed}")
+                return False
+        
+        print(f"✅ Traitement par lots fonctionnel ({summary['questions_per_minute']:.0f} questions/min)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur traitement par lots: {e}")
+        return False
+
+def test_singleflight():
+    """Test le regroupement des appels identiques simultanés"""
+    print("\n🛬 Test du regroupement d'appels...")
+    
+    try:
+        import threading
+        import time
+        from singleflight import SingleFlight, SingleFlightTimeout
+        from bench_e2e import FakePerplexityServer
+        from perplexity_service import PerplexityService
+        
+        flight = SingleFlight(timeout=5)
+        calls = []
+        
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return {"rows": 3}
+        
+        def run_concurrently(target, count=8):
+            outcomes = []
+            threads = [threading.Thread(target=lambda: outcomes.append(target())) for _ in range(count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return outcomes
+        
+        results = run_concurrently(lambda: flight.do(("execute", "q1"), compute))
+        if len(calls) != 1 or any(result is not results[0] for result in results):
+            print(f"❌ Un seul calcul attendu pour 8 appels identiques ({len(calls)})")
+            return False
+        
+        def failing():
+            time.sleep(0.1)
+            raise ValueError("aggregation failed")
+        
+        def capture_error():
+            try:
+                flight.do(("execute", "q2"), failing)
+            except ValueError as e:
+                return str(e)
+        if set(run_concurrently(capture_error, 4)) != {"aggregation failed"}:
+            print("❌ L'erreur du meneur doit être transmise aux appels regroupés")
+            return False
+        
+        leader = threading.Thread(target=lambda: flight.do(("format", "q3"), lambda: time.sleep(0.3)))
+        leader.start()
+        time.sleep(0.05)
+        try:
+            flight.do(("format", "q3"), compute, timeout=0.05)
+            print("❌ L'attente d'un appel regroupé doit être bornée")
+            return False
+        except SingleFlightTimeout:
+            pass
+        leader.join()
+        
+        def produce():
+            calls.append(1)
+            for chunk in ["Voici ", "la ", "réponse"]:
+                time.sleep(0.05)
+                yield chunk
+        
+        calls.clear()
+        streams = run_concurrently(lambda: "".join(flight.stream(("format_stream", "q4"), produce)), 4)
+        if set(streams) != {"Voici la réponse"} or len(calls) != 1 or flight.in_flight():
+            print(f"❌ Flux partagé incorrect: {streams}")
+            return False
+        
+        server = FakePerplexityServer({}, latency_ms=150).start()
+        try:
+            service = PerplexityService(api_url=server.url)
+            service.query_cache = None
+            answers = run_concurrently(lambda: service.generate_mongodb_query("Quels films lien partagé xyz ?", ""), 6)
+        finally:
+            server.stop()
+        if server.requests != 1 or len({answer["query_type"] for answer in answers}) != 1:
+            print(f"❌ Une seule traduction attendue pour 6 sessions ({server.requests} appels)")
+            return False
+        
+        print("✅ Regroupement d'appels fonctionnel (1 appel pour 6 sessions)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur regroupement d'appels: {e}")
+        return False
+
+def test_rate_limiter():
+    """Test le limiteur de débit : priorités, quotas, AIMD et délai d'attente"""
+    print("\n🚦 Test du limiteur de débit...")
+    
+    try:
+        import threading
+        import time
+        import telemetry
+        from rate_limiter import (
+            RateLimiter, RateLimitTimeout, PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_BACKGROUND
+        )
+        
+        limiter = RateLimiter(requests_per_minute=0, initial_concurrency=1, max_concurrency=4)
+        held = limiter.acquire()
+        admitted = []
+        
+        def call(name, priority):
+            permit = limiter.acquire(priority=priority)
+            admitted.append(name)
+            permit.release(200)
+        
+        threads = []
+        for name, priority in (("background", PRIORITY_BACKGROUND), ("batch", PRIORITY_BATCH),
+                               ("interactive", PRIORITY_INTERACTIVE)):
+            threads.append(threading.Thread(target=call, args=(name, priority)))
+            threads[-1].start()
+            time.sleep(0.05)
+        depth = limiter.stats()["queue_depth"]
+        held.release(200)
+        for thread in threads:
+            thread.join()
+        if admitted != ["interactive", "batch", "background"] or depth != {"interactive": 1, "batch": 1, "background": 1}:
+            print(f"❌ Ordre d'admission incorrect: {admitted} (file {depth})")
+            return False
+        
+        limiter.concurrency_limit = 1
+        try:
+            blocker = limiter.acquire()
+            limiter.acquire(timeout=0.05)
+            print("❌ L'attente dans la file doit être bornée")
+            return False
+        except RateLimitTimeout:
+            blocker.release(200)
+        
+        limiter = RateLimiter(requests_per_minute=600, initial_concurrency=4, max_concurrency=8)
+        limiter.requests.level = 0
+        started = time.perf_counter()
+        limiter.acquire().release(200)
+        waited = time.perf_counter() - started
+        if not 0.05 < waited < 0.5:
+            print(f"❌ Le quota de requêtes doit espacer les appels ({waited:.2f} s)")
+            return False
+        
+        limiter.acquire().release(429, retry_after=0.2)
+        throttled = limiter.stats()
+        if throttled["concurrency_limit"] != 2 or throttled["paused_for_s"] <= 0:
+            print(f"❌ Un 429 doit réduire la concurrence et suspendre les appels: {throttled}")
+            return False
+        for _ in range(6):
+            limiter.acquire().release(200)
+        if limiter.stats()["concurrency_limit"] <= 2:
+            print("❌ La concurrence doit remonter après des appels réussis")
+            return False
+        
+        if "mbot_llm_queue_depth" not in telemetry.registry.render():
+            print("❌ La profondeur de file doit être exportée")
+            return False
+        
+        print(f"✅ Limiteur de débit fonctionnel (concurrence {limiter.stats()['concurrency_limit']})")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur limiteur de débit: {e}")
+        return False
+
+def test_columnar_engine():
+    """Test le moteur colonnaire en mémoire et son repli sur MongoDB"""
+    print("\n🧮 Test du moteur colonnaire...")
+    
+    try:
+        from collections import Counter
+        from columnar_engine import ColumnarSnapshot, ColumnarEngine, run_pipeline, results_equivalent
+        from synthetic_movies import generate_movies
+        
+        movies = generate_movies(500)
+        snapshot = ColumnarSnapshot(movies)
+        
+        genres = Counter(genre for movie in movies if movie["year"] >= 2000 for genre in movie.get("genres", []))
+        pipeline = [
+            {"$match": {"year": {"$gte": 2000}}},
+            {"$unwind": "$genres"},
+            {"$group": {"_id": "$genres", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 5},
+        ]
+        expected = [{"_id": genre, "count": count} for genre, count in genres.most_common(5)]
+        if not results_equivalent(expected, run_pipeline(snapshot, pipeline), ["count"]):
+            print("❌ Genres les plus fréquents incorrects")
+            return False
+        
+        rated = [movie["imdb"]["rating"] for movie in movies
+                 if movie["year"] == 2010 and isinstance(movie.get("imdb", {}).get("rating"), (int, float))]
+        pipeline = [{"$match": {"year": 2010}}, {"$group": {"_id": None, "avg": {"$avg": "$imdb.rating"},
+                                                            "films": {"$sum": 1}}}]
+        result = run_pipeline(snapshot, pipeline)
+        if abs(result[0]["avg"] - sum(rated) / len(rated)) > 1e-9 or \
+                result[0]["films"] != sum(1 for movie in movies if movie["year"] == 2010):
+            print(f"❌ Moyenne incorrecte: {result}")
+            return False
+        
+        # Clés composées triées champ par champ, nombres comparés comme des nombres
+        compound = run_pipeline(ColumnarSnapshot([{"year": 2000, "genres": ["Action"]},
+                                                  {"year": 999, "genres": ["Western"]},
+                                                  {"year": 2000, "genres": ["Drama"]}]), [
+            {"$unwind": "$genres"},
+            {"$group": {"_id": {"year": "$year", "genre": "$genres"}, "films": {"$sum": 1}}},
+            {"$sort": {"_id": 1}},
+        ])
+        if [row["_id"] for row in compound] != [{"year": 999, "genre": "Western"}, {"year": 2000, "genre": "Action"},
+                                                {"year": 2000, "genre": "Drama"}]:
+            print(f"❌ Tri sur une clé composée incorrect: {compound}")
+            return False
+        
+        # Hors sous-ensemble : None, MongoDB exécute le pipeline
+        class Collection:
+            def find(self, query, projection):
+                return iter(movies)
+        
+        engine = ColumnarEngine(Collection())
+        engine.refresh()
+        if engine.execute([{"$match": {"year": 2010}}, {"$sort": {"title": 1}}]) is not None:
+            print("❌ Un pipeline retournant des documents doit retomber sur MongoDB")
+            return False
+        if engine.execute([{"$count": "total"}]) != [{"total": 500}] or engine.stats()["fallbacks"] != 1:
+            print(f"❌ Statistiques du moteur incorrectes: {engine.stats()}")
+            return False
+        
+        print(f"✅ Moteur colonnaire ({snapshot.size} films, repli: {engine.last_fallback_reason})")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur moteur colonnaire: {e}")
+        return False
+
+def test_conversation():
+    """Test la modification locale de la requête précédente par les questions de suivi"""
+    print("\n💬 Test des questions de suivi...")
+    
+    try:
+        from conversation import Conversation
+        from intent_engine import match_intent
+        
+        conversation = Conversation()
+        question = "Quelle est la note moyenne des films parus en 2015 ?"
+        conversation.record(question, match_intent(question))
+        
+        follow_up = conversation.follow_up("Et pour 2016 ?")
+        if follow_up is None or follow_up.method != "intent" or \
+                follow_up.query_info["mongodb_query"][0]["$match"]["year"] != 2016:
+            print("❌ « Et pour 2016 ? » doit reconstruire la requête de l'intention")
+            return False
+        if not follow_up.question.startswith(question):
+            print("❌ La question de suivi doit être complétée par la question précédente")
+            return False
+        
+        pipeline = [
+            {"$match": {"year": 2015, "countries": "France"}},
+            {"$unwind": "$genres"},
+            {"$group": {"_id": "$genres", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 5},
+        ]
+        conversation.record("Genres les plus fréquents des films français de 2015",
+                            {"query_type": "aggregate", "mongodb_query": pipeline, "explanation": "Top genres"})
+        follow_up = conversation.follow_up("et seulement les drames, les 10 premiers")
+        patched = follow_up.query_info["mongodb_query"] if follow_up and follow_up.query_info else None
+        if follow_up.method != "patch" or patched[0]["$match"] != {"year": 2015, "countries": "France", "genres": "Drama"} \
+                or patched[-1] != {"$limit": 10} or pipeline[-1] != {"$limit": 5}:
+            print(f"❌ Pipeline mal modifié: {patched}")
+            return False
+        
+        if conversation.follow_up("et seulement les drames italiens").method != "llm":
+            print("❌ Un critère non reconnu avec un paramètre modifié doit être confié au LLM")
+            return False
+        # Critère non reconnu après un marqueur de continuation : modifié par le LLM avec la requête précédente
+        for continuation in ["et seulement les films français ?", "et avec Tom Hanks ?", "et pour les films italiens ?"]:
+            resolved = conversation.follow_up(continuation)
+            if resolved is None or resolved.method != "llm":
+                print(f"❌ « {continuation} » doit être confiée au LLM avec la requête précédente")
+                return False
+        since = conversation.follow_up("et depuis 2010 ?")
+        if since is None or since.changes != {"year_range": (2010, 2100)} or \
+                since.query_info["mongodb_query"][0]["$match"]["year"] != {"$gte": 2010, "$lte": 2100}:
+            print(f"❌ « et depuis 2010 ? » mal traduit: {since and since.changes}")
+            return False
+        if conversation.follow_up("pour 2016 ?") is None:
+            print("❌ Une question réduite à un paramètre est une question de suivi")
+            return False
+        for independent in ["Quels sont les 10 genres les plus fréquents ?", "En quelle année est sorti Titanic ?",
+                            "De quels pays viennent les films ?", "Qu'est-ce qu'un film noir ?",
+                            "Depuis 2010, quel genre domine ?", "et alors ?"]:
+            if conversation.follow_up(independent) is not None:
+                print(f"❌ « {independent} » ne doit pas être traitée comme un suivi")
+                return False
+        
+        print(f"✅ Questions de suivi ({follow_up.describe()})")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur questions de suivi: {e}")
+        return False
+
 def main():
     """Fonction principale de test"""
     print("🎬 Test du Chatbot Analytique MongoDB Movies")
@@ -138,6 +1645,31 @@ def main():
         test_environment,
         test_imports,
         test_schema_loading,
+        test_query_cache,
+        test_result_cache,
+        test_mongo_pool,
+        test_http_transport,
+        test_async_pipeline,
+        test_sse_decoding,
+        test_local_formatter,
+        test_intent_engine,
+        test_pipeline_optimizer,
+        test_index_advisor,
+        test_rollups,
+        test_serialization,
+        test_pagination,
+        test_result_compactor,
+        test_schema_inference,
+        test_example_store,
+        test_benchmark_harness,
+        test_telemetry,
+        test_stats_service,
+        test_warmup,
+        test_batch_runner,
+        test_singleflight,
+        test_rate_limiter,
+        test_columnar_engine,
+        test_conversation,
         test_perplexity_api,
         test_mongodb_connection
     ]
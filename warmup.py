@@ -0,0 +1,187 @@
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+from config import (
+    EXAMPLE_QUESTIONS, WARMUP_ENABLED, WARMUP_INTERVAL, PREFETCH_MIN_PREFIX, PREFETCH_MAX_CANDIDATES
+)
+from query_cache import normalize_question
+from rate_limiter import PRIORITY_BACKGROUND, request_priority
+
+
+class WarmupManager:
+    """
+    Réponses complètes précalculées (requête, résultats, texte formaté)
+
+    Les questions d'exemple sont traitées au démarrage puis toutes les
+    WARMUP_INTERVAL secondes dans un thread de fond. Pendant la saisie,
+    les questions connues (exemples et traductions réussies) qui commencent
+    par le texte tapé sont calculées par anticipation. Une réponse sert
+    toutes les sessions du processus jusqu'à son expiration.
+    """
+
+    def __init__(self, perplexity_service, mongodb_service, schema_context: str = "",
+                 questions: Optional[List[str]] = None, interval: int = WARMUP_INTERVAL):
+        self.perplexity_service = perplexity_service
+        self.mongodb_service = mongodb_service
+        self.schema_context = schema_context
+        self.questions = list(questions if questions is not None else EXAMPLE_QUESTIONS)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._answers: Dict[str, Dict] = {}
+        self._pending = set()
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=20)
+        self._worker = None
+        self._scheduler_started = False
+
+    def _ttl(self) -> float:
+        # Une réponse reste valable jusqu'au recalcul suivant (avec une marge)
+        return 2 * self.interval if self.interval > 0 else float("inf")
+
+    def compute(self, question: str) -> Optional[Dict]:
+        """Traite une question de bout en bout et conserve la réponse si elle a des résultats"""
+        # Appels LLM derrière les questions posées dans l'interface
+        with request_priority(PRIORITY_BACKGROUND):
+            return self._compute(question)
+
+    def _compute(self, question: str) -> Optional[Dict]:
+        query_info = self.perplexity_service.generate_mongodb_query(question, self.schema_context)
+        query_type = query_info.get("query_type")
+        if query_type not in ("find", "aggregate"):
+            return None
+        mongodb_query = query_info.get("mongodb_query", {})
+        results = self.mongodb_service.execute_query(query_type, mongodb_query)
+        if not results:
+            return None
+        formatted_response = self.perplexity_service.format_results(results, question)
+        if formatted_response.startswith("Erreur lors du formatage"):
+            return None
+        answer = {
+            "question": question,
+            "query_info": query_info,
+            "results": results,
+            "formatted_response": formatted_response,
+            "computed_at": time.time(),
+        }
+        with self._lock:
+            self._answers[normalize_question(question)] = answer
+        return answer
+
+    def get(self, question: str) -> Optional[Dict]:
+        """Réponse précalculée pour cette question, ou None"""
+        key = normalize_question(question)
+        with self._lock:
+            answer = self._answers.get(key)
+            if answer and time.time() - answer["computed_at"] > self._ttl():
+                del self._answers[key]
+                return None
+            return answer
+
+    def warm(self, questions: Optional[List[str]] = None) -> int:
+        """Calcule les réponses des questions (exemples par défaut) ; retourne le nombre de réponses"""
+        computed = 0
+        for question in questions or self.questions:
+            try:
+                if self.compute(question):
+                    computed += 1
+            except Exception as e:
+                print(f"Erreur lors du préchargement de « {question} »: {e}")
+        return computed
+
+    def start(self):
+        """Précharge les exemples maintenant puis à intervalle régulier (thread de fond)"""
+        with self._lock:
+            if self._scheduler_started:
+                return
+            self._scheduler_started = True
+        threading.Thread(target=self._schedule_loop, name="warmup", daemon=True).start()
+
+    def _schedule_loop(self):
+        while True:
+            self.warm()
+            if self.interval <= 0:
+                return
+            time.sleep(self.interval)
+
+    def candidates(self, prefix: str) -> List[str]:
+        """Questions connues qui prolongent le texte saisi, les plus courtes d'abord"""
+        typed = normalize_question(prefix)
+        if len(typed) < PREFETCH_MIN_PREFIX:
+            return []
+        known = list(self.questions)
+        example_store = getattr(self.perplexity_service, "example_store", None)
+        if example_store:
+            known.extend(example["question"] for example in example_store.examples)
+        matches = {}
+        for question in known:
+            key = normalize_question(question)
+            if key.startswith(typed) and key not in matches:
+                matches[key] = question
+        return sorted(matches.values(), key=len)[:PREFETCH_MAX_CANDIDATES]
+
+    def prefetch(self, prefix: str) -> List[str]:
+        """
+        Calcule par anticipation les questions connues commençant par prefix
+
+        Returns:
+            Questions mises en file (déjà calculées ou en cours exclues)
+        """
+        queued = []
+        for question in self.candidates(prefix):
+            key = normalize_question(question)
+            with self._lock:
+                if key in self._pending or key in self._answers:
+                    continue
+                self._pending.add(key)
+            try:
+                self._queue.put_nowait(question)
+                queued.append(question)
+            except queue.Full:
+                with self._lock:
+                    self._pending.discard(key)
+        if queued:
+            self._ensure_worker()
+        return queued
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._prefetch_loop, name="prefetch", daemon=True)
+                self._worker.start()
+
+    def _prefetch_loop(self):
+        while True:
+            question = self._queue.get()
+            try:
+                self.compute(question)
+            except Exception as e:
+                print(f"Erreur lors du préchargement de « {question} »: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(normalize_question(question))
+
+
+_shared_warmup = None
+_shared_warmup_lock = threading.Lock()
+
+
+def get_warmup_manager(schema_context: Optional[str] = None) -> Optional[WarmupManager]:
+    """
+    Retourne le gestionnaire de préchargement partagé du processus
+
+    Créé au premier appel avec ses propres services (clients MongoDB et
+    HTTP partagés) ; le préchargement des exemples démarre aussitôt.
+
+    Returns:
+        WarmupManager, ou None si le préchargement est désactivé
+    """
+    global _shared_warmup
+    if not WARMUP_ENABLED:
+        return None
+    with _shared_warmup_lock:
+        if _shared_warmup is None and schema_context is not None:
+            from mongodb_service import MongoDBService
+            from perplexity_service import PerplexityService
+            _shared_warmup = WarmupManager(PerplexityService(), MongoDBService(), schema_context)
+            _shared_warmup.start()
+        return _shared_warmup